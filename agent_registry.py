@@ -0,0 +1,87 @@
+import copy
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Optional
+
+from autogen import ConversableAgent, OpenAIWrapper
+
+
+def clone_agent(prototype: ConversableAgent) -> ConversableAgent:
+    """
+    Make a per-session copy of a prebuilt agent.
+
+    The copy shares everything that is read-only after construction (LLM client,
+    tool schemas, function map, system message text) with the prototype and gets
+    fresh conversation state: histories, counters, reply functions and hooks.
+    """
+    agent = copy.copy(prototype)
+    agent._oai_messages = defaultdict(list)
+    agent._oai_system_message = [dict(message) for message in prototype._oai_system_message]
+    agent._consecutive_auto_reply_counter = defaultdict(int)
+    # bound to the clone, not the prototype, so per-session overrides apply
+    agent._max_consecutive_auto_reply_dict = defaultdict(agent.max_consecutive_auto_reply)
+    agent._reply_func_list = [dict(reply_func) for reply_func in prototype._reply_func_list]
+    agent._human_input = []
+    agent.reply_at_receive = defaultdict(bool)
+    agent.hook_lists = {name: list(hooks) for name, hooks in prototype.hook_lists.items()}
+    agent.client_cache = None
+    if isinstance(prototype._code_execution_config, dict):
+        agent._code_execution_config = dict(prototype._code_execution_config)
+    return agent
+
+
+class AgentTemplate:
+    """A prebuilt agent that sessions instantiate with clone_agent."""
+
+    def __init__(self, prototype: ConversableAgent):
+        self.prototype = prototype
+
+    @property
+    def name(self) -> str:
+        return self.prototype.name
+
+    def instantiate(self) -> ConversableAgent:
+        return clone_agent(self.prototype)
+
+
+class AgentTemplateRegistry:
+    """
+    Process-level registry of agent templates. Tool schemas, system messages and
+    LLM clients are built once when the registry is populated; each session only
+    pays for the per-session state of its agents.
+    """
+
+    def __init__(self, manager_llm_config: Optional[Dict] = None):
+        self._templates: Dict[str, AgentTemplate] = {}
+        self.manager_llm_config = manager_llm_config or False
+        self.manager_client = OpenAIWrapper(**manager_llm_config) if manager_llm_config else None
+
+    def add(self, prototype: ConversableAgent) -> AgentTemplate:
+        template = AgentTemplate(prototype)
+        self._templates[template.name] = template
+        return template
+
+    def instantiate(self, name: str) -> ConversableAgent:
+        return self._templates[name].instantiate()
+
+    def attach_manager_llm(self, manager: ConversableAgent):
+        """Give a per-session group chat manager the shared speaker-selection LLM config and client."""
+        manager.llm_config = self.manager_llm_config
+        manager.client = self.manager_client
+
+    def names(self):
+        return list(self._templates)
+
+
+_registry: Optional[AgentTemplateRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_agent_registry(factory: Callable[[], AgentTemplateRegistry]) -> AgentTemplateRegistry:
+    """Return the process-wide registry, building it with factory on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = factory()
+    return _registry
@@ -1,131 +1,172 @@
-from autogen import ConversableAgent, UserProxyAgent, AssistantAgent, register_function
-from azure.identity import ClientSecretCredential
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
 import os
-from datetime import datetime, timedelta
-import requests
-import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from database.db import get_db
-from database.db import Base, engine
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 import json
+import math
+from typing import Annotated
+from search_cache import get_search_cache
+from search_postprocess import postprocess_results
+from product_index import local_results
+from metrics import TOOL_CALLS, TOOL_SECONDS
 # from gauge_reader import gauge_reader
 from dotenv import load_dotenv
 load_dotenv()
 
-SQLITE_DB_PATH = os.path.join(os.getcwd(),"new_db.db")
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{SQLITE_DB_PATH}"
-
-# Create an SQLite engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Required for SQLite with SQLAlchemy
-)
-
-llm_config = [
-    {
-        "model": "GPT4",
-        "api_key": os.getenv("APIKEY"),
-        "base_url": os.getenv("BASEURL"),
-        "api_type": "azure",
-        "api_version": "2024-02-01",
-        "max_tokens": 2048,
-        "stream": True
-    }
-]
-
-llm_config_GPT4V = [
-    {
-        "model": "GPT4",
-        "api_key": os.getenv("APIKEY"),
-        "base_url": os.getenv("GPT4VBASEURL"),
-        "api_type": "azure",
-        "api_version": "2024-02-15",
-        "max_tokens": 2048,
-    }
-]
-
-
-def get_customer_details(cust_id: int) -> str:
+
+# "digest" answers with the customer's profile digest and pages of raw rows on request, "raw" with every row
+CUSTOMER_DETAILS = os.getenv("CUSTOMER_DETAILS", "digest")
+CUSTOMER_PAGE_SIZE = int(os.getenv("CUSTOMER_PAGE_SIZE", "20"))
+
+
+def get_customer_details(
+    cust_id: int,
+    page: Annotated[int, "0 for the customer's profile digest, 1 or more for that page of raw transactions"] = 0,
+) -> str:
     """
     Function to get the customer details from an Excel file using customer ID.
 
     :param identifier: Customer ID (int).
+    :param page: 0 for the profile digest, otherwise the page of raw transactions.
     :return: A JSON string with customer details.
     """
-    # Read the Excel file
-    customer_file_path = "test_data.xlsx"
-    df = pd.read_excel(customer_file_path)
-    df['cust_id'] = df['cust_id'].astype(str)
-    df['Transaction Date'] = pd.to_datetime(df['Transaction Date'], dayfirst=True, errors='coerce')
-    # Convert input cust_id to string for comparison
-    cust_id = str(cust_id)
-    customers = df[df['cust_id'] == cust_id]
-    # List to store customer details
-    customer_list = []
-
-    # Iterate over each customer and censor the cust_id
-    for _, customer in customers.iterrows():
-        cutomer_id = str(customer['cust_id'])
-        censored_cust_id = '*' * (len(cutomer_id) - 4) + cutomer_id[-4:]
-
-         # Convert 'Transaction Date' to string if it's a datetime object
-        transaction_date = customer['Transaction Date']
-        if pd.notna(transaction_date):  # Check if date is not NaT
-            transaction_date = transaction_date.strftime('%Y-%m-%d')  # Format the date as 'YYYY-MM-DD'
-        else:
-            transaction_date = None  # Handle missing or invalid dates        
-        # Create a dictionary with customer details
-        cust_details = {
-            'customer name': customer['Name'],
-            'customer id': censored_cust_id,
-            'email address': customer['email_address'],
-            'Transaction type': customer['Transaction Type'],
-            'Transaction Amount': customer['Transaction Amount'],
-            'Transaction Date': transaction_date,
-            'Reference Number': customer['Reference Number'],
-            'Mode of Payment': customer['Mode of Payment'],
-            'Transaction_Detail': customer['Detail']
-        }
-        # Add the dictionary to the list
-        customer_list.append(cust_details)
-    cust_det = json.dumps(customer_list)
-    
-    return cust_det
+    # pandas and the workbook are loaded by the first lookup
+    from customer_store import get_customer_store
 
+    store = get_customer_store()
+    if CUSTOMER_DETAILS == "raw":
+        # The workbook is parsed once per process and indexed by cust_id
+        with TOOL_SECONDS.time(tool="get_customer_details", target="lookup"):
+            return json.dumps(store.lookup(cust_id))
+    # spend totals, monthly trend and top merchants instead of every row, cached until the workbook changes
+    with TOOL_SECONDS.time(tool="get_customer_details", target="digest"):
+        digest = store.digest(cust_id)
+    pages = math.ceil(digest.get("transactions", 0) / CUSTOMER_PAGE_SIZE)
+    if page <= 0:
+        return json.dumps({**digest, "raw transaction pages": pages}, default=str) if digest else json.dumps([])
+    with TOOL_SECONDS.time(tool="get_customer_details", target="page"):
+        rows = store.lookup(cust_id, offset=(page - 1) * CUSTOMER_PAGE_SIZE, limit=CUSTOMER_PAGE_SIZE)
+    return json.dumps({"page": page, "pages": pages, "transactions": rows})
 
-def bing_search(query: str) -> str:
-    bing_endpoint = "https://api.bing.microsoft.com/v7.0/search"
-    bing_subscription_key = "088b5b8f0ff84ae29388258b92ddcfba"
-    headers = {"Ocp-Apim-Subscription-Key": bing_subscription_key}
-    
-    # Queries for OCBC and UOB separately
-    ocbc_query = f"site:ocbc.com {query}"
-    uob_query = f"site:uob.com.sg {query}"
-    
-    # Function to get search results
-    def get_results(site_query):
-        params = {"q": site_query, "textDecorations": True, "textFormat": "HTML"}
-        response = requests.get(bing_endpoint, headers=headers, params=params)
-        response.raise_for_status()
-        return response.json().get("webPages", {}).get("value", [])
-    
-    
-    ocbc_results = get_results(ocbc_query)
-    uob_results = get_results(uob_query)
-    
-    combined_results = ocbc_results + uob_results
-    
+
+BING_ENDPOINT = os.getenv("BING_ENDPOINT", "https://api.bing.microsoft.com/v7.0/search")
+BING_SUBSCRIPTION_KEY = os.getenv("BING_SUBSCRIPTION_KEY", "088b5b8f0ff84ae29388258b92ddcfba")
+BING_TIMEOUT = float(os.getenv("BING_TIMEOUT", "10"))
+# Queries for OCBC and UOB are sent separately
+SEARCH_SITES = ("ocbc.com", "uob.com.sg")
+# strip, dedupe, rank and budget the hits before they reach the agent; "false" passes Bing's HTML snippets through
+SEARCH_POSTPROCESS = os.getenv("SEARCH_POSTPROCESS", "true").lower() in ("1", "true", "yes")
+# plain snippets when they are post-processed, the markup would only be stripped again; part of the cache key
+SEARCH_TEXT_FORMAT = "Raw" if SEARCH_POSTPROCESS else "HTML"
+
+# keep-alive pools shared by every session in the process
+_http_limits = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+_http_timeout = httpx.Timeout(BING_TIMEOUT, connect=min(BING_TIMEOUT, 3.0))
+_sync_client = None
+_async_client = None
+_async_client_loop = None
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bing_search")
+
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(limits=_http_limits, timeout=_http_timeout)
+    return _sync_client
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    # an AsyncClient is bound to the loop that first used it
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(limits=_http_limits, timeout=_http_timeout)
+        _async_client_loop = loop
+    return _async_client
+
+
+def _search_request(site: str, query: str):
+    headers = {"Ocp-Apim-Subscription-Key": BING_SUBSCRIPTION_KEY}
+    params = {"q": f"site:{site} {query}", "textDecorations": SEARCH_TEXT_FORMAT == "HTML", "textFormat": SEARCH_TEXT_FORMAT}
+    return headers, params
+
+
+def _web_pages(response: httpx.Response) -> list:
+    response.raise_for_status()
+    return response.json().get("webPages", {}).get("value", [])
+
+
+def _local_results(query: str) -> dict:
+    # saved product pages answer in milliseconds; sites where the index recalls too little go to Bing
+    with TOOL_SECONDS.time(tool="bing_search", target="product_index"):
+        return local_results(query, SEARCH_SITES)
+
+
+def _format_results(query: str, site_results: list) -> list:
+    if SEARCH_POSTPROCESS:
+        with TOOL_SECONDS.time(tool="bing_search", target="postprocess"):
+            return postprocess_results(query, site_results, SEARCH_SITES)[0]
     results = []
-    for result in combined_results:
-        result_data = {
-            "title": result["name"],
-            "url": result["url"],
-            "snippet": result["snippet"]
-        }
-        results.append(result_data)
-
-    return results
\ No newline at end of file
+    for site_result in site_results:
+        for result in site_result:
+            result_data = {
+                "title": result["name"],
+                "url": result["url"],
+                "snippet": result["snippet"]
+            }
+            results.append(result_data)
+    return results
+
+
+def bing_search(query: str) -> str:
+    """
+    Search the OCBC and UOB websites with Bing. Both site queries run concurrently
+    over the shared connection pool; use a_bing_search from async code. Sites the
+    local product index answers well enough are not sent to Bing.
+    """
+    cache = get_search_cache()
+    local = _local_results(query)
+
+    def get_results(site):
+        if site in local:
+            return local[site]
+        cached = cache.get(site, query, SEARCH_TEXT_FORMAT)
+        TOOL_CALLS.inc(tool="bing_search", cached=str(cached is not None).lower())
+        if cached is not None:
+            return cached
+        headers, params = _search_request(site, query)
+        with TOOL_SECONDS.time(tool="bing_search", target=site):
+            pages = _web_pages(_get_sync_client().get(BING_ENDPOINT, headers=headers, params=params))
+        cache.set(site, query, pages, SEARCH_TEXT_FORMAT)
+        return pages
+
+    site_results = list(_search_executor.map(get_results, SEARCH_SITES))
+    return _format_results(query, site_results)
+
+
+async def a_bing_search(query: str) -> str:
+    """
+    Search the OCBC and UOB websites with Bing without blocking the event loop.
+    Both site queries are sent at the same time, so a search takes as long as the slower one.
+    Sites the local product index answers well enough are not sent to Bing.
+    """
+    client = _get_async_client()
+    cache = get_search_cache()
+    # the index search and its first segment open read from disk
+    local = await asyncio.to_thread(_local_results, query)
+
+    async def get_results(site):
+        if site in local:
+            return local[site]
+        cached = await cache.a_get(site, query, SEARCH_TEXT_FORMAT)
+        TOOL_CALLS.inc(tool="bing_search", cached=str(cached is not None).lower())
+        if cached is not None:
+            return cached
+        headers, params = _search_request(site, query)
+        with TOOL_SECONDS.time(tool="bing_search", target=site):
+            pages = _web_pages(await client.get(BING_ENDPOINT, headers=headers, params=params))
+        await cache.a_set(site, query, pages, SEARCH_TEXT_FORMAT)
+        return pages
+
+    site_results = await asyncio.gather(*(get_results(site) for site in SEARCH_SITES))
+    return _format_results(query, site_results)
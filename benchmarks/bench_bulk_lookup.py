@@ -0,0 +1,86 @@
+"""
+Bulk customer lookup against one get_customer_details-style lookup per id.
+
+Writes a workbook of --customers synthetic customers with --transactions rows
+each, then resolves --ids batches of customer ids (10k and 100k by default)
+into the NDJSON lines of POST /api/customers/bulk with customer_store's
+bulk_lookup. The per-id baseline calls store.lookup for each id; it runs on
+--baseline-sample ids and is extrapolated to the batch size.
+
+    python benchmarks/bench_bulk_lookup.py --customers 100000 --transactions 3 --ids 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from customer_store import CustomerStore, SidecarCustomerStore, bulk_lookup  # noqa: E402
+
+FIRST_ID = 100000000
+
+
+def write_workbook(path, customers, transactions, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = customers * transactions
+    ids = np.repeat(np.arange(customers) + FIRST_ID, transactions)
+    days = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 640, rows), unit="D")
+    pd.DataFrame({
+        "cust_id": ids,
+        "Name": [f"Customer {i - FIRST_ID}" for i in ids],
+        "email_address": [f"customer{i - FIRST_ID}@example.com" for i in ids],
+        "Transaction Type": rng.choice(["deposit", "withdrawals", "fund transfer", "loan payment"], rows),
+        "Transaction Amount": rng.integers(10, 5000, rows),
+        "Transaction Date": days.strftime("%d/%m/%Y"),
+        "Reference Number": rng.integers(100000, 999999, rows),
+        "Mode of Payment": rng.choice(["bank transfer", "DuitNow", "Direct debit", "checks"], rows),
+        "Detail": rng.choice(["salary", "fuel", "travel", "groceries shopping", "loan"], rows),
+    }).to_excel(path, index=False)
+
+
+def ndjson(pairs):
+    # the lines POST /api/customers/bulk streams
+    return sum(len(json.dumps({"cust_id": cust_id, "transactions": records})) + 1 for cust_id, records in pairs)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "customers.xlsx")
+        start = time.perf_counter()
+        write_workbook(path, args.customers, args.transactions)
+        print(f"wrote {args.customers * args.transactions} rows in {time.perf_counter() - start:.1f}s")
+        store = CustomerStore(path) if args.backend == "memory" else SidecarCustomerStore(path, cache_dir=tmp)
+        start = time.perf_counter()
+        store.rows(FIRST_ID)
+        print(f"{args.backend} store ready in {time.perf_counter() - start:.1f}s")
+
+        rng = random.Random(1)
+        sample = [FIRST_ID + rng.randrange(args.customers) for _ in range(args.baseline_sample)]
+        start = time.perf_counter()
+        ndjson((str(cust_id), store.lookup(cust_id)) for cust_id in sample)
+        per_id = (time.perf_counter() - start) / len(sample)
+
+        for count in args.ids:
+            ids = [FIRST_ID + rng.randrange(args.customers) for _ in range(count)]
+            start = time.perf_counter()
+            size = ndjson(bulk_lookup(ids, store=store))
+            elapsed = time.perf_counter() - start
+            print(f"{count:>7} ids: bulk {elapsed:6.2f}s ({count / elapsed:8.0f} ids/s, {size / 1e6:.1f} MB NDJSON), "
+                  f"per-id lookups ~{per_id * count:7.2f}s ({1 / per_id:6.0f} ids/s), {per_id * count / elapsed:.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--transactions", type=int, default=3, help="transactions per customer")
+    parser.add_argument("--ids", type=int, nargs="+", default=[10000, 100000], help="batch sizes to look up")
+    parser.add_argument("--baseline-sample", type=int, default=2000, help="ids timed with one lookup each")
+    parser.add_argument("--backend", choices=("memory", "sidecar"), default="sidecar")
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+"""
+Check that concurrent group chat sessions advance in parallel.
+
+Each session runs CustomGroupChatManager.run_chat for a few rounds. Speaker
+selection is simulated with a fixed-latency LLM round trip, done the way autogen
+does it: on a worker thread from the async path, on the caller's thread from the
+sync path. When selection never blocks the event loop, N sessions take about as
+long as one.
+
+    python benchmarks/bench_concurrent_sessions.py --sessions 20 --rounds 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autogen import Agent, ConversableAgent, GroupChat  # noqa: E402
+
+from custom_groupchat_manager import CustomGroupChatManager  # noqa: E402
+
+
+class SimulatedSelectionGroupChat(GroupChat):
+    """Round-robin group chat whose selection costs one simulated LLM round trip."""
+
+    selection_latency = 0.1
+
+    def _auto_select_speaker(self, last_speaker, selector, messages, agents):
+        time.sleep(self.selection_latency)
+        return self.next_agent(last_speaker, agents)
+
+    async def a_auto_select_speaker(self, last_speaker, selector, messages, agents):
+        await asyncio.to_thread(time.sleep, self.selection_latency)
+        return self.next_agent(last_speaker, agents)
+
+
+def make_agent(name):
+    agent = ConversableAgent(name, llm_config=False, human_input_mode="NEVER")
+    agent.register_reply([Agent, None], lambda recipient, messages, sender, config: (True, f"reply from {recipient.name}"))
+    return agent
+
+
+def make_session(rounds):
+    agents = [make_agent(f"agent_{i}") for i in range(3)]
+    groupchat = SimulatedSelectionGroupChat(agents=agents, messages=[], max_round=rounds + 1)
+    manager = CustomGroupChatManager(groupchat=groupchat, llm_config=False)
+    manager.set_queues(asyncio.Queue(), asyncio.Queue())
+    return agents[0], manager
+
+
+async def run_session(rounds):
+    initiator, manager = make_session(rounds)
+    await initiator.a_initiate_chat(manager, message="hello", clear_history=True, silent=True)
+
+
+async def main(sessions, rounds):
+    start = time.perf_counter()
+    await run_session(rounds)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(rounds) for _ in range(sessions)))
+    concurrent = time.perf_counter() - start
+
+    serial = single * sessions
+    print(f"1 session: {single:.2f}s, {sessions} sessions: {concurrent:.2f}s (serial would be ~{serial:.2f}s)")
+    print(f"parallel speedup: {serial / concurrent:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.rounds))
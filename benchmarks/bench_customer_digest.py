@@ -0,0 +1,111 @@
+"""
+Size and cost of get_customer_details' profile digest against the raw rows.
+
+Writes a workbook of --customers synthetic customers with --transactions rows
+each, in the columns of test_data.xlsx, and for every customer compares the
+prompt tokens of the raw row dump with those of the digest. Also times the
+first digest of each customer against a cached one, and checks that the digest
+keeps the facts of the rows: per transaction type and payment mode the counts
+and totals must match the raw rows.
+
+    python benchmarks/bench_customer_digest.py --customers 50 --transactions 300 --backend sidecar
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+from customer_store import CustomerStore, SidecarCustomerStore  # noqa: E402
+from tokens import count_tokens  # noqa: E402
+
+TYPES = ("deposit", "withdrawals", "fund transfer", "loan payment")
+MODES = ("bank transfer", "DuitNow", "duitnow", "Direct debit", "checks")
+DETAILS = ("salary", "groceries shopping", "fuel", "travel", "to travel agent", "travel loan", "dining", "utilities",
+           "insurance", "online shopping", "school fees", "medical")
+
+
+def write_workbook(path, customers, transactions, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    start = date(2023, 1, 1)
+    for i in range(customers):
+        cust_id = 100000000 + i
+        for _ in range(transactions):
+            day = start + timedelta(days=rng.randrange(640))
+            rows.append({
+                "cust_id": cust_id,
+                "Name": f"Customer {i}",
+                "email_address": f"customer{i}@example.com",
+                "Transaction Type": rng.choice(TYPES),
+                "Transaction Amount": rng.randrange(10, 5000),
+                # the workbook mixes day-first strings and real dates
+                "Transaction Date": day.strftime("%d/%m/%Y") if rng.random() < 0.5 else pd.Timestamp(day),
+                "Reference Number": rng.randrange(100000, 999999),
+                "Mode of Payment": rng.choice(MODES),
+                "Detail": rng.choice(DETAILS),
+            })
+    pd.DataFrame(rows).to_excel(path, index=False)
+
+
+def check_facts(rows, digest):
+    """The digest's per-type and per-mode counts and totals equal those of the raw rows."""
+    for key, field in (("Transaction type", "by transaction type"), ("Mode of Payment", "by mode of payment")):
+        expected = defaultdict(lambda: [0, 0])
+        for row in rows:
+            totals = expected[str(row[key]).strip().lower()]
+            totals[0] += 1
+            totals[1] += row["Transaction Amount"]
+        actual = {name: [value["count"], value["total"]] for name, value in digest[field].items()}
+        if actual != dict(expected):
+            return False
+    return digest["transactions"] == len(rows)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "customers.xlsx")
+        start = time.perf_counter()
+        write_workbook(path, args.customers, args.transactions)
+        print(f"wrote {args.customers * args.transactions} rows in {time.perf_counter() - start:.1f}s")
+        store = CustomerStore(path) if args.backend == "memory" else SidecarCustomerStore(path, cache_dir=tmp)
+        # load the workbook (and build the sidecar) before timing
+        store.rows(100000000)
+
+        raw_tokens, digest_tokens, cold, warm, facts = [], [], [], [], 0
+        for i in range(args.customers):
+            cust_id = 100000000 + i
+            rows = store.lookup(cust_id)
+            start = time.perf_counter()
+            digest = store.digest(cust_id)
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            store.digest(cust_id)
+            warm.append(time.perf_counter() - start)
+            raw_tokens.append(count_tokens(json.dumps(rows)))
+            digest_tokens.append(count_tokens(json.dumps(digest, default=str)))
+            facts += check_facts(rows, digest)
+
+    raw, compact = statistics.mean(raw_tokens), statistics.mean(digest_tokens)
+    print(f"{args.backend} backend, {args.transactions} transactions per customer")
+    print(f"raw rows   {raw:8.0f} tokens per customer")
+    print(f"digest     {compact:8.0f} tokens per customer  ({raw / compact:.1f}x smaller)")
+    print(f"digest     {statistics.median(cold) * 1000:8.2f} ms first, {statistics.median(warm) * 1000:.3f} ms cached (median)")
+    print(f"facts kept for {facts}/{args.customers} customers")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--transactions", type=int, default=300, help="transactions per customer")
+    parser.add_argument("--backend", choices=("memory", "sidecar"), default="sidecar")
+    main(parser.parse_args())
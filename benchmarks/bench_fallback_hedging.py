@@ -0,0 +1,140 @@
+"""
+Hedged requests and the circuit breaker of FallbackGroupChatManager against
+benchmarks/stub_services.py.
+
+The speaker's model ("primary") answers in --latency seconds except for a
+--tail-rate share of requests that take --tail-latency seconds more; the
+fallback_agent's model ("fallback") always answers in --latency. Replies are
+generated --requests times, --concurrency at a time, first without hedging and
+then with hedging at --percentile, and the reply latency percentiles compared.
+
+Then the primary starts failing every request: the first BREAKER_FAILURES
+failures fall back after the error, the rest skip the primary while its circuit
+is open. Once the primary is healthy again the circuit closes after
+--recovery seconds.
+
+    python benchmarks/bench_fallback_hedging.py --spawn --requests 200 --tail-rate 0.05 --tail-latency 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autogen import ConversableAgent, GroupChat  # noqa: E402
+
+from fallback_groupchat_manager import FallbackGroupChatManager, endpoint_key, get_circuit_breaker  # noqa: E402
+from metrics import FALLBACK_REPLIES  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTION = "What is the room for me to request for a home loan? This will be on top of my current loan."
+OUTCOMES = ("primary", "hedged", "failed", "circuit_open")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def make_agent(name, deployment, stub_url):
+    config = {
+        "model": deployment,
+        "api_type": "azure",
+        "api_version": "2024-02-01",
+        "base_url": stub_url,
+        "api_key": "stub",
+        "max_retries": 0,
+    }
+    return ConversableAgent(name, llm_config={"config_list": [config], "cache_seed": None}, human_input_mode="NEVER")
+
+
+def make_manager(stub_url, hedge_percentile):
+    user = ConversableAgent("user", llm_config=False, human_input_mode="NEVER")
+    speaker = make_agent("loan_assitant", "primary", stub_url)
+    fallback = make_agent("fallback", "fallback", stub_url)
+    groupchat = GroupChat(agents=[user, speaker], messages=[], max_round=2)
+    manager = FallbackGroupChatManager(fallback, groupchat=groupchat, llm_config=False, hedge_percentile=hedge_percentile)
+    speaker._oai_messages[manager] = [{"role": "user", "name": "user", "content": QUESTION}]
+    return manager, speaker
+
+
+def configure_stub(stub_url, **config):
+    request = urllib.request.Request(f"{stub_url}/stub/config", data=json.dumps(config).encode(), method="POST")
+    urllib.request.urlopen(request).read()
+
+
+def outcome_counts(speaker):
+    return {outcome: FALLBACK_REPLIES.value(agent=speaker.name, outcome=outcome) for outcome in OUTCOMES}
+
+
+async def run(manager, speaker, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    before = outcome_counts(speaker)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await manager.a_generate_with_fallback(speaker)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    after = outcome_counts(speaker)
+    return latencies, {outcome: int(after[outcome] - before[outcome]) for outcome in OUTCOMES}
+
+
+def report(label, latencies, outcomes):
+    print(f"{label:<18} p50 {percentile(latencies, 50) * 1000:6.0f} ms, p95 {percentile(latencies, 95) * 1000:6.0f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:6.0f} ms  {outcomes}")
+
+
+async def main(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    configure_stub(stub_url, tail={"primary": [args.tail_rate, args.tail_latency]}, fail={"primary": 0})
+
+    manager, speaker = make_manager(stub_url, hedge_percentile=0)
+    report("without hedging", *await run(manager, speaker, args.requests, args.concurrency))
+    # the first run also taught the latency tracker the primary's percentiles
+    manager.hedge_percentile = args.percentile
+    report(f"hedged at p{args.percentile:g}", *await run(manager, speaker, args.requests, args.concurrency))
+
+    breaker = get_circuit_breaker(endpoint_key(speaker))
+    breaker.recovery = args.recovery
+    configure_stub(stub_url, tail={"primary": [0, 0]}, fail={"primary": 1})
+    report("primary failing", *await run(manager, speaker, args.requests, args.concurrency))
+    configure_stub(stub_url, fail={"primary": 0})
+    await asyncio.sleep(args.recovery)
+    report("primary recovered", *await run(manager, speaker, args.requests, args.concurrency))
+    print(f"circuit {breaker.state}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--percentile", type=float, default=90, help="hedge deadline percentile")
+    parser.add_argument("--recovery", type=float, default=2.0, help="seconds before an open circuit is tried again")
+    parser.add_argument("--spawn", action="store_true", help="start the stub services")
+    parser.add_argument("--stub-port", type=int, default=9102)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub response latency in seconds (with --spawn)")
+    parser.add_argument("--tail-rate", type=float, default=0.05, help="share of primary requests that are slow")
+    parser.add_argument("--tail-latency", type=float, default=3.0, help="extra seconds of a slow primary request")
+    args = parser.parse_args()
+    stub = None
+    if args.spawn:
+        stub = subprocess.Popen([
+            sys.executable, os.path.join(ROOT, "benchmarks", "stub_services.py"),
+            "--port", str(args.stub_port), "--latency", str(args.latency),
+        ])
+        time.sleep(3)
+    try:
+        asyncio.run(main(args))
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
@@ -0,0 +1,72 @@
+"""
+Import-time budget of the service.
+
+Imports --module (main by default) --runs times in fresh interpreters with
+`python -X importtime`, and reports the median cumulative import time and the
+slowest modules it pulled in. Exits with status 1 when the median is over
+--budget-ms, or when any of the --forbid modules was imported: autogen, the
+agents and their heavy dependencies belong to the startup hook and the first
+tool call, not to the import of main.
+
+    PYTHONPATH=. python benchmarks/bench_import_time.py --runs 5 --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORBIDDEN = ("autogen", "openai", "pandas", "numpy", "sklearn", "scipy", "tiktoken", "azure")
+
+
+def import_times(module):
+    """Return [(cumulative microseconds, depth, module)] of one import of module in a new interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), (len(name) - len(name.lstrip()) - 1) // 2, name.strip()))
+    return rows
+
+
+def main(args):
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [next(cumulative for cumulative, _, name in rows if name == args.module) / 1000 for rows in runs]
+    median = statistics.median(totals)
+    last = runs[-1]
+    # the modules imported directly by the target, and what they cost
+    target_depth = next(depth for _, depth, name in last if name == args.module)
+    children = sorted(((cumulative, name) for cumulative, depth, name in last if depth == target_depth + 1), reverse=True)
+    print(f"import {args.module}: median {median:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    for cumulative, name in children[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    imported = {name for _, _, name in last}
+    forbidden = sorted(name for name in imported if name.split(".")[0] in args.forbid)
+    failed = False
+    if forbidden:
+        roots = sorted({name.split(".")[0] for name in forbidden})
+        print(f"FAIL: import {args.module} pulls in {', '.join(roots)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: import {args.module} takes {median:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    parser.add_argument("--forbid", nargs="*", default=FORBIDDEN, help="top-level packages main must not import")
+    main(parser.parse_args())
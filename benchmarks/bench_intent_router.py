@@ -0,0 +1,64 @@
+"""
+Offline accuracy and latency of the local intent router on held-out prompts.
+
+    python benchmarks/bench_intent_router.py
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_router import CARD_INFO, CARD_PERSONALISED, INSURANCE, LOAN, IntentRouter  # noqa: E402
+
+HELD_OUT = [
+    ("How long can I stretch a UOB home loan repayment?", LOAN),
+    ("Is the UOB personal loan rate fixed or floating?", LOAN),
+    ("Can you compare OCBC and UOB renovation loans?", LOAN),
+    ("I want to borrow 50k for my wedding", LOAN),
+    ("What is the maximum loan to value for an HDB flat?", LOAN),
+    ("Am I eligible to take another loan given my existing one?", LOAN),
+    ("What travel insurance do you recommend for a ski trip?", INSURANCE),
+    ("Does the policy cover flight delays?", INSURANCE),
+    ("Which insurance is best for my elderly parents?", INSURANCE),
+    ("Compare OCBC and UOB home insurance", INSURANCE),
+    ("How much is the premium for car insurance?", INSURANCE),
+    ("Do you cover hospitalisation overseas?", INSURANCE),
+    ("Which UOB card is good for petrol savings?", CARD_INFO),
+    ("I'm switching from OCBC 365, what UOB card is closest?", CARD_INFO),
+    ("What is the UOB Lady's card?", CARD_INFO),
+    ("Which card gives miles on overseas spend?", CARD_INFO),
+    ("Tell me the cashback rates on UOB cards", CARD_INFO),
+    ("Are there UOB cards without annual fees?", CARD_INFO),
+    ("From my account activity, which card would give me the most back?", CARD_PERSONALISED),
+    ("Given what I spend every month, recommend a UOB card", CARD_PERSONALISED),
+    ("Check my recent transactions and tell me the right card", CARD_PERSONALISED),
+    ("As an existing customer, which card matches my profile?", CARD_PERSONALISED),
+    ("Based on my spending history, which card fits me?", CARD_PERSONALISED),
+    ("Pick a credit card tailored to my account", CARD_PERSONALISED),
+]
+
+
+def main():
+    router = IntentRouter()
+    correct = confident = confident_correct = 0
+    latencies = []
+    for text, label in HELD_OUT:
+        start = time.perf_counter()
+        predicted, confidence = router.classify(text)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        correct += predicted == label
+        if confidence >= router.threshold:
+            confident += 1
+            confident_correct += predicted == label
+    latencies.sort()
+    n = len(HELD_OUT)
+    print(f"accuracy (top-1):        {correct / n:.1%} ({correct}/{n})")
+    print(f"routed locally:          {confident / n:.1%} (threshold {router.threshold})")
+    print(f"accuracy when routed:    {confident_correct / max(confident, 1):.1%}")
+    print(f"latency p50 / p99 (us):  {statistics.median(latencies):.0f} / {latencies[int(0.99 * (n - 1))]:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Completions against a rate-limited deployment of benchmarks/stub_services.py,
+with and without the shared client pool and admission controller of llm_pool.
+
+--sessions chat sessions each send completions back to back for --duration
+seconds to a deployment with a quota of --rpm requests and --tpm tokens per
+minute; --background more sessions send background completions at the same
+time. Without admission every agent has its own OpenAI client that retries 429s
+on its own backoff; with it they share one connection pool and wait for the
+token buckets, speaker replies ahead of background calls and sessions in turn.
+Reported are the completions per minute the stub served against the quota, the
+429s it answered, completions that failed after their retries, and reply
+latencies. Background calls only get through while replies wait for longer
+than LLM_PRIORITY_AGING, so a short run may finish none of them.
+
+    python benchmarks/bench_llm_admission.py --spawn --sessions 20 --rpm 120 --duration 30
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEPLOYMENT = "limited"
+QUESTION = "What is the room for me to request for a home loan? This will be on top of my current loan."
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def stub_call(stub_url, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(f"{stub_url}{path}", data=data, method="POST" if data else "GET")
+    return json.loads(urllib.request.urlopen(request).read() or "null")
+
+
+def make_agent(name, stub_url, pooled):
+    from autogen import ConversableAgent
+    from llm_pool import pooled_config
+
+    config = {
+        "model": DEPLOYMENT,
+        "api_type": "azure",
+        "api_version": "2024-02-01",
+        "base_url": stub_url,
+        "api_key": "stub",
+        "max_tokens": 256,
+        "price": [0, 0],
+    }
+    config = pooled_config(config) if pooled else config
+    return ConversableAgent(name, llm_config={"config_list": [config], "cache_seed": None}, human_input_mode="NEVER")
+
+
+async def session(name, stub_url, pooled, priority, deadline, results):
+    from llm_pool import completion_priority, llm_session
+
+    llm_session.set(name)
+    agent = make_agent(name, stub_url, pooled)
+    messages = [{"role": "user", "content": QUESTION}]
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            with completion_priority(priority):
+                await agent.a_generate_reply(messages=messages)
+        except Exception as error:  # noqa: BLE001 - a completion that gave up is what is counted
+            results["failed"] += 1
+            results.setdefault("errors", set()).add(type(error).__name__)
+            continue
+        if time.monotonic() <= deadline:
+            results["latencies"][priority].append(time.monotonic() - start)
+
+
+async def run(args, stub_url, pooled):
+    from llm_pool import LLM_THREADS, PRIORITY_BACKGROUND, PRIORITY_REPLY, ContextThreadPoolExecutor
+
+    stub_call(stub_url, "/stub/config", {"quota": {DEPLOYMENT: [args.rpm, args.tpm]}})
+    before = stub_call(stub_url, "/stub/stats").get(DEPLOYMENT, {"completions": 0, "rate_limited": 0})
+    # both runs get as many completion threads; only the pooled one carries the session to admission
+    executor_cls = ContextThreadPoolExecutor if pooled else concurrent.futures.ThreadPoolExecutor
+    asyncio.get_running_loop().set_default_executor(executor_cls(max_workers=LLM_THREADS))
+    results = {"failed": 0, "latencies": {PRIORITY_REPLY: [], PRIORITY_BACKGROUND: []}}
+    start = time.monotonic()
+    deadline = start + args.duration
+    await asyncio.gather(
+        *(session(f"session-{i}", stub_url, pooled, PRIORITY_REPLY, deadline, results) for i in range(args.sessions)),
+        *(session(f"background-{i}", stub_url, pooled, PRIORITY_BACKGROUND, deadline, results) for i in range(args.background)),
+    )
+    elapsed = time.monotonic() - start
+    after = stub_call(stub_url, "/stub/stats")[DEPLOYMENT]
+    completed = after["completions"] - before["completions"]
+    replies = results["latencies"][PRIORITY_REPLY]
+    background = results["latencies"][PRIORITY_BACKGROUND]
+    label = "shared pool + admission" if pooled else "client per agent"
+    print(f"{label:<24} {completed / elapsed * 60:6.1f} completions/min of {args.rpm:g} RPM quota, "
+          f"{after['rate_limited'] - before['rate_limited']:5d} 429s, {results['failed']:4d} failed, "
+          f"reply p50 {percentile(replies, 50):5.2f}s p95 {percentile(replies, 95):5.2f}s, "
+          f"background p50 {percentile(background, 50):5.2f}s ({len(background)} done)"
+          + (f"  errors: {', '.join(sorted(results['errors']))}" if results.get("errors") else ""))
+
+
+def main(args):
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    # the quota of this process, which has the deployment to itself
+    os.environ["LLM_RPM"], os.environ["LLM_TPM"] = str(args.rpm), str(args.tpm)
+    for pooled in (False, True):
+        asyncio.run(run(args, stub_url, pooled))
+        # let the stub's buckets fill up again between runs
+        time.sleep(10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--background", type=int, default=5, help="sessions sending background completions")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--rpm", type=float, default=120, help="requests per minute quota of the deployment")
+    parser.add_argument("--tpm", type=float, default=200000, help="tokens per minute quota of the deployment")
+    parser.add_argument("--spawn", action="store_true", help="start the stub services")
+    parser.add_argument("--stub-port", type=int, default=9103)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub response latency in seconds (with --spawn)")
+    args = parser.parse_args()
+    stub = None
+    if args.spawn:
+        stub = subprocess.Popen([
+            sys.executable, os.path.join(ROOT, "benchmarks", "stub_services.py"),
+            "--port", str(args.stub_port), "--latency", str(args.latency),
+        ])
+        time.sleep(3)
+    try:
+        main(args)
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
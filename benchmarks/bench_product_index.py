@@ -0,0 +1,165 @@
+"""
+Query latency of the local product index that answers bing_search before Bing.
+
+Saves --pages synthetic OCBC and UOB product pages as HTML (navigation, scripts
+and footers included, like a browser saves them) and ingests them in --segments
+increments, then replays --queries product questions. A share of them, --unknown,
+asks about products the index has no pages for and should be sent to Bing.
+Reported are ingest throughput, the median and tail query latency with
+--segments segments and again after compaction, how many known and unknown
+questions were answered locally, and how often the best local page is about the
+product asked for. With --bing-endpoint (for example the stub services) the same
+questions are also timed against Bing.
+
+    python benchmarks/bench_product_index.py --pages 20000 --segments 4 --queries 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from product_index import (  # noqa: E402
+    PRODUCT_INDEX_MIN_COVERAGE, PRODUCT_INDEX_MIN_HITS, ProductIndex, compact, ingest,
+)
+
+SITES = ("ocbc.com", "uob.com.sg")
+PRODUCTS = {
+    "cashback credit card": ("cashback", "dining", "groceries", "petrol", "minimum spend", "rebate", "annual fee"),
+    "miles credit card": ("air miles", "travel", "overseas spend", "lounge", "KrisFlyer", "conversion"),
+    "home loan": ("mortgage", "HDB flat", "private property", "fixed rate", "refinancing", "loan tenure"),
+    "car loan": ("vehicle", "down payment", "COE", "instalment", "flat rate"),
+    "personal loan": ("instalment", "EIR", "approval", "cash", "processing fee"),
+    "renovation loan": ("renovation", "contractor", "quotation", "disbursement"),
+    "travel insurance": ("trip cancellation", "medical coverage", "annual plan", "baggage", "COVID"),
+    "home insurance": ("fire", "flood", "contents", "renovations", "liability"),
+    "fixed deposit": ("interest rate", "placement", "tenor", "promotion", "early withdrawal"),
+    "savings account": ("bonus interest", "salary crediting", "GIRO", "fall-below fee"),
+}
+# asked about, but never saved into the index
+UNKNOWN = ("business account", "trade finance", "wealth management", "remittance", "share financing")
+QUESTIONS = (
+    "What {site} {product} options are there?",
+    "Which {site} {product} has the best {feature}?",
+    "{site} {product} {feature}",
+    "Tell me about the {feature} of {site} {product}",
+)
+BOILERPLATE = (
+    "<nav>Personal Business Private Banking Cards Loans Insurance Investments Contact us Login</nav>"
+    "<script>window.dataLayer = window.dataLayer || []; function gtag(){dataLayer.push(arguments);}</script>"
+    "<header>Search Menu Promotions Rates Branches ATM</header>"
+)
+FOOTER = "<footer>Terms and conditions Privacy Security Copyright Deposit Insurance Scheme</footer>"
+
+
+def save_pages(rng, directory, pages):
+    """Write pages product pages per site and return their (url, product) list."""
+    saved = []
+    for i in range(pages):
+        site = SITES[i % len(SITES)]
+        product = rng.choice(list(PRODUCTS))
+        brand = site.split(".")[0].upper()
+        features = PRODUCTS[product]
+        paragraphs = "".join(
+            f"<p>The {brand} {product} offers {rng.choice(features)} and {rng.choice(features)}. "
+            f"{' '.join(rng.choice(features) for _ in range(6))} for eligible customers who apply online.</p>"
+            for _ in range(rng.randint(3, 12))
+        )
+        url = f"https://www.{site}/personal/{product.replace(' ', '-')}/{i}.page"
+        with open(os.path.join(directory, f"{i}.html"), "w") as f:
+            f.write(f"<!-- saved from url=({len(url):04d}){url} -->\n<html><head><title>{brand} {product.title()} {i}</title>"
+                    f"</head><body>{BOILERPLATE}<h1>{brand} {product.title()}</h1>{paragraphs}{FOOTER}</body></html>")
+        saved.append((url, product))
+    return saved
+
+
+def questions(rng, count, unknown):
+    for _ in range(count):
+        site = rng.choice(("OCBC", "UOB"))
+        if rng.random() < unknown:
+            yield False, None, rng.choice(QUESTIONS).format(site=site, product=rng.choice(UNKNOWN), feature="fees")
+        else:
+            product = rng.choice(list(PRODUCTS))
+            yield True, product, rng.choice(QUESTIONS).format(site=site, product=product, feature=rng.choice(PRODUCTS[product]))
+
+
+def percentile(values, share):
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def replay(index, asked):
+    seconds, answered, relevant = [], {True: 0, False: 0}, []
+    for known, product, question in asked:
+        start = time.perf_counter()
+        found = index.search(question, SITES)
+        seconds.append(time.perf_counter() - start)
+        local = [pages for pages, coverage in found.values()
+                 if len(pages) >= PRODUCT_INDEX_MIN_HITS and coverage >= PRODUCT_INDEX_MIN_COVERAGE]
+        # a question counts as answered locally when no site had to go to Bing
+        answered[known] += len(local) == len(SITES)
+        if known and local:
+            relevant.append(all(f"/{product.replace(' ', '-')}/" in pages[0]["url"] for pages in local))
+    return seconds, answered, relevant
+
+
+def report(label, seconds, answered, relevant, asked):
+    known = sum(1 for item in asked if item[0])
+    print(f"{label}: p50 {statistics.median(seconds) * 1000:.2f} ms, p95 {percentile(seconds, 0.95) * 1000:.2f} ms, "
+          f"p99 {percentile(seconds, 0.99) * 1000:.2f} ms per search of both sites")
+    print(f"  answered locally: {answered[True] / max(known, 1):.0%} of known products, "
+          f"{answered[False] / max(len(asked) - known, 1):.0%} of unknown ones; "
+          f"best local page about the product asked: {sum(relevant) / max(len(relevant), 1):.0%}")
+
+
+def main(args):
+    rng = random.Random(0)
+    asked = list(questions(rng, args.queries, args.unknown))
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = os.path.join(tmp, "index")
+        elapsed = 0.0
+        per_segment = -(-args.pages // args.segments)
+        for segment in range(args.segments):
+            pages_dir = os.path.join(tmp, f"pages{segment}")
+            os.makedirs(pages_dir)
+            save_pages(rng, pages_dir, min(per_segment, args.pages - segment * per_segment))
+            start = time.perf_counter()
+            ingest([pages_dir], index_dir)
+            elapsed += time.perf_counter() - start
+        print(f"ingested {args.pages} pages in {args.segments} segments: {elapsed:.1f}s ({args.pages / elapsed:.0f} pages/s)")
+
+        index = ProductIndex(index_dir)
+        index.search("warm up", SITES)
+        report(f"{args.segments} segments", *replay(index, asked), asked)
+        start = time.perf_counter()
+        compact(index_dir)
+        print(f"compacted in {time.perf_counter() - start:.1f}s")
+        report("1 segment", *replay(ProductIndex(index_dir), asked), asked)
+
+    if args.bing_endpoint:
+        client = httpx.Client(timeout=30)
+        seconds = []
+        for _, _, question in asked[:args.bing_sample]:
+            start = time.perf_counter()
+            for site in SITES:
+                client.get(args.bing_endpoint, params={"q": f"site:{site} {question}"},
+                           headers={"Ocp-Apim-Subscription-Key": os.getenv("BING_SUBSCRIPTION_KEY", "")})
+            seconds.append(time.perf_counter() - start)
+        print(f"Bing ({args.bing_endpoint}, sites one after the other): p50 {statistics.median(seconds) * 1000:.0f} ms, "
+              f"p95 {percentile(seconds, 0.95) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=20000)
+    parser.add_argument("--segments", type=int, default=4, help="ingests the pages are split over")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--unknown", type=float, default=0.2, help="share of questions about products not in the index")
+    parser.add_argument("--bing-endpoint", help="also time the questions against this Bing search endpoint")
+    parser.add_argument("--bing-sample", type=int, default=50, help="questions sent to --bing-endpoint")
+    main(parser.parse_args())
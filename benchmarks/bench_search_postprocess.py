@@ -0,0 +1,110 @@
+"""
+Bytes and prompt tokens bing_search sends to the agent with and without
+search_postprocess.
+
+Builds Bing-style HTML responses for --queries questions, --hits pages per
+site, like a real bank site search returns them: highlighted titles and
+snippets, the same page under tracking parameters or www./non-www. URLs, and
+templated pages whose snippets differ by a word. A share of the pages is about
+the question; the rest is about other products. Reported per call are the
+bytes and tokens before and after post-processing, the time it takes, and how
+many of the pages about the question the agent still sees.
+
+    python benchmarks/bench_search_postprocess.py --queries 50 --hits 10 --budget 400
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_postprocess import postprocess_results  # noqa: E402
+
+SITES = ("ocbc.com", "uob.com.sg")
+TOPICS = {
+    "home loan": ("home loan", "mortgage", "property", "refinancing", "fixed rate", "loan tenure"),
+    "travel insurance": ("travel insurance", "trip cancellation", "medical coverage", "annual plan", "overseas"),
+    "cashback credit card": ("cashback", "credit card", "dining", "groceries", "petrol", "minimum spend"),
+    "fixed deposit": ("fixed deposit", "interest rate", "placement", "tenor", "promotion"),
+    "personal loan": ("personal loan", "instalment", "EIR", "approval", "cash"),
+}
+FILLER = ("Find out more about", "Enjoy exclusive privileges with", "Apply online today for", "Terms and conditions apply to",
+          "Learn how you can benefit from", "Discover our range of")
+
+
+def highlight(text, query):
+    for word in query.split():
+        text = text.replace(word, f"<b>{word}</b>")
+    return text
+
+
+def page(rng, site, topic, query, index):
+    words = TOPICS[topic]
+    snippet = " ".join(f"{rng.choice(FILLER)} {rng.choice(words)} &amp; {rng.choice(words)}." for _ in range(4))
+    return {
+        "id": f"https://api.bing.microsoft.com/api/v7/#WebPages.{index}",
+        "name": highlight(f"{words[0].title()} | {site.split('.')[0].upper()} {rng.choice(words).title()}", query),
+        "url": f"https://www.{site}/personal/{topic.replace(' ', '-')}/{index}.page",
+        "displayUrl": f"https://www.{site}/personal/{topic.replace(' ', '-')}",
+        "snippet": highlight(snippet, query),
+        "language": "en",
+        "isNavigational": False,
+    }
+
+
+def site_pages(rng, site, query, hits, relevant_share):
+    topic = query
+    others = [other for other in TOPICS if other != topic]
+    pages = []
+    for index in range(hits):
+        relevant = rng.random() < relevant_share
+        pages.append((relevant, page(rng, site, topic if relevant else rng.choice(others), query, index)))
+    # the same page again under a tracking URL, and a template page that differs by a word
+    relevant, duplicate = rng.choice(pages)
+    pages.append((relevant, {**duplicate, "url": duplicate["url"].replace("https://www.", "http://") + "?cid=sem"}))
+    relevant, template = rng.choice(pages)
+    pages.append((relevant, {**template, "url": template["url"] + "x", "snippet": template["snippet"] + " Today."}))
+    rng.shuffle(pages)
+    return [relevant for relevant, _ in pages], [p for _, p in pages]
+
+
+def main(args):
+    rng = random.Random(0)
+    before_bytes, after_bytes, before_tokens, after_tokens, seconds, recall = [], [], [], [], [], []
+    for _ in range(args.queries):
+        query = rng.choice(list(TOPICS))
+        labels, site_results = zip(*(site_pages(rng, site, query, args.hits, args.relevant) for site in SITES))
+        start = time.perf_counter()
+        hits, report = postprocess_results(query, list(site_results), SITES, budget=args.budget)
+        seconds.append(time.perf_counter() - start)
+        before_bytes.append(sum(r["bytes"][0] for r in report.values()))
+        after_bytes.append(sum(r["bytes"][1] for r in report.values()))
+        before_tokens.append(sum(r["tokens"][0] for r in report.values()))
+        after_tokens.append(sum(r["tokens"][1] for r in report.values()))
+        relevant_urls = {p["url"].split("?")[0].replace("http://", "https://www.")
+                         for site_labels, pages in zip(labels, site_results)
+                         for relevant, p in zip(site_labels, pages) if relevant}
+        kept = {hit["url"].split("?")[0].replace("http://", "https://www.") for hit in hits}
+        if relevant_urls:
+            # pages about the question the agent still sees, of at most what fits the budget
+            recall.append(len(kept & relevant_urls) / min(len(relevant_urls), len(hits)))
+
+    print(f"{args.queries} searches, {args.hits} + 2 duplicate pages per site, budget {args.budget} tokens per site")
+    print(f"bytes   {statistics.mean(before_bytes):8.0f} -> {statistics.mean(after_bytes):6.0f} per call "
+          f"({1 - sum(after_bytes) / sum(before_bytes):.0%} less)")
+    print(f"tokens  {statistics.mean(before_tokens):8.0f} -> {statistics.mean(after_tokens):6.0f} per call "
+          f"({1 - sum(after_tokens) / sum(before_tokens):.0%} less)")
+    print(f"post-processing {statistics.median(seconds) * 1000:.2f} ms per call (median)")
+    print(f"hits kept that are about the question: {statistics.mean(recall):.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--hits", type=int, default=10, help="pages per site before the duplicates")
+    parser.add_argument("--relevant", type=float, default=0.5, help="share of pages about the question")
+    parser.add_argument("--budget", type=int, default=400, help="tokens per site")
+    main(parser.parse_args())
@@ -0,0 +1,55 @@
+"""
+Measure per-session AutogenChat construction time and retained memory, building
+every agent from scratch versus cloning the process-wide agent templates.
+
+    python benchmarks/bench_session_construction.py --sessions 50
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from group_chat import AutogenChat, build_agent_templates, get_agent_templates  # noqa: E402
+
+
+def from_scratch(chat_id):
+    # what every connection paid before templates: build the agents, then the session
+    return AutogenChat(chat_id=chat_id, templates=build_agent_templates())
+
+
+def from_templates(chat_id):
+    return AutogenChat(chat_id=chat_id)
+
+
+def measure(factory, sessions):
+    gc.collect()
+    tracemalloc.start()
+    start_mem = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    chats = [factory(str(i)) for i in range(sessions)]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - start_mem
+    tracemalloc.stop()
+    del chats
+    return elapsed / sessions * 1000, retained / sessions / 1024
+
+
+async def main(sessions):
+    # warm the shared registry so the templated run only measures per-session work
+    get_agent_templates()
+    for label, factory in (("from scratch", from_scratch), ("templates", from_templates)):
+        ms, kib = measure(factory, sessions)
+        print(f"{label:>12}: {ms:8.2f} ms/session  {kib:10.1f} KiB/session")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions))
@@ -0,0 +1,132 @@
+"""
+Latency of one executor turn whose message carries several bing_search tool
+calls, against the Bing endpoint of benchmarks/stub_services.py.
+
+Each turn sends --calls searches (both sites each, answered after the stub's
+--latency) three ways: one call after the other, through autogen's
+UserProxyAgent, and through CustomExecutorAgent. This is done once with the
+sync bing_search tool and once with a_bing_search. Reported are the median and
+worst turn time over --turns turns. Also reported is the longest time the event
+loop was blocked during a turn, since other sessions served by the same process
+would wait that long.
+
+    python benchmarks/bench_tool_calls.py --spawn --latency 0.5 --calls 4 --turns 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_queries = itertools.count()
+
+
+def tool_message(tool, calls):
+    # distinct queries, so the search cache never answers a call
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": f"call_{i}",
+                "type": "function",
+                "function": {"name": tool, "arguments": json.dumps({"query": f"home loan rates {next(_queries)}"})},
+            }
+            for i in range(calls)
+        ],
+    }
+
+
+async def one_after_the_other(agent, message):
+    for call in message["tool_calls"]:
+        await agent.a_execute_function(call["function"])
+
+
+async def in_one_reply(agent, message):
+    await agent.a_generate_tool_calls_reply(messages=[message])
+
+
+async def timed_turn(run, agent, message):
+    """Seconds the turn took and the longest gap between event loop ticks meanwhile."""
+    stalls = []
+
+    async def ticker():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    # without autogen's ">>>>>>>> EXECUTING FUNCTION" banners
+    with contextlib.redirect_stdout(io.StringIO()):
+        await run(agent, message)
+    seconds = time.perf_counter() - start
+    tick.cancel()
+    return seconds, max(stalls, default=seconds)
+
+
+async def main(args):
+    from autogen import UserProxyAgent
+
+    from agent_tools import a_bing_search, bing_search
+    from custom_executor_agent import CustomExecutorAgent
+
+    tools = {"bing_search": bing_search, "a_bing_search": a_bing_search}
+    stock = UserProxyAgent("executor", human_input_mode="NEVER", code_execution_config=False, llm_config=False)
+    custom = CustomExecutorAgent("executor", human_input_mode="NEVER", llm_config=False)
+    for agent in (stock, custom):
+        agent.register_function(tools)
+    # open the HTTP clients before timing
+    bing_search("warm up")
+    await a_bing_search("warm up")
+
+    print(f"{args.calls} tool calls per turn, stub latency {args.latency:.2f}s, {args.turns} turns each")
+    for tool in tools:
+        for label, run, agent in (
+            ("one after the other", one_after_the_other, stock),
+            ("UserProxyAgent", in_one_reply, stock),
+            ("CustomExecutorAgent", in_one_reply, custom),
+        ):
+            turns = [await timed_turn(run, agent, tool_message(tool, args.calls)) for _ in range(args.turns)]
+            seconds, stalls = zip(*turns)
+            print(f"{tool:>13}  {label:<20} turn p50 {statistics.median(seconds):.2f}s, max {max(seconds):.2f}s; "
+                  f"event loop blocked up to {max(stalls):.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=4, help="tool calls in one message")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--spawn", action="store_true", help="start the stub services")
+    parser.add_argument("--stub-port", type=int, default=9103)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub response latency in seconds (with --spawn)")
+    args = parser.parse_args()
+    os.environ.setdefault("BING_ENDPOINT", f"http://127.0.0.1:{args.stub_port}/v7.0/search")
+    # every search goes to the stub
+    os.environ.setdefault("PRODUCT_INDEX", "false")
+    stub = None
+    if args.spawn:
+        stub = subprocess.Popen([
+            sys.executable, os.path.join(ROOT, "benchmarks", "stub_services.py"),
+            "--port", str(args.stub_port), "--latency", str(args.latency),
+        ])
+        time.sleep(3)
+    try:
+        asyncio.run(main(args))
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
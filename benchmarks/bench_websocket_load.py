@@ -0,0 +1,203 @@
+"""
+Load test for the websocket API, runnable without network access.
+
+Opens --sessions /api/ws/{id} sessions, --concurrency at a time, and replays
+the sample conversation from the README (card comparison, personalised card,
+home loan, travel insurance) in each. With --spawn the script starts
+benchmarks/stub_services.py and the app (through benchmarks/serve_offline.py),
+pointed at the stub, and measures the app's memory; otherwise it drives an already running app
+(--url, and --app-pid for memory).
+
+Reports turn latency (question sent to the next "Provide feedback" prompt)
+percentiles, time to the first frame of each turn, completed sessions per
+second and the app's resident memory per concurrent session.
+
+    python benchmarks/bench_websocket_load.py --spawn --sessions 50 --concurrency 25 --latency 0.5
+
+Questions are made unique per session so the response and search caches do
+not answer the replayed load; pass --cached to send identical questions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONVERSATION = [
+    "My OCBC 365 card is expiring soon. It was a great card with 2% cashback options. Can you suggest similar options with UOB?",
+    "Ah thanks for the options. But based on my account and recent spend, can you suggest me some UOB cards that might be more suitable to me?",
+    "What is the room for me to request for a home loan? This will be on top of my current loan.",
+    "I also want to enquire about travel insurance. What are some of the best options available with UOB there?",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def rss_kib(pid):
+    """Resident memory of pid and its children, which are the uvicorn workers with --workers."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    total = int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            total += sum(rss_kib(int(child)) for child in children.read().split())
+    except FileNotFoundError:
+        pass
+    return total
+
+
+class Results:
+    def __init__(self):
+        self.turns = []
+        self.first_frames = []
+        self.sessions = 0
+        self.errors = 0
+
+
+async def run_session(url, turns, unique, results):
+    session_id = uuid.uuid4().hex
+    async with websockets.connect(f"{url}/api/ws/{session_id}", max_size=None) as ws:
+        for number, question in enumerate(CONVERSATION[:turns]):
+            if unique:
+                question = f"{question} (ref {session_id[:8]})"
+            sent = time.perf_counter()
+            first_frame = None
+            await ws.send(question)
+            while True:
+                frame = json.loads(await ws.recv())
+                if first_frame is None:
+                    first_frame = time.perf_counter() - sent
+                # the user proxy asks for the next question once the agents are done
+                if frame.get("name") == "system":
+                    break
+            results.turns.append(time.perf_counter() - sent)
+            results.first_frames.append(first_frame)
+        await ws.send("DO_FINISH")
+    results.sessions += 1
+
+
+async def sample_rss(pid, peak):
+    while True:
+        peak[0] = max(peak[0], rss_kib(pid))
+        await asyncio.sleep(0.05)
+
+
+async def wait_for_port(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"nothing is listening on port {port}")
+
+
+def spawn(args):
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "stub_services.py"),
+        "--port", str(args.stub_port), "--latency", str(args.latency), "--token-delay", str(args.token_delay),
+    ])
+    env = dict(
+        os.environ,
+        BASEURL=f"http://127.0.0.1:{args.stub_port}",
+        APIKEY="stub",
+        BING_ENDPOINT=f"http://127.0.0.1:{args.stub_port}/v7.0/search",
+        BING_SUBSCRIPTION_KEY="stub",
+    )
+    # the app prints every agent message; keep it out of the report
+    app = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "serve_offline.py"), "--port", str(args.app_port),
+         "--workers", str(args.workers)],
+        cwd=ROOT, env=env, stdout=open(args.app_log, "w"), stderr=subprocess.STDOUT,
+    )
+    return stub, app
+
+
+async def main(args):
+    processes = []
+    if args.spawn:
+        processes = spawn(args)
+        args.url = f"ws://127.0.0.1:{args.app_port}"
+        args.app_pid = processes[1].pid
+    try:
+        if args.spawn:
+            await wait_for_port(args.stub_port)
+            await wait_for_port(args.app_port)
+        # one session first, so imports and agent templates are warm before measuring
+        await run_session(args.url, args.turns, not args.cached, Results())
+        baseline = rss_kib(args.app_pid) if args.app_pid else 0
+        peak = [baseline]
+        sampler = asyncio.create_task(sample_rss(args.app_pid, peak)) if args.app_pid else None
+
+        results = Results()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded():
+            async with semaphore:
+                try:
+                    await run_session(args.url, args.turns, not args.cached, results)
+                except Exception as e:
+                    results.errors += 1
+                    print(f"session failed: {e!r}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded() for _ in range(args.sessions)))
+        elapsed = time.perf_counter() - start
+        if sampler:
+            sampler.cancel()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    print(f"{results.sessions} sessions ({results.errors} failed), {len(results.turns)} turns in {elapsed:.1f}s, "
+          f"concurrency {args.concurrency}, stub latency {args.latency}s")
+    print(f"sessions/s:        {results.sessions / elapsed:.2f}")
+    for label, values in (("turn latency", results.turns), ("first frame", results.first_frames)):
+        print(f"{label + ':':<18} p50 {percentile(values, 50) * 1000:.0f} ms, "
+              f"p95 {percentile(values, 95) * 1000:.0f} ms, p99 {percentile(values, 99) * 1000:.0f} ms")
+    if args.app_pid:
+        per_session = (peak[0] - baseline) / min(args.concurrency, args.sessions)
+        print(f"app RSS:           {baseline / 1024:.0f} MiB idle, {peak[0] / 1024:.0f} MiB peak, "
+              f"~{per_session:.0f} KiB per concurrent session")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=len(CONVERSATION), choices=range(1, len(CONVERSATION) + 1))
+    parser.add_argument("--cached", action="store_true", help="send identical questions in every session")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--app-pid", type=int, help="pid of a running app, to report its memory")
+    parser.add_argument("--spawn", action="store_true", help="start the stub services and the app")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the spawned app")
+    parser.add_argument("--app-log", default=os.devnull, help="file for the spawned app's output")
+    parser.add_argument("--stub-port", type=int, default=9101)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub response latency in seconds (with --spawn)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="stub delay between streamed chunks (with --spawn)")
+    args = parser.parse_args()
+    if websockets is None:
+        sys.exit("bench_websocket_load.py needs the websockets package")
+    asyncio.run(main(args))
@@ -0,0 +1,41 @@
+"""
+Serve main:app on a machine without network access.
+
+autogen counts the prompt tokens of streamed completions with tiktoken, which
+downloads its encoding files on first use. When they cannot be loaded, this
+counts tokens with the estimate from tokens instead, then runs the
+app with uvicorn. With --workers the patch is applied in every worker process,
+which imports this module again.
+
+    python benchmarks/serve_offline.py --port 8765 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+
+import autogen.oai.client  # noqa: E402
+from tokens import count_tokens, get_encoding  # noqa: E402
+
+
+def estimate_tokens(input, model=None):
+    return count_tokens(input if isinstance(input, str) else json.dumps(input))
+
+
+if not get_encoding():
+    autogen.oai.client.count_token = estimate_tokens
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    if autogen.oai.client.count_token is estimate_tokens:
+        print("tiktoken encodings are not available, estimating streamed prompt tokens")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
@@ -0,0 +1,210 @@
+"""
+Local stand-ins for Azure OpenAI and Bing Web Search, for offline load tests.
+
+The chat completions endpoint plays the group chat: speaker selection prompts
+get the name of the next agent, an agent that has tools and has not called one
+yet gets a tool call, and every other request gets a canned answer. Answers are
+streamed chunk by chunk when the request asks for it. Both endpoints wait
+--latency seconds before answering, streamed chunks --token-delay apart.
+
+Single deployments can be made slow or broken: --tail primary=0.1:3 makes one
+in ten requests to the "primary" deployment take 3 seconds more, --fail
+primary=1 answers every one of them with a 503, and --quota primary=60:40000
+enforces 60 requests and 40000 tokens (prompt plus max_tokens) per minute,
+like Azure in ten-second buckets, answering requests over it with a 429 and
+Retry-After. POST /stub/config with {"tail": {...}, "fail": {...},
+"quota": {...}} changes them while the stub runs; GET /stub/stats counts the
+completions and 429s of each deployment.
+
+    python benchmarks/stub_services.py --port 9101 --latency 0.5 --token-delay 0.02
+
+Point the app at it with
+    BASEURL=http://localhost:9101 APIKEY=stub
+    BING_ENDPOINT=http://localhost:9101/v7.0/search BING_SUBSCRIPTION_KEY=stub
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY = 0.5
+TOKEN_DELAY = 0.02
+ANSWER_WORDS = 60
+SEARCH_RESULTS = 8
+# deployment -> (probability, extra seconds) and deployment -> failure probability
+TAIL = {}
+FAIL = {}
+# deployment -> (requests per minute, tokens per minute), its buckets, and what it answered
+QUOTA = {}
+BUCKETS = {}
+STATS = {}
+
+app = FastAPI()
+
+
+def _last_user_text(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user" and isinstance(message.get("content"), str):
+            return message["content"]
+    return ""
+
+
+def _select_speaker(messages):
+    conversation = [
+        m for m in messages
+        if m.get("role") != "system" and m.get("name") not in ("checking_agent", "speaker_selection_agent")
+    ]
+    last = conversation[-1] if conversation else {}
+    if last.get("tool_calls"):
+        return "executor"
+    if last.get("role") == "tool":
+        callers = [m for m in conversation if m.get("tool_calls")]
+        return callers[-1].get("name", "loan_assitant") if callers else "loan_assitant"
+    if last.get("name") == "user":
+        return "loan_assitant"
+    return "user"
+
+
+def _reply(body):
+    messages = body["messages"]
+    if "Read the above conversation" in json.dumps(messages[-2:]):
+        return {"content": _select_speaker(messages)}
+    if body.get("tools") and messages[-1].get("role") != "tool":
+        tool = body["tools"][0]["function"]
+        if "cust_id" in json.dumps(tool.get("parameters", {})):
+            arguments = {"cust_id": 345566767}
+        else:
+            # searching for the question keeps the search cache from answering repeated load
+            arguments = {"query": _last_user_text(messages)[:200]}
+        return {"tool_calls": [{
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": tool["name"], "arguments": json.dumps(arguments)},
+        }]}
+    return {"content": " ".join(["Here is what UOB offers for your question."] * (ANSWER_WORDS // 8))}
+
+
+def _completion(reply, model):
+    message = {"role": "assistant", "content": reply.get("content")}
+    if "tool_calls" in reply:
+        message["tool_calls"] = reply["tool_calls"]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if "tool_calls" in reply else "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+async def _stream(reply, model):
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+
+    def chunk(delta, finish_reason=None):
+        return "data: " + json.dumps({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}) + "\n\n"
+
+    if "tool_calls" in reply:
+        yield chunk({"role": "assistant", "tool_calls": [{"index": 0, **reply["tool_calls"][0]}]})
+        yield chunk({}, "tool_calls")
+    else:
+        for word in reply["content"].split(" "):
+            yield chunk({"content": word + " "})
+            await asyncio.sleep(TOKEN_DELAY)
+        yield chunk({}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+def _over_quota(deployment, body):
+    """Charge a request to the deployment's quota; returns the seconds to retry after when it does not fit."""
+    if deployment not in QUOTA:
+        return 0
+    rpm, tpm = QUOTA[deployment]
+    tokens = len(json.dumps(body.get("messages", []))) / 4 + (body.get("max_tokens") or 0)
+    now = time.monotonic()
+    requests_left, tokens_left, refilled = BUCKETS.get(deployment, (rpm / 6, tpm / 6, now))
+    requests_left = min(rpm / 6, requests_left + (now - refilled) * rpm / 60)
+    tokens_left = min(tpm / 6, tokens_left + (now - refilled) * tpm / 60)
+    if requests_left < 1 or tokens_left < tokens:
+        BUCKETS[deployment] = (requests_left, tokens_left, now)
+        return max((1 - requests_left) * 60 / rpm, (tokens - tokens_left) * 60 / tpm, 0.1)
+    BUCKETS[deployment] = (requests_left - 1, tokens_left - tokens, now)
+    return 0
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    stats = STATS.setdefault(deployment, {"completions": 0, "rate_limited": 0})
+    retry_after = _over_quota(deployment, body)
+    if retry_after:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+            status_code=429,
+            headers={"retry-after-ms": str(int(retry_after * 1000)), "retry-after": str(max(1, round(retry_after)))},
+        )
+    stats["completions"] += 1
+    reply = _reply(body)
+    if random.random() < FAIL.get(deployment, 0):
+        return JSONResponse({"error": {"code": "ServiceUnavailable", "message": "stub failure"}}, status_code=503)
+    tail_rate, tail_latency = TAIL.get(deployment, (0, 0))
+    await asyncio.sleep(LATENCY + (tail_latency if random.random() < tail_rate else 0))
+    if body.get("stream"):
+        return StreamingResponse(_stream(reply, deployment), media_type="text/event-stream")
+    return JSONResponse(_completion(reply, deployment))
+
+
+@app.post("/stub/config")
+async def stub_config(request: Request):
+    body = await request.json()
+    TAIL.update({name: tuple(value) for name, value in body.get("tail", {}).items()})
+    FAIL.update(body.get("fail", {}))
+    QUOTA.update({name: tuple(value) for name, value in body.get("quota", {}).items()})
+    BUCKETS.clear()
+    return {"tail": TAIL, "fail": FAIL, "quota": QUOTA}
+
+
+@app.get("/stub/stats")
+async def stub_stats():
+    return STATS
+
+
+def _per_deployment(values, parse):
+    return {name: parse(value) for name, value in (item.split("=", 1) for item in values)}
+
+
+@app.get("/v7.0/search")
+async def bing_search(q: str):
+    await asyncio.sleep(LATENCY)
+    return {"webPages": {"value": [
+        {"name": f"{q} - result {i}", "url": f"https://www.uob.com.sg/stub/{i}", "snippet": f"<b>{q}</b> stub snippet {i}."}
+        for i in range(SEARCH_RESULTS)
+    ]}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds before each response starts")
+    parser.add_argument("--token-delay", type=float, default=TOKEN_DELAY, help="seconds between streamed chunks")
+    parser.add_argument("--answer-words", type=int, default=ANSWER_WORDS)
+    parser.add_argument("--tail", action="append", default=[], metavar="DEPLOYMENT=RATE:SECONDS",
+                        help="make a share of a deployment's requests slower")
+    parser.add_argument("--fail", action="append", default=[], metavar="DEPLOYMENT=RATE",
+                        help="answer a share of a deployment's requests with a 503")
+    parser.add_argument("--quota", action="append", default=[], metavar="DEPLOYMENT=RPM:TPM",
+                        help="answer a deployment's requests over this rate with a 429")
+    args = parser.parse_args()
+    LATENCY, TOKEN_DELAY, ANSWER_WORDS = args.latency, args.token_delay, args.answer_words
+    TAIL.update(_per_deployment(args.tail, lambda value: tuple(float(part) for part in value.split(":"))))
+    FAIL.update(_per_deployment(args.fail, float))
+    QUOTA.update(_per_deployment(args.quota, lambda value: tuple(float(part) for part in value.split(":"))))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, List
+
+from metrics import QUEUE_DROPPED, QUEUE_WAIT_SECONDS
+
+FINISH = "DO_FINISH"
+CLIENT_QUEUE_MAXSIZE = int(os.getenv("CLIENT_QUEUE_MAXSIZE", "256"))
+# what a full queue does with a new frame: "block" the producer or "drop_oldest" queued frame
+CLIENT_QUEUE_OVERFLOW = os.getenv("CLIENT_QUEUE_OVERFLOW", "block")
+# how long the send pump waits for more deltas before flushing, 0 sends immediately
+CLIENT_FLUSH_INTERVAL = float(os.getenv("CLIENT_FLUSH_INTERVAL", "0"))
+CLIENT_MAX_BATCH = int(os.getenv("CLIENT_MAX_BATCH", "64"))
+
+_DELTA_PREFIX = '{"type": "delta"'
+
+
+class ClientQueue(asyncio.Queue):
+    """
+    Bounded queue between a websocket and its group chat, with an overflow
+    policy for when the client cannot keep up and per-connection depth stats.
+    The time each frame spends queued is recorded under the queue's name.
+    """
+
+    def __init__(self, maxsize: int = CLIENT_QUEUE_MAXSIZE, overflow: str = CLIENT_QUEUE_OVERFLOW, name: str = "client"):
+        super().__init__(maxsize)
+        if overflow not in ("block", "drop_oldest"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.overflow = overflow
+        self.name = name
+        self._put_times = deque()
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._finish_queued = False
+
+    def _put(self, item):
+        super()._put(item)
+        self._put_times.append(time.perf_counter())
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.qsize())
+
+    def _get(self):
+        self.dequeued += 1
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - self._put_times.popleft(), queue=self.name)
+        return super()._get()
+
+    def _drop_oldest(self):
+        self._queue.popleft()
+        self._put_times.popleft()
+        self.dropped += 1
+        QUEUE_DROPPED.inc(queue=self.name)
+        self.task_done()
+
+    async def put(self, item):
+        if self.overflow == "drop_oldest" and self.full():
+            self._drop_oldest()
+        await super().put(item)
+
+    def put_nowait(self, item):
+        if self.overflow == "drop_oldest" and self.full():
+            self._drop_oldest()
+        super().put_nowait(item)
+
+    def finish(self):
+        """
+        Enqueue the end-of-session sentinel once; later calls do nothing. A full
+        "drop_oldest" queue drops its oldest frame for it, a full "block" queue
+        keeps every frame and grows by one slot instead.
+        """
+        if self._finish_queued:
+            return
+        self._finish_queued = True
+        if self.full():
+            if self.overflow == "drop_oldest":
+                self._drop_oldest()
+            else:
+                self._maxsize += 1
+        super().put_nowait(FINISH)
+
+    def drain(self, limit: int) -> List:
+        items = []
+        while len(items) < limit and not self.empty():
+            items.append(self.get_nowait())
+        return items
+
+    def queued_bytes(self) -> int:
+        return sum(len(item) for item in self._queue if isinstance(item, str))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self.qsize(),
+            "max_depth": self.max_depth,
+            "maxsize": self.maxsize,
+            "enqueued": self.enqueued,
+            "dequeued": self.dequeued,
+            "dropped": self.dropped,
+        }
+
+
+def is_delta(frame) -> bool:
+    return isinstance(frame, str) and frame.startswith(_DELTA_PREFIX)
+
+
+def coalesce_frames(frames: List[str]) -> List[str]:
+    """Merge runs of delta frames from the same agent into a single delta frame."""
+    out = []
+    pending = None
+    for frame in frames:
+        if is_delta(frame):
+            delta = json.loads(frame)
+            if pending is not None and pending["name"] == delta["name"]:
+                pending["content"] += delta["content"]
+                continue
+            if pending is not None:
+                out.append(json.dumps(pending))
+            pending = delta
+            continue
+        if pending is not None:
+            out.append(json.dumps(pending))
+            pending = None
+        out.append(frame)
+    if pending is not None:
+        out.append(json.dumps(pending))
+    return out
+
+
+async def next_batch(queue: ClientQueue, flush_interval: float = CLIENT_FLUSH_INTERVAL, max_batch: int = CLIENT_MAX_BATCH) -> List[str]:
+    """
+    Wait for the next frame, then take whatever else is already queued (after
+    waiting up to flush_interval for more deltas) and coalesce it.
+    """
+    frames = [await queue.get()]
+    if flush_interval > 0 and is_delta(frames[0]) and queue.empty():
+        await asyncio.sleep(flush_interval)
+    frames.extend(queue.drain(max_batch - 1))
+    for _ in frames:
+        queue.task_done()
+    return coalesce_frames(frames)
@@ -0,0 +1,57 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import autogen
+
+# sync tools of all sessions share this many worker threads
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+# seconds a single tool call may take before the agent gets an error result instead
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+class CustomExecutorAgent(autogen.UserProxyAgent):
+    """
+    Executor that runs the tool calls of one message at the same time.
+
+    autogen already gathers the calls of a message, but a sync tool runs inline
+    and blocks the event loop (and every other session) until it returns. Here
+    sync tools run on a bounded, process-wide thread pool and every call gets a
+    timeout, so a turn takes as long as its slowest tool. Results keep the order
+    of the calls.
+
+    A timed-out sync tool cannot be interrupted; its thread finishes in the
+    background and the result is discarded.
+    """
+
+    def __init__(self, *args, tool_timeout: Optional[float] = TOOL_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tool_timeout = tool_timeout
+
+    async def a_execute_function(self, func_call) -> Tuple[bool, Dict[str, str]]:
+        func_name = func_call.get("name", "")
+        func = self._function_map.get(func_name)
+        if func is None or inspect.iscoroutinefunction(func):
+            call = super().a_execute_function(func_call)
+        else:
+            call = self._a_execute_in_thread(func_call)
+        try:
+            return await asyncio.wait_for(call, self.tool_timeout)
+        except asyncio.TimeoutError:
+            return False, {
+                "name": func_name,
+                "role": "function",
+                "content": f"Error: {func_name} did not finish within {self.tool_timeout} seconds.",
+            }
+
+    async def _a_execute_in_thread(self, func_call) -> Tuple[bool, Dict[str, str]]:
+        loop = asyncio.get_running_loop()
+        # keep the caller's IOStream and other context in the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_tool_executor, functools.partial(context.run, self.execute_function, func_call))
@@ -1,9 +1,14 @@
 from dataclasses import dataclass
 import json
 import sys
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
 from autogen import Agent, GroupChat, GroupChatManager
+from autogen.io.base import IOStream
 import logging
+from delta_stream import DeltaStream
+from llm_pool import PRIORITY_REPLY, PRIORITY_SELECTION, completion_priority
+from metrics import CHAT_PHASE_SECONDS
+from shared_transcript import attach_transcript
 
 
 class CustomGroupChatManager(GroupChatManager):
@@ -18,6 +23,7 @@ class CustomGroupChatManager(GroupChatManager):
         human_input_mode: Optional[str] = "NEVER",
         system_message: Optional[str] = "Group chat manager.",
         # seed: Optional[int] = 4,
+        stream_replies: bool = False,
         *args,
         **kwargs,
     ):
@@ -31,6 +37,10 @@ class CustomGroupChatManager(GroupChatManager):
             **kwargs,
         )
         self.register_reply(Agent, CustomGroupChatManager.run_chat, config=groupchat, reset_config=GroupChat.reset)
+        # forward the speaking agent's LLM deltas to the client while they are generated
+        self.stream_replies = stream_replies
+        # called with every message added to the transcript, e.g. to checkpoint it
+        self.on_message: Optional[Callable[[Dict], None]] = None
         # self._random = random.Random(seed)
 
     async def run_chat(
@@ -45,23 +55,26 @@ class CustomGroupChatManager(GroupChatManager):
         message = messages[-1]
         speaker = sender
         groupchat = config
+        # agents read the shared transcript instead of keeping broadcast copies
+        attach_transcript(self, groupchat)
         for i in range(groupchat.max_round):
             # set the name to speaker's name if the role is not function
             if message["role"] != "function":
                 message["name"] = speaker.name
+            # appending to the shared transcript broadcasts the message to every agent
             groupchat.messages.append(message)
-            # broadcast the message to all agents except the speaker
-            for agent in groupchat.agents:
-                if agent != speaker:
-                    self.send(message, agent, request_reply=False, silent=True)
+            if self.on_message is not None:
+                self.on_message(message)
             if i == groupchat.max_round - 1:
                 # the last round
                 break
             try:
-                # select the next speaker
-                speaker = groupchat.select_speaker(speaker, self)
-                # let the speaker speak
-                reply = await speaker.a_generate_reply(sender=self)
+                # select the next speaker without blocking the event loop shared by all sessions
+                with CHAT_PHASE_SECONDS.time(phase="select_speaker", agent=speaker.name), completion_priority(PRIORITY_SELECTION):
+                    speaker = await groupchat.a_select_speaker(speaker, self)
+                # let the speaker speak; for the user this is the wait for their next message
+                with CHAT_PHASE_SECONDS.time(phase="generate_reply", agent=speaker.name):
+                    reply = await self._generate_reply(speaker)
             except KeyboardInterrupt:
                 # let the admin agent speak if interrupted
                 if groupchat.admin_name in groupchat.agent_names:
@@ -83,7 +96,8 @@ class CustomGroupChatManager(GroupChatManager):
                         msg = f"'{reply['content']}'"
                 else:
                     msg = f"'{reply}'"
-                    await self.client_receive_queue.put(json.dumps({'type':msg_type, 'name': speaker.name, 'content': msg}))
+                    with CHAT_PHASE_SECONDS.time(phase="enqueue_reply", agent=speaker.name):
+                        await self.client_receive_queue.put(json.dumps({'type':msg_type, 'name': speaker.name, 'content': msg}))
                     # await self.client_receive_queue.put(f"{{'type':'{msg_type}', 'name': '{speaker.name}', 'content': {msg}}}")
                 # Send message to client
                 
@@ -113,10 +127,21 @@ class CustomGroupChatManager(GroupChatManager):
             #     # Send message to client
             #     await self.client_receive_queue.put(f"{{'type':'{msg_type}', 'name': '{speaker.name}', 'content': {msg}}}")
             # The speaker sends the message without requesting a reply
-            speaker.send(reply, self, request_reply=False)
+            with CHAT_PHASE_SECONDS.time(phase="send", agent=speaker.name):
+                await speaker.a_send(reply, self, request_reply=False)
             message = self.last_message(speaker)
         return True, None
 
+    async def _generate_reply(self, speaker: Agent) -> Union[str, Dict, None]:
+        with completion_priority(PRIORITY_REPLY):
+            return await self._a_speak(speaker)
+
+    async def _a_speak(self, speaker: Agent) -> Union[str, Dict, None]:
+        if not self.stream_replies or speaker.name == 'user':
+            return await speaker.a_generate_reply(sender=self)
+        with IOStream.set_default(DeltaStream(self.client_receive_queue, speaker.name)):
+            return await speaker.a_generate_reply(sender=self)
+
     def set_queues(self, client_sent_queue, client_receive_queue):
         self.client_sent_queue = client_sent_queue
         self.client_receive_queue = client_receive_queue
\ No newline at end of file
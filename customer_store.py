@@ -0,0 +1,383 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import pandas as pd
+
+from metrics import TOOL_SECONDS
+
+CUSTOMER_FILE_PATH = "test_data.xlsx"
+CUSTOMER_CACHE_DIR = os.getenv("CUSTOMER_CACHE_DIR", ".cache")
+# "sidecar" (default) queries the SQLite copy of the workbook, "memory" keeps a DataFrame per process
+CUSTOMER_STORE_BACKEND = os.getenv("CUSTOMER_STORE_BACKEND", "sidecar")
+SIDECAR_MMAP_BYTES = 256 * 1024 * 1024
+# profile digests kept per process, and how much history and how many merchants a digest lists
+CUSTOMER_DIGEST_CACHE_SIZE = int(os.getenv("CUSTOMER_DIGEST_CACHE_SIZE", "1024"))
+DIGEST_MONTHS = int(os.getenv("CUSTOMER_DIGEST_MONTHS", "12"))
+DIGEST_TOP_MERCHANTS = int(os.getenv("CUSTOMER_DIGEST_TOP_MERCHANTS", "5"))
+# transaction types that are spending at a merchant; deposits and loan payments are not
+SPEND_TYPES = tuple(
+    kind.strip().lower() for kind in os.getenv("CUSTOMER_SPEND_TYPES", "withdrawals,fund transfer").split(",") if kind.strip()
+)
+# customers fetched and serialised together by bulk_lookup
+BULK_CHUNK_SIZE = int(os.getenv("CUSTOMER_BULK_CHUNK_SIZE", "2000"))
+SIDECAR_TABLE = "transactions"
+
+# output key -> workbook column, in the order get_customer_details emits them
+RECORD_COLUMNS = {
+    'customer name': 'Name',
+    'customer id': 'cust_id',
+    'email address': 'email_address',
+    'Transaction type': 'Transaction Type',
+    'Transaction Amount': 'Transaction Amount',
+    'Transaction Date': 'Transaction Date',
+    'Reference Number': 'Reference Number',
+    'Mode of Payment': 'Mode of Payment',
+    'Transaction_Detail': 'Detail',
+}
+
+
+def load_customer_frame(path: str) -> pd.DataFrame:
+    """Read the customer workbook and normalise the id and date columns."""
+    with TOOL_SECONDS.time(tool="customer_store", target="read_excel"):
+        df = pd.read_excel(path)
+    df['cust_id'] = df['cust_id'].astype(str)
+    df['Transaction Date'] = pd.to_datetime(df['Transaction Date'], dayfirst=True, errors='coerce')
+    return df
+
+
+def mask_ids(ids: pd.Series) -> pd.Series:
+    """Censor every character of the customer id except the last four."""
+    return ids.astype(str).str.replace(r'.(?=.{4})', '*', regex=True)
+
+
+def serialise_records(rows: pd.DataFrame) -> List[Dict]:
+    """Turn customer rows into the dictionaries returned by get_customer_details."""
+    dates = rows['Transaction Date']
+    formatted_dates = dates.dt.strftime('%Y-%m-%d').astype(object).where(dates.notna(), None)
+    out = pd.DataFrame({
+        key: rows[column] for key, column in RECORD_COLUMNS.items()
+    })
+    out['customer id'] = mask_ids(rows['cust_id'])
+    out['Transaction Date'] = formatted_dates
+    return out.to_dict('records')
+
+
+def _totals(rows: pd.DataFrame, by: pd.Series) -> Dict[str, Dict]:
+    grouped = rows['Transaction Amount'].groupby(by, sort=False).agg(['size', 'sum'])
+    grouped = grouped.sort_values('sum', ascending=False).rename(columns={'size': 'count', 'sum': 'total'})
+    return grouped.to_dict('index')
+
+
+def _label(column: pd.Series) -> pd.Series:
+    # "DuitNow" and "duitnow " are one payment mode
+    return column.astype(str).str.strip().str.lower()
+
+
+def profile_digest(rows: pd.DataFrame) -> Dict:
+    """
+    Summarise the transactions of one customer for the credit recommender: spend
+    by transaction type and payment mode, monthly totals per type for the last
+    DIGEST_MONTHS months, and the DIGEST_TOP_MERCHANTS transaction details with
+    the most spend, counting only SPEND_TYPES transactions.
+    """
+    if rows.empty:
+        return {}
+    first = rows.iloc[0]
+    kinds = _label(rows['Transaction Type'])
+    dates = rows['Transaction Date']
+    dated = rows[dates.notna()]
+    monthly = (
+        dated['Transaction Amount']
+        .groupby([dated['Transaction Date'].dt.strftime('%Y-%m'), kinds[dates.notna()]])
+        .sum()
+        .unstack(fill_value=0)
+        .sort_index()
+        .tail(DIGEST_MONTHS)
+    )
+    spend = rows[kinds.isin(SPEND_TYPES)]
+    merchants = _totals(spend, _label(spend['Detail']))
+    return {
+        'customer name': first['Name'],
+        'customer id': mask_ids(rows['cust_id'].iloc[:1]).iloc[0],
+        'email address': first['email_address'],
+        'transactions': len(rows),
+        'first transaction': dates.min().strftime('%Y-%m-%d') if not dated.empty else None,
+        'last transaction': dates.max().strftime('%Y-%m-%d') if not dated.empty else None,
+        'by transaction type': _totals(rows, kinds),
+        'by mode of payment': _totals(rows, _label(rows['Mode of Payment'])),
+        'monthly totals by type': {month: {kind: total for kind, total in totals.items() if total}
+                                   for month, totals in monthly.to_dict('index').items()},
+        'top merchants by spend': dict(list(merchants.items())[:DIGEST_TOP_MERCHANTS]),
+    }
+
+
+class DigestCache:
+    """
+    Profile digests by cust_id, each tagged with the version of the data it was
+    computed from; a digest of an older version is recomputed. Least recently
+    used customers are dropped past max_size.
+    """
+
+    def __init__(self, max_size: int = CUSTOMER_DIGEST_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._digests: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cust_id: str, version) -> Optional[Dict]:
+        with self._lock:
+            entry = self._digests.get(cust_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._digests.move_to_end(cust_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, cust_id: str, version, digest: Dict):
+        with self._lock:
+            self._digests[cust_id] = (version, digest)
+            self._digests.move_to_end(cust_id)
+            while len(self._digests) > self.max_size:
+                self._digests.popitem(last=False)
+
+
+class CustomerStore:
+    """
+    Loads the customer workbook once per process and keeps a hash index from
+    cust_id to row positions. The workbook is re-read only when its mtime changes.
+    """
+
+    def __init__(self, path: str = CUSTOMER_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        # (frame, cust_id -> row positions), swapped as one object on reload
+        self._snapshot = (None, {})
+        self.digests = DigestCache()
+
+    def _refresh(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            df = load_customer_frame(self.path)
+            index = df.groupby('cust_id', sort=False).indices
+            self._snapshot = (df, index)
+            self._mtime = mtime
+
+    def frame(self) -> pd.DataFrame:
+        self._refresh()
+        return self._snapshot[0]
+
+    def rows(self, cust_id, offset: int = 0, limit: Optional[int] = None) -> pd.DataFrame:
+        self._refresh()
+        df, index = self._snapshot
+        positions = index.get(str(cust_id), [])
+        return df.iloc[positions[offset:None if limit is None else offset + limit]]
+
+    def rows_for(self, cust_ids: List[str]) -> pd.DataFrame:
+        """The rows of several customers, in one gather over the index."""
+        self._refresh()
+        df, index = self._snapshot
+        positions = [index[cust_id] for cust_id in set(cust_ids) if cust_id in index]
+        return df.iloc[np.concatenate(positions) if positions else []]
+
+    def lookup(self, cust_id, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        """Return the serialised transaction rows of one customer, or limit of them from offset."""
+        return serialise_records(self.rows(cust_id, offset, limit))
+
+    def digest(self, cust_id) -> Dict:
+        """Return the profile digest of one customer, computed once per version of the workbook."""
+        self._refresh()
+        version = self._mtime
+        digest = self.digests.get(str(cust_id), version)
+        if digest is None:
+            digest = profile_digest(self.rows(cust_id))
+            self.digests.set(str(cust_id), version, digest)
+        return digest
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sidecar_path(source: str, digest: str, cache_dir: str = CUSTOMER_CACHE_DIR) -> str:
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, f"{name}.{digest[:16]}.sqlite")
+
+
+def build_sidecar(source: str, target: str) -> str:
+    """
+    Convert the customer workbook into an indexed SQLite file.
+
+    The file is written next to its final name and renamed into place, so workers
+    racing to build the same sidecar never observe a partial file.
+    """
+    df = load_customer_frame(source)
+    df['Transaction Date'] = df['Transaction Date'].dt.strftime('%Y-%m-%d')
+    df.insert(0, 'row', range(len(df)))
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    conn = sqlite3.connect(tmp)
+    try:
+        df.to_sql(SIDECAR_TABLE, conn, index=False, if_exists='replace')
+        conn.execute(f'CREATE INDEX idx_{SIDECAR_TABLE}_cust_id ON {SIDECAR_TABLE} (cust_id, row)')
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, target)
+    return target
+
+
+def ensure_sidecar(source: str = CUSTOMER_FILE_PATH, cache_dir: str = CUSTOMER_CACHE_DIR) -> str:
+    """Return the sidecar for the current content of source, building it if needed."""
+    target = sidecar_path(source, file_digest(source), cache_dir)
+    if not os.path.exists(target):
+        build_sidecar(source, target)
+        remove_stale_sidecars(source, target, cache_dir)
+    return target
+
+
+def remove_stale_sidecars(source: str, current: str, cache_dir: str = CUSTOMER_CACHE_DIR):
+    """Delete the sidecars of earlier versions of source; workers still reading one keep their open file."""
+    name = os.path.splitext(os.path.basename(source))[0]
+    pattern = re.compile(rf"{re.escape(name)}\.[0-9a-f]{{16}}\.sqlite")
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if pattern.fullmatch(entry) and os.path.abspath(path) != os.path.abspath(current):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another worker removed it first
+                pass
+
+
+class SidecarCustomerStore:
+    """
+    Serves customer rows from the SQLite sidecar of the workbook. The sidecar is
+    opened read-only and memory-mapped, so every worker process shares the same
+    page cache instead of holding its own DataFrame.
+    """
+
+    def __init__(self, path: str = CUSTOMER_FILE_PATH, cache_dir: str = CUSTOMER_CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._sidecar: Optional[str] = None
+        self._local = threading.local()
+        self.digests = DigestCache()
+
+    def _refresh(self) -> str:
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._sidecar = ensure_sidecar(self.path, self.cache_dir)
+                    self._mtime = mtime
+        return self._sidecar
+
+    def _connection(self) -> sqlite3.Connection:
+        sidecar = self._refresh()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.sidecar != sidecar:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{os.path.abspath(sidecar)}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={SIDECAR_MMAP_BYTES}")
+            self._local.conn, self._local.sidecar = conn, sidecar
+        return conn
+
+    def query(self, sql: str, params=()) -> pd.DataFrame:
+        rows = pd.read_sql_query(sql, self._connection(), params=params)
+        rows['Transaction Date'] = pd.to_datetime(rows['Transaction Date'], format='%Y-%m-%d')
+        return rows
+
+    def frame(self) -> pd.DataFrame:
+        return self.query(f'SELECT * FROM {SIDECAR_TABLE} ORDER BY row')
+
+    def rows(self, cust_id, offset: int = 0, limit: Optional[int] = None) -> pd.DataFrame:
+        return self.query(
+            f'SELECT * FROM {SIDECAR_TABLE} WHERE cust_id = ? ORDER BY row LIMIT ? OFFSET ?',
+            (str(cust_id), -1 if limit is None else limit, offset),
+        )
+
+    def rows_for(self, cust_ids: List[str]) -> pd.DataFrame:
+        """The rows of several customers, in one query over the cust_id index."""
+        return self.query(
+            f'SELECT * FROM {SIDECAR_TABLE} WHERE cust_id IN (SELECT value FROM json_each(?)) ORDER BY row',
+            (json.dumps(sorted(set(cust_ids))),),
+        )
+
+    def lookup(self, cust_id, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        """Return the serialised transaction rows of one customer, or limit of them from offset."""
+        return serialise_records(self.rows(cust_id, offset, limit))
+
+    def digest(self, cust_id) -> Dict:
+        """Return the profile digest of one customer, computed once per content of the workbook."""
+        # the sidecar is named after the workbook's content hash
+        version = self._refresh()
+        digest = self.digests.get(str(cust_id), version)
+        if digest is None:
+            digest = profile_digest(self.rows(cust_id))
+            self.digests.set(str(cust_id), version, digest)
+        return digest
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_customer_store() -> CustomerStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if CUSTOMER_STORE_BACKEND == "memory":
+                    _store = CustomerStore()
+                else:
+                    _store = SidecarCustomerStore()
+    return _store
+
+
+def bulk_lookup(cust_ids: Iterable, store=None, chunk_size: int = BULK_CHUNK_SIZE) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    Yield (cust_id, serialised rows) for every requested id, in request order,
+    formatted like get_customer_details. Each chunk of ids is fetched with one
+    pass over the store's cust_id index and serialised in one go, instead of a
+    lookup per customer.
+    """
+    store = store or get_customer_store()
+    ids = [str(cust_id) for cust_id in cust_ids]
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        rows = store.rows_for(chunk)
+        records = serialise_records(rows)
+        groups = rows.groupby('cust_id', sort=False).indices
+        for cust_id in chunk:
+            yield cust_id, [records[position] for position in groups.get(cust_id, ())]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the customer workbook into its SQLite sidecar.")
+    parser.add_argument("source", nargs="?", default=CUSTOMER_FILE_PATH)
+    parser.add_argument("--cache-dir", default=CUSTOMER_CACHE_DIR)
+    args = parser.parse_args()
+    print(ensure_sidecar(args.source, args.cache_dir))
@@ -0,0 +1,48 @@
+import asyncio
+import concurrent.futures
+import json
+from typing import Any
+
+from autogen.io.base import IOStream
+
+
+class DeltaStream:
+    """
+    IOStream that forwards the streamed LLM deltas of the speaking agent to the
+    websocket client as {"type": "delta"} frames.
+
+    autogen's OpenAI client prints every streamed content chunk with
+    ``print(content, end="", flush=True)`` from the executor thread that runs the
+    completion; those chunks are pushed onto the client queue through the event
+    loop. Anything else is printed to the console as before.
+
+    When the client queue is bounded and full, the completion thread waits for
+    room (up to put_timeout seconds), so a slow client slows the stream down
+    instead of growing memory.
+    """
+
+    put_timeout = 30.0
+
+    def __init__(self, client_receive_queue: asyncio.Queue, name: str, loop: asyncio.AbstractEventLoop = None):
+        self.client_receive_queue = client_receive_queue
+        self.name = name
+        self.loop = loop or asyncio.get_running_loop()
+        self.deltas = 0
+        self._console = IOStream.get_global_default()
+
+    def print(self, *objects: Any, sep: str = " ", end: str = "\n", flush: bool = False) -> None:
+        if end == "" and flush and objects:
+            content = sep.join(str(o) for o in objects)
+            if content:
+                self.deltas += 1
+                frame = json.dumps({'type': 'delta', 'name': self.name, 'content': content})
+                future = asyncio.run_coroutine_threadsafe(self.client_receive_queue.put(frame), self.loop)
+                try:
+                    future.result(timeout=self.put_timeout)
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+            return
+        self._console.print(*objects, sep=sep, end=end, flush=flush)
+
+    def input(self, prompt: str = "", *, password: bool = False) -> str:
+        return self._console.input(prompt, password=password)
@@ -1,7 +1,117 @@
 from autogen import Agent, GroupChat, GroupChatManager, ConversableAgent
+import asyncio
 import autogen
-from typing import  Optional, List, Dict
+import os
+import threading
+import time
+from collections import deque
+from typing import  Optional, List, Dict, Tuple, Union
 from openai import OpenAIError
+from metrics import FALLBACK_REPLIES
+from llm_pool import PRIORITY_REPLY, PRIORITY_SELECTION, completion_priority
+
+# percentile of the primary's recent latencies after which the fallback is asked too, 0 disables hedging
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# hedge deadline while fewer than HEDGE_MIN_SAMPLES latencies are known, and its lower bound after
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "10"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+# consecutive failures that open an endpoint's circuit, and seconds before it is tried again
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_RECOVERY = float(os.getenv("BREAKER_RECOVERY", "30"))
+
+FAILURES = (TimeoutError, asyncio.TimeoutError, OpenAIError)
+
+
+class LatencyTracker:
+    """Recent reply latencies of one endpoint and the hedge deadline derived from them."""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def deadline(self, percentile: float, min_samples: int = HEDGE_MIN_SAMPLES,
+                 default: float = HEDGE_DELAY, minimum: float = HEDGE_MIN_DELAY) -> float:
+        if len(self._samples) < min_samples:
+            return default
+        return max(minimum, self.percentile(percentile))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one endpoint. After `failures`
+    failures in a row the circuit opens and requests skip the endpoint; every
+    `recovery` seconds a single trial request is let through, and its outcome
+    closes or reopens the circuit. A trial that never reports back (say it lost
+    a hedge race) just waits for the next one.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: int = BREAKER_FAILURES, recovery: float = BREAKER_RECOVERY):
+        self.failures = failures
+        self.recovery = recovery
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.recovery:
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failures:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_latencies: Dict[str, LatencyTracker] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_endpoints_lock = threading.Lock()
+
+
+def endpoint_key(agent: ConversableAgent) -> str:
+    """The model endpoint an agent's first config points at."""
+    config_list = agent.llm_config.get("config_list") or [agent.llm_config]
+    config = config_list[0]
+    return f"{config.get('base_url') or config.get('azure_endpoint') or 'openai'}/{config.get('model', '')}"
+
+
+def get_latency_tracker(endpoint: str) -> LatencyTracker:
+    with _endpoints_lock:
+        return _latencies.setdefault(endpoint, LatencyTracker())
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    with _endpoints_lock:
+        return _breakers.setdefault(endpoint, CircuitBreaker())
+
 
 class FallbackGroupChatManager(GroupChatManager):
     """
@@ -9,14 +119,82 @@ class FallbackGroupChatManager(GroupChatManager):
     or openai.APIConnectionError occurs for any of the agents. For example, if sending a request
     to a model deployed on a Raspberry Pi while the device is offline, the system will instead use
     the fallback_agent ConversableAgent to continue its operation.
-    """
-    fallback_agent = None
-    def __init__(self, fallback_agent: ConversableAgent, *args, **kwargs):
 
-        FallbackGroupChatManager.fallback_agent = fallback_agent
+    A speaker that has not answered within hedge_percentile of its endpoint's recent latencies
+    is raced against the fallback_agent, and whichever answers first is used. The other request is
+    not aborted: its completion runs to the end on its executor thread, still using quota and a pool
+    connection, and its reply is discarded. Endpoints that keep failing are skipped by a circuit
+    breaker until they recover.
+    """
+    def __init__(self, fallback_agent: ConversableAgent, *args, hedge_percentile: float = HEDGE_PERCENTILE, **kwargs):
         super().__init__(*args, **kwargs)
+        self.fallback_agent = fallback_agent
+        self.hedge_percentile = hedge_percentile
         self.replace_reply_func(GroupChatManager.a_run_chat, FallbackGroupChatManager.a_run_chat)
 
+    async def a_generate_with_fallback(self, speaker: Agent) -> Tuple[Agent, Union[str, Dict, None]]:
+        """Let the speaker speak, hedged with and backed by the fallback_agent; returns who answered and the reply."""
+        if self.fallback_agent is None or speaker is self.fallback_agent or not getattr(speaker, "llm_config", None):
+            return speaker, await speaker.a_generate_reply(sender=self)
+        endpoint = endpoint_key(speaker)
+        breaker = get_circuit_breaker(endpoint)
+        if not breaker.allow():
+            FALLBACK_REPLIES.inc(agent=speaker.name, outcome="circuit_open")
+            return self.fallback_agent, self._fallback_notice(await self._a_fallback_reply(speaker), "is unavailable")
+
+        tracker = get_latency_tracker(endpoint)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(speaker.a_generate_reply(sender=self))
+        hedge = None
+        pending = {primary}
+        try:
+            while True:
+                # only the wait for the hedge deadline is bounded
+                timeout = tracker.deadline(self.hedge_percentile) - (time.monotonic() - start) \
+                    if hedge is None and self.hedge_percentile else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the primary is past its deadline: race the fallback against it
+                    hedge = asyncio.ensure_future(self._a_fallback_reply(speaker))
+                    pending.add(hedge)
+                    continue
+                if primary in done:
+                    error = primary.exception()
+                    if error is None:
+                        tracker.observe(time.monotonic() - start)
+                        breaker.success()
+                        FALLBACK_REPLIES.inc(agent=speaker.name, outcome="primary")
+                        return speaker, primary.result()
+                    if not isinstance(error, FAILURES):
+                        raise error
+                    breaker.failure()
+                    if hedge is None:
+                        FALLBACK_REPLIES.inc(agent=speaker.name, outcome="failed")
+                        return self.fallback_agent, self._fallback_notice(await self._a_fallback_reply(speaker), "failed")
+                # a failed hedge is only final once the primary has failed too
+                if hedge is not None and hedge.done() and (hedge.exception() is None or not pending):
+                    if not primary.done():
+                        # the primary took at least this long, which keeps the percentile honest
+                        tracker.observe(time.monotonic() - start)
+                    FALLBACK_REPLIES.inc(agent=speaker.name, outcome="hedged")
+                    return self.fallback_agent, hedge.result()
+        finally:
+            # stops waiting for the loser; the completion it started still finishes on its thread and is discarded
+            for task in pending:
+                task.cancel()
+
+    async def _a_fallback_reply(self, speaker: Agent) -> Union[str, Dict, None]:
+        # the fallback answers the conversation as the speaker sees it
+        return await self.fallback_agent.a_generate_reply(messages=list(speaker.chat_messages[self]), sender=self)
+
+    def _fallback_notice(self, reply, reason: str):
+        notice = f"The Agent {reason}. Falling back to {self.fallback_agent.name}...\n\n"
+        if isinstance(reply, dict):
+            reply['content'] = notice + (reply.get('content') or "")
+        elif isinstance(reply, str):
+            reply = notice + reply
+        return reply
+
     async def a_run_chat(
         self,
         messages: Optional[List[Dict]] = None,
@@ -25,7 +203,7 @@ class FallbackGroupChatManager(GroupChatManager):
     ):
         """
         Run a group chat asynchronously. Overrides GroupChatManager.a_run_chat method, only
-        differing in handling a failed response generation request from the selected speaker.
+        differing in handling a slow or failed response generation request from the selected speaker.
         """
         if messages is None:
             messages = self._oai_messages[sender]
@@ -63,21 +241,12 @@ class FallbackGroupChatManager(GroupChatManager):
                 break
             try:
                 # select the next speaker
-                speaker = await groupchat.a_select_speaker(speaker, self)
+                with completion_priority(PRIORITY_SELECTION):
+                    speaker = await groupchat.a_select_speaker(speaker, self)
                 # let the speaker speak
-                # NOTE: uses a fallback agent in case the selected speaker fails to respond
-                try:
-                    reply = await speaker.a_generate_reply(sender=self)
-                except (TimeoutError, OpenAIError):
-                    reply = {'content': "The Agent timed out. Falling back to GPT-4...",
-                             'name': speaker.name, 'role': 'user'}
-                    await speaker.a_send(reply, self, request_reply=False, silent=silent)
-                    speaker = self.fallback_agent
-                    reply = await speaker.a_generate_reply(sender=self) 
-                    if isinstance(reply, dict):
-                        reply['content'] = "The Agent timed out. Falling back to GPT-4...\n\n"  + reply['content']
-                    elif isinstance(reply, str):
-                        reply = "The Agent timed out. Falling back to GPT-4...\n\n"  + reply
+                # NOTE: the fallback agent answers instead when the selected speaker is slow or fails
+                with completion_priority(PRIORITY_REPLY):
+                    speaker, reply = await self.a_generate_with_fallback(speaker)
             except KeyboardInterrupt:
                 # let the admin agent speak if interrupted
                 if groupchat.admin_name in groupchat.agent_names:
@@ -1,12 +1,34 @@
+import asyncio
+import json
 import os
+import time
+import uuid
 import autogen
 from custom_user_proxy import CustomUserProxyAgent
+from custom_executor_agent import CustomExecutorAgent
 from custom_groupchat_manager import CustomGroupChatManager
-import asyncio
+from agent_registry import AgentTemplateRegistry, get_agent_registry
+from client_queue import FINISH, ClientQueue
+from intent_router import get_intent_router
+from history_compaction import HistoryCompaction
+from llm_cache import get_llm_cache
+from llm_pool import llm_session, pooled_config
+from session_checkpoint import get_checkpointer
+from session_store import WORKER_ID
 from dotenv import load_dotenv
-from agent_tools import get_customer_details, bing_search
+from agent_tools import get_customer_details, a_bing_search
 load_dotenv()
 
+# stream completions so replies reach the websocket token by token
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() in ("1", "true", "yes")
+# "local" picks the next speaker with the intent router, "llm" always asks the model
+SPEAKER_SELECTION = os.getenv("SPEAKER_SELECTION", "local")
+
+# rough memory of an idle session (cloned agents, group chat, manager, queues) and of a
+# transcript message beyond its text, measured with benchmarks/bench_session_construction.py
+SESSION_BASE_BYTES = 36 * 1024
+MESSAGE_OVERHEAD_BYTES = 700
+
 llm_config = [
     {
         "model": "GPT4",
@@ -15,106 +37,151 @@ llm_config = [
         "api_type": "azure",
         "api_version": "2024-02-01",
         "max_tokens": 2048,
-        "stream": False
+        "stream": STREAM_REPLIES
     }
 ]
 
+def build_agent_templates() -> AgentTemplateRegistry:
+    """Build the agents, their tool schemas and LLM clients once per process."""
+    # agent and speaker-selection completions go through the shared response cache
+    llm_cache = get_llm_cache()
+    # every agent's client sends through the shared connection pool and rate limit admission
+    config_list = [pooled_config(config) for config in llm_config]
+    if llm_cache:
+        config_list = [dict(config, cache=llm_cache) for config in config_list]
+
+    #region desc = "AGENTS"
+    # runs the tool calls of a message concurrently, sync tools on a thread pool
+    executor = CustomExecutorAgent(
+        name="executor",
+        human_input_mode="NEVER",
+        llm_config=False
+    )      
+
+    user_proxy = CustomUserProxyAgent( 
+        name="user",
+        human_input_mode="ALWAYS", 
+        is_termination_msg=lambda x: x.get("content", "") and x.get("content", "").rstrip().endswith("TERMINATE"),
+        code_execution_config=False,
+        llm_config=False
+    )
+
+    information_recommender_agent = autogen.ConversableAgent(
+        name="information_recommender_agent",
+        system_message="you are a UOB Bank credit card expert employed to help new users find information regarding credit cards offered in UOB Bank Singapore"
+            "trigger bing_search function to get the answers"
+            "When user provides their current OCBC credit card name and asks for the similar UOB credit card, do the comparison and return the competitive UOB credit card suggestions only"
+            "DO NOT CROSS SELL: MEANING DO NOT MARKET PERSONAL LOAN WHEN YOU ARE EMPLOYED TO DO RECOMMEND ONLY CREDIT CARD"
+            "STRICTLY DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY",
+        description="You are the UOB Bank Credit Card expert specifically appointed to answer the credit card related question for new user",
+        llm_config={"config_list": config_list},
+    )
+
+    personalised_credit_recommender_agent = autogen.ConversableAgent(
+        name="credit_recommender_agent",
+        system_message="you are a UOB Bank credit card expert employed to help existing UOB users find information regarding credit cards offered in UOB Bank Singapore based on their customer profile"
+            "trigger bing_search function to get the answers"
+            "When UOB user asks for the UOB credit card suggestions only, trigger get_customer_details function by passing 345566767 cust_id variable and use the customer profile data output provided to tailor your recommendations"
+            "ONLY IF YOU SUCCEED FINDING THE CUSTOMISED CREDIT CARD, ASSUME USER HAS EXISTING PERSONAL LOAN AND OFFER SOME ATTRACTIVE DISCOUNTS IN INTEREST RATE FOR CREDIT CARD IN YOUR RESPONSE"
+            "DO NOT CROSS SELL: MEANING DO NOT MARKET PERSONAL LOAN WHEN YOU ARE EMPLOYED TO RECOMMEND ONLY CREDIT CARD"
+            "once you are done with forming the credit card responses, make sure you include the following text at the end: 'You dont need to remember all the things, I will mail all the conversation to your registered email address'"
+            "STRICTLY DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY",
+        description="You are the UOB Bank Credit Card expert specifically appointed to answer the personalised credit card questions for existing user",
+        llm_config={"config_list": config_list},
+    )
+
+    loan_assitant = autogen.ConversableAgent(
+        name="loan_assitant",
+        system_message="You are the UOB Bank Loan Specialist employed to help users find information regarding loans offered in UOB Bank Singapore"
+                "You help to find the information related to Loans by triggering the bing_search function"
+                "summarize the list of dictionary from bing_search function not more than 50 words"
+                "ONLY When user asks with the intention of comparison, Ensure to include results from both OCBC and UOB websites along with factors you considered for Comparison"
+                "DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY",
+        description="You are the UOB Bank Loan expert specifically appointed to answer the Loan related question",
+        llm_config={"config_list": config_list},
+    )
+
+    customer_assitant = autogen.ConversableAgent(
+        name="customer_assitant",
+        system_message="You are UOB Bank Customer Assistant. you can help to find any information related to queries on Insurance"
+                "ASSUME USER HAS PERSONAL LOAN IN UOB Bank ALREADY and tailor your recommendation based on that with some best offers"
+                "DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY"
+                "Ensure to include results from both OCBC and UOB websites only when user asks with the intention of comparison"
+                "DO NOY CROSS SELL: MEANING DO NOT RECOMMEND CREDIT CARD WHEN YOU ARE EMPLOYED TO ANSWER INSURANCE RELATED QUESTION ONLY"
+                "Summarize your answer not more than 50 words",
+        description="You are the UOB Bank Loan expert specifically appointed to answer the Insurance related question",
+        llm_config={"config_list": config_list}
+    )
+
+    loan_assitant.register_for_llm(
+        name="bing_search", description="a tool to answer customer question from bing_search function"
+        )(a_bing_search)
+    executor.register_for_execution(name="bing_search")(a_bing_search)
+
+    information_recommender_agent.register_for_llm(
+        name="information_bing_search",
+        description="a tool to answer customer question from bing_search function. Ensure to include results from both OCBC and UOB websites."
+        )(a_bing_search)
+    executor.register_for_execution(name="information_bing_search")(a_bing_search)
+
+    personalised_credit_recommender_agent.register_for_llm(
+        name="get_customer_details",
+        description="Get the customer's profile from the customer database: spend by transaction type and mode of payment, "
+                    "monthly totals and top merchants by spend. Pass page 1 or more only if individual transactions are needed."
+        )(get_customer_details)
+    executor.register_for_execution(name="get_customer_details")(get_customer_details)
+
+    personalised_credit_recommender_agent.register_for_llm(
+        name="personalised_bing_search",
+        description="Get the customer details from the customer database"
+        )(a_bing_search)
+    executor.register_for_execution(name="personalised_bing_search")(a_bing_search)
+
+    registry = AgentTemplateRegistry(manager_llm_config={"config_list": config_list})
+    for agent in [
+        executor,
+        user_proxy,
+        loan_assitant,
+        customer_assitant,
+        information_recommender_agent,
+        personalised_credit_recommender_agent,
+    ]:
+        registry.add(agent)
+    return registry
+
+
+def get_agent_templates() -> AgentTemplateRegistry:
+    return get_agent_registry(build_agent_templates)
+
+
 class AutogenChat():
-    def __init__(self, chat_id=None, websocket=None):
+    def __init__(self, chat_id=None, websocket=None, templates: AgentTemplateRegistry = None):
         self.websocket = websocket
         self.chat_id = chat_id
-        self.client_sent_queue = asyncio.Queue()
-        self.client_receive_queue = asyncio.Queue()
+        self.created_at = time.monotonic()
+        self.last_activity = self.created_at
+        self.client_sent_queue = ClientQueue(name="client_sent")
+        self.client_receive_queue = ClientQueue(name="client_receive")
 
         #region desc = "AGENTS"
-        self.executor = autogen.UserProxyAgent(
-            name="executor",
-            human_input_mode="NEVER",
-            llm_config=False
-        )      
-
-        self.user_proxy = CustomUserProxyAgent( 
-            name="user",
-            human_input_mode="ALWAYS", 
-            is_termination_msg=lambda x: x.get("content", "") and x.get("content", "").rstrip().endswith("TERMINATE"),
-            code_execution_config=False,
-            llm_config=False
-        )
-
-
-        self.information_recommender_agent = autogen.ConversableAgent(
-            name="information_recommender_agent",
-            system_message="you are a UOB Bank credit card expert employed to help new users find information regarding credit cards offered in UOB Bank Singapore"
-                "trigger bing_search function to get the answers"
-                "When user provides their current OCBC credit card name and asks for the similar UOB credit card, do the comparison and return the competitive UOB credit card suggestions only"
-                "DO NOT CROSS SELL: MEANING DO NOT MARKET PERSONAL LOAN WHEN YOU ARE EMPLOYED TO DO RECOMMEND ONLY CREDIT CARD"
-                "STRICTLY DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY",
-            description="You are the UOB Bank Credit Card expert specifically appointed to answer the credit card related question for new user",
-            llm_config={"config_list": llm_config},
-        )
-
-        self.personalised_credit_recommender_agent = autogen.ConversableAgent(
-            name="credit_recommender_agent",
-            system_message="you are a UOB Bank credit card expert employed to help existing UOB users find information regarding credit cards offered in UOB Bank Singapore based on their customer profile"
-                "trigger bing_search function to get the answers"
-                "When UOB user asks for the UOB credit card suggestions only, trigger get_customer_details function by passing 345566767 cust_id variable and use the customer profile data output provided to tailor your recommendations"
-                "ONLY IF YOU SUCCEED FINDING THE CUSTOMISED CREDIT CARD, ASSUME USER HAS EXISTING PERSONAL LOAN AND OFFER SOME ATTRACTIVE DISCOUNTS IN INTEREST RATE FOR CREDIT CARD IN YOUR RESPONSE"
-                "DO NOT CROSS SELL: MEANING DO NOT MARKET PERSONAL LOAN WHEN YOU ARE EMPLOYED TO RECOMMEND ONLY CREDIT CARD"
-                "once you are done with forming the credit card responses, make sure you include the following text at the end: 'You dont need to remember all the things, I will mail all the conversation to your registered email address'"
-                "STRICTLY DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY",
-            description="You are the UOB Bank Credit Card expert specifically appointed to answer the personalised credit card questions for existing user",
-            llm_config={"config_list": llm_config},
-        )
-
-
-        self.loan_assitant = autogen.ConversableAgent(
-            name="loan_assitant",
-            system_message="You are the UOB Bank Loan Specialist employed to help users find information regarding loans offered in UOB Bank Singapore"
-                    "You help to find the information related to Loans by triggering the bing_search function"
-                    "summarize the list of dictionary from bing_search function not more than 50 words"
-                    "ONLY When user asks with the intention of comparison, Ensure to include results from both OCBC and UOB websites along with factors you considered for Comparison"
-                    "DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY",
-            description="You are the UOB Bank Loan expert specifically appointed to answer the Loan related question",
-            llm_config={"config_list": llm_config},
-        )
-
-        
-        self.customer_assitant = autogen.ConversableAgent(
-            name="customer_assitant",
-            system_message="You are UOB Bank Customer Assistant. you can help to find any information related to queries on Insurance"
-                    "ASSUME USER HAS PERSONAL LOAN IN UOB Bank ALREADY and tailor your recommendation based on that with some best offers"
-                    "DO NOT REPLY MULTIPLE TIMES TO THE USER CONSECUTIVELY. RESPOND BACK TO USER IN SINGLE ANSWER AFTER THOROUGH ANALYSIS OF THE USER QUERY"
-                    "Ensure to include results from both OCBC and UOB websites only when user asks with the intention of comparison"
-                    "DO NOY CROSS SELL: MEANING DO NOT RECOMMEND CREDIT CARD WHEN YOU ARE EMPLOYED TO ANSWER INSURANCE RELATED QUESTION ONLY"
-                    "Summarize your answer not more than 50 words",
-            description="You are the UOB Bank Loan expert specifically appointed to answer the Insurance related question",
-            llm_config={"config_list": llm_config}
-        )
-
-
-        self.loan_assitant.register_for_llm(
-            name="bing_search", description="a tool to answer customer question from bing_search function"
-            )(bing_search)
-        self.executor.register_for_execution(name="bing_search")(bing_search)
-
-        self.information_recommender_agent.register_for_llm(
-            name="information_bing_search",
-            description="a tool to answer customer question from bing_search function. Ensure to include results from both OCBC and UOB websites."
-            )(bing_search)
-        self.executor.register_for_execution(name="information_bing_search")(bing_search)
-
-
-        self.personalised_credit_recommender_agent.register_for_llm(
-            name="get_customer_details",
-            description="Get the customer details from the customer database"
-            )(get_customer_details)
-        self.executor.register_for_execution(name="get_customer_details")(get_customer_details)
-
-        self.personalised_credit_recommender_agent.register_for_llm(
-            name="personalised_bing_search",
-            description="Get the customer details from the customer database"
-            )(bing_search)
-        self.executor.register_for_execution(name="personalised_bing_search")(bing_search)
+        # agents are cloned from process-wide templates; only conversation state is per session
+        templates = templates or get_agent_templates()
+        self.executor = templates.instantiate("executor")
+        self.user_proxy = templates.instantiate("user")
+        self.information_recommender_agent = templates.instantiate("information_recommender_agent")
+        self.personalised_credit_recommender_agent = templates.instantiate("credit_recommender_agent")
+        self.loan_assitant = templates.instantiate("loan_assitant")
+        self.customer_assitant = templates.instantiate("customer_assitant")
+
+        # compact what each expert sends to its LLM; the shared transcript stays complete
+        self.history_compaction = HistoryCompaction()
+        for agent in [
+            self.loan_assitant,
+            self.customer_assitant,
+            self.information_recommender_agent,
+            self.personalised_credit_recommender_agent,
+        ]:
+            self.history_compaction.add_to_agent(agent)
 
         # add the queues to communicate 
         self.user_proxy.set_queues(self.client_sent_queue, self.client_receive_queue)
@@ -130,16 +197,145 @@ class AutogenChat():
             self.personalised_credit_recommender_agent
             ],
         messages=[],
-        max_round=25)
+        max_round=25,
+        speaker_selection_method=get_intent_router() if SPEAKER_SELECTION == "local" else "auto")
         self.manager = CustomGroupChatManager(groupchat=self.groupchat, 
-            llm_config={"config_list":llm_config},
-            human_input_mode="ALWAYS" ) 
+            llm_config=False,
+            human_input_mode="ALWAYS",
+            stream_replies=STREAM_REPLIES ) 
+        templates.attach_manager_llm(self.manager)
 
         self.manager.set_queues(self.client_sent_queue, self.client_receive_queue)    
 
+        # every transcript message and client input is checkpointed, so a reconnect to any worker can resume the chat
+        self.checkpointer = get_checkpointer()
+        if self.checkpointer is not None:
+            self.manager.on_message = self._checkpoint_message
+        # identifies this connection as the one serving chat_id
+        self.owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        self.claimed = False
+        self.resumed = False
+        self.finished = False
+        self.abandoned = False
+        self._pending_inputs = []
+        self._chat = None
+
+    def queue_stats(self):
+        return {
+            "client_sent_queue": self.client_sent_queue.stats(),
+            "client_receive_queue": self.client_receive_queue.stats(),
+        }
+
+    def history_stats(self):
+        return self.history_compaction.stats()
+
+    def touch(self):
+        """Record client traffic, which keeps the session from being evicted as idle."""
+        self.last_activity = time.monotonic()
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by this session: fixed agent state, transcript and queued frames."""
+        messages = self.groupchat.messages
+        transcript = len(json.dumps(messages, default=str)) + MESSAGE_OVERHEAD_BYTES * len(messages)
+        queued = self.client_sent_queue.queued_bytes() + self.client_receive_queue.queued_bytes()
+        return SESSION_BASE_BYTES + transcript + queued
+
+    def describe(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        return {
+            "chat_id": self.chat_id,
+            "age_seconds": round(now - self.created_at, 1),
+            "idle_seconds": round(now - self.last_activity, 1),
+            "messages": len(self.groupchat.messages),
+            "memory_bytes": self.memory_estimate(),
+            "queued_frames": self.client_sent_queue.qsize() + self.client_receive_queue.qsize(),
+        }
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        """End the chat and the send pump, then close the websocket."""
+        self.abandon()
+        self.client_sent_queue.finish()
+        self.client_receive_queue.finish()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            # already closed by the client
+            pass
+
+    def _checkpoint_message(self, message):
+        self.checkpointer.record(self.chat_id, len(self.groupchat.messages) - 1, message)
+        if message.get("name") == self.user_proxy.name:
+            # the client input behind this message has been consumed
+            self.checkpointer.consume_input(self.chat_id, message.get("content"))
+
+    async def claim(self):
+        """Take over chat_id from whichever connection served it before."""
+        if self.checkpointer is not None:
+            await self.checkpointer.claim(self.chat_id, self.owner)
+            self.claimed = True
+
+    async def release(self):
+        if self.checkpointer is not None:
+            await self.checkpointer.release(self.chat_id, self.owner)
+
+    async def moved(self) -> bool:
+        """Whether a newer connection, possibly on another worker, has claimed chat_id."""
+        if self.checkpointer is None or not self.claimed:
+            return False
+        return await self.checkpointer.owner(self.chat_id) != self.owner
+
+    async def restore(self) -> int:
+        """Load the checkpointed transcript and unanswered inputs of this chat_id; returns the number of messages."""
+        if self.checkpointer is None:
+            return 0
+        messages, inputs = await self.checkpointer.load(self.chat_id)
+        if messages and messages[-1].get("name") == self.user_proxy.name:
+            # the question the dropped connection never answered is asked again
+            inputs.insert(0, messages.pop()["content"])
+        self._pending_inputs = inputs
+        if messages:
+            self.groupchat.messages.extend(messages)
+            self.resumed = True
+        return len(messages)
+
+    async def receive_input(self) -> str:
+        data = await self.websocket.receive_text()
+        self.touch()
+        if self.checkpointer is not None and data != FINISH:
+            self.checkpointer.record_input(self.chat_id, data)
+        return data
+
+    async def first_input(self) -> str:
+        """The message that starts the chat: an input the dropped connection left unanswered, or the client's next one."""
+        if not self._pending_inputs:
+            return await self.receive_input()
+        for data in self._pending_inputs[1:]:
+            self.client_sent_queue.put_nowait(data)
+        return self._pending_inputs[0]
+
+    def end(self):
+        """The client finished the chat; its checkpoint is no longer needed."""
+        self.finished = True
+        if self.checkpointer is not None:
+            self.checkpointer.discard(self.chat_id)
+
+    def abandon(self):
+        """Stop the chat mid-round; its checkpoint is kept for a reconnect."""
+        self.abandoned = True
+        if self._chat is not None:
+            self._chat.cancel()
+
     async def start(self, message):
-        await self.user_proxy.a_initiate_chat(
+        # completions of this chat queue fairly against other sessions' for the rate limit
+        llm_session.set(self.chat_id)
+        self._chat = asyncio.ensure_future(self.user_proxy.a_initiate_chat(
             self.manager,
-            clear_history=True,
+            # a resumed chat keeps its restored transcript
+            clear_history=not self.resumed,
             message=message
-        )
\ No newline at end of file
+        ))
+        try:
+            await self._chat
+        except asyncio.CancelledError:
+            if not self.abandoned:
+                raise
\ No newline at end of file
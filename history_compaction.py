@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from autogen import ConversableAgent
+
+from tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# tokens of history (system message excluded) an agent may send per completion, 0 disables compaction;
+# HISTORY_TOKEN_BUDGET_<AGENT NAME> overrides it for one agent
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# tool outputs from earlier turns larger than this are replaced by a digest
+HISTORY_DIGEST_TOKENS = int(os.getenv("HISTORY_DIGEST_TOKENS", "400"))
+# the most recent turns are always sent in full
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "2"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+
+SUMMARY_NAME = "history_summary"
+# per-message overhead of the chat format (role, name, separators)
+_MESSAGE_OVERHEAD = 4
+
+def message_tokens(message: Dict) -> int:
+    tokens = _MESSAGE_OVERHEAD + count_tokens(_text(message.get("content")))
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        tokens += count_tokens(function.get("name")) + count_tokens(function.get("arguments"))
+    for response in message.get("tool_responses") or []:
+        tokens += _MESSAGE_OVERHEAD + count_tokens(_text(response.get("content")))
+    return tokens
+
+
+def messages_tokens(messages: List[Dict]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+
+def _text(content) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    # multimodal content
+    return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def _is_tool_result(message: Dict) -> bool:
+    return message.get("role") in ("tool", "function")
+
+
+class ToolOutputDigest:
+    """
+    Replaces large tool outputs from earlier turns with a compact digest.
+
+    JSON lists (search results, transaction rows) keep their first few items with
+    long strings shortened and a count of what was left out; other text is cut to
+    the token limit. Tool outputs of the current turn, the ones the agent is
+    answering from, are left untouched.
+
+    Follows autogen's MessageTransform protocol.
+    """
+
+    def __init__(self, max_tokens: int = HISTORY_DIGEST_TOKENS, keep_items: int = 3, max_field_tokens: int = 40, user_name: str = "user"):
+        self.max_tokens = max_tokens
+        self.keep_items = keep_items
+        self.max_field_tokens = max_field_tokens
+        self.user_name = user_name
+
+    def apply_transform(self, messages: List[Dict]) -> List[Dict]:
+        current_turn = _current_turn_start(messages, self.user_name)
+        out = []
+        for index, message in enumerate(messages):
+            if index < current_turn and _is_tool_result(message):
+                message = self._digest_message(message)
+            out.append(message)
+        return out
+
+    def get_logs(self, pre_transform_messages: List[Dict], post_transform_messages: List[Dict]) -> Tuple[str, bool]:
+        saved = messages_tokens(pre_transform_messages) - messages_tokens(post_transform_messages)
+        if saved > 0:
+            return f"{saved} tokens saved by digesting tool outputs.", True
+        return "No tool outputs digested.", False
+
+    def _digest_message(self, message: Dict) -> Dict:
+        message = dict(message)
+        if message.get("tool_responses"):
+            message["tool_responses"] = [
+                dict(response, content=self.digest(response.get("content"))) for response in message["tool_responses"]
+            ]
+        if isinstance(message.get("content"), str):
+            message["content"] = self.digest(message["content"])
+        return message
+
+    def digest(self, content) -> str:
+        text = _text(content)
+        if count_tokens(text) <= self.max_tokens:
+            return content
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return truncate_tokens(text, self.max_tokens)
+        if isinstance(data, dict) and len(data) == 1 and isinstance(next(iter(data.values())), list):
+            data = next(iter(data.values()))
+        if not isinstance(data, list):
+            return truncate_tokens(text, self.max_tokens)
+        items = [self._shorten(item) for item in data[:self.keep_items]]
+        digest = {"digest_of": f"{len(data)} items", "items": items, "omitted": len(data) - len(items)}
+        if data and isinstance(data[0], dict):
+            digest["fields"] = list(data[0])
+        return truncate_tokens(json.dumps(digest), self.max_tokens)
+
+    def _shorten(self, item):
+        if isinstance(item, str):
+            return truncate_tokens(item, self.max_field_tokens)
+        if isinstance(item, dict):
+            return {key: self._shorten(value) for key, value in item.items()}
+        return item
+
+
+class TurnBudget:
+    """
+    Keeps the history within a token budget by folding the oldest turns into a
+    short summary message.
+
+    The history is split into units that must stay together (an assistant
+    tool call and its tool results); the newest units are kept while they fit,
+    the last keep_turns units always are. The dropped units are summarised
+    extractively: the speaker and the first sentence of each message.
+
+    Follows autogen's MessageTransform protocol.
+    """
+
+    def __init__(self, max_tokens: int = HISTORY_TOKEN_BUDGET, keep_turns: int = HISTORY_KEEP_TURNS, summary_tokens: int = HISTORY_SUMMARY_TOKENS):
+        self.max_tokens = max_tokens
+        self.keep_turns = max(1, keep_turns)
+        self.summary_tokens = summary_tokens
+
+    def apply_transform(self, messages: List[Dict]) -> List[Dict]:
+        if not self.max_tokens or messages_tokens(messages) <= self.max_tokens:
+            return messages
+        units = _units(messages)
+        kept = []
+        used = self.summary_tokens + _MESSAGE_OVERHEAD
+        for position, unit in enumerate(reversed(units)):
+            tokens = messages_tokens(unit)
+            if position >= self.keep_turns and used + tokens > self.max_tokens:
+                break
+            kept.insert(0, unit)
+            used += tokens
+        dropped = units[:len(units) - len(kept)]
+        if not dropped:
+            return messages
+        summary = {"role": "user", "name": SUMMARY_NAME, "content": self.summarise([m for unit in dropped for m in unit])}
+        return [summary] + [message for unit in kept for message in unit]
+
+    def get_logs(self, pre_transform_messages: List[Dict], post_transform_messages: List[Dict]) -> Tuple[str, bool]:
+        folded = len(pre_transform_messages) - len(post_transform_messages) + 1
+        if post_transform_messages is not pre_transform_messages:
+            return f"{folded} earlier messages folded into a summary.", True
+        return "History within budget.", False
+
+    def summarise(self, messages: List[Dict]) -> str:
+        lines = []
+        tool_results = 0
+        for message in messages:
+            if _is_tool_result(message):
+                tool_results += 1
+                continue
+            if message.get("name") == SUMMARY_NAME:
+                lines.append(_text(message.get("content")))
+                continue
+            text = " ".join(_text(message.get("content")).split())
+            if message.get("tool_calls"):
+                names = ", ".join(call.get("function", {}).get("name", "") for call in message["tool_calls"])
+                text = f"called {names}"
+            if text:
+                lines.append(f"- {message.get('name', message.get('role'))}: {_first_sentence(text)}")
+        if tool_results:
+            lines.append(f"- ({tool_results} tool results omitted)")
+        header = "Summary of the earlier conversation:"
+        # keep the most recent lines that fit
+        while lines and count_tokens("\n".join([header] + lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join([header] + lines)
+
+
+def _first_sentence(text: str, max_tokens: int = 40) -> str:
+    for end in (". ", "? ", "! ", "\n"):
+        position = text.find(end)
+        if position > 0:
+            text = text[:position + 1]
+            break
+    return truncate_tokens(text, max_tokens)
+
+
+def _current_turn_start(messages: List[Dict], user_name: str) -> int:
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get("name") == user_name and not _is_tool_result(messages[index]):
+            return index
+    return 0
+
+
+def _units(messages: List[Dict]) -> List[List[Dict]]:
+    units = []
+    for message in messages:
+        if units and _is_tool_result(message):
+            # tool results must follow the call that requested them
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return units
+
+
+def agent_token_budget(agent_name: str) -> int:
+    return int(os.getenv(f"HISTORY_TOKEN_BUDGET_{agent_name.upper()}", HISTORY_TOKEN_BUDGET))
+
+
+class HistoryCompaction:
+    """
+    Agent capability that compacts the history an agent sends to its LLM and
+    records how many prompt tokens it saved.
+
+    Registered on an agent's process_all_messages_before_reply hook like
+    autogen's TransformMessages; the shared transcript itself is never changed,
+    only the copy handed to the model.
+    """
+
+    def __init__(self, digest_tokens: int = HISTORY_DIGEST_TOKENS, keep_turns: int = HISTORY_KEEP_TURNS, user_name: str = "user"):
+        self.digest_tokens = digest_tokens
+        self.keep_turns = keep_turns
+        self.user_name = user_name
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def add_to_agent(self, agent: ConversableAgent, max_tokens: Optional[int] = None):
+        max_tokens = agent_token_budget(agent.name) if max_tokens is None else max_tokens
+        transforms = [
+            ToolOutputDigest(max_tokens=self.digest_tokens, user_name=self.user_name),
+            TurnBudget(max_tokens=max_tokens, keep_turns=self.keep_turns),
+        ]
+
+        def compact(messages: List[Dict]) -> List[Dict]:
+            if not messages:
+                return messages
+            messages = list(messages)
+            before = messages_tokens(messages)
+            for transform in transforms:
+                messages = transform.apply_transform(messages)
+            self._record(agent.name, before, messages_tokens(messages))
+            return messages
+
+        agent.register_hook(hookable_method="process_all_messages_before_reply", hook=compact)
+
+    def _record(self, agent_name: str, before: int, after: int):
+        with self._lock:
+            stats = self._stats.setdefault(agent_name, {"rounds": 0, "tokens_in": 0, "tokens_sent": 0, "tokens_saved": 0})
+            stats["rounds"] += 1
+            stats["tokens_in"] += before
+            stats["tokens_sent"] += after
+            stats["tokens_saved"] += before - after
+        logger.info("%s: history %d -> %d prompt tokens (saved %d)", agent_name, before, after, before - after)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+from typing import List, Optional, Tuple, Union
+
+from autogen import Agent, GroupChat
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+except ImportError:
+    make_pipeline = None
+
+# below this confidence the router defers to the LLM speaker selection
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.45"))
+
+LOAN = "loan_assitant"
+INSURANCE = "customer_assitant"
+CARD_INFO = "information_recommender_agent"
+CARD_PERSONALISED = "credit_recommender_agent"
+
+TRAINING_PROMPTS = [
+    ("What is the room for me to request for a home loan? This will be on top of my current loan.", LOAN),
+    ("How much can I borrow for a home loan with UOB?", LOAN),
+    ("What are the interest rates for UOB personal loans?", LOAN),
+    ("Compare OCBC and UOB home loan packages", LOAN),
+    ("Can I refinance my mortgage with UOB?", LOAN),
+    ("I need a car loan, what does UOB offer?", LOAN),
+    ("What is the tenure of a UOB renovation loan?", LOAN),
+    ("How do I apply for a personal instalment loan?", LOAN),
+    ("Is there an education loan for my child's university fees?", LOAN),
+    ("What is the processing fee for a cash loan?", LOAN),
+    ("Can I take a second loan while repaying my current one?", LOAN),
+    ("What documents do I need for a property loan?", LOAN),
+    ("Which bank has better loan rates, OCBC or UOB?", LOAN),
+    ("How is my loan eligibility calculated?", LOAN),
+    ("I also want to enquire about travel insurance. What are some of the best options available with UOB there?", INSURANCE),
+    ("Does UOB offer travel insurance for families?", INSURANCE),
+    ("What health insurance plans are available?", INSURANCE),
+    ("Compare UOB and OCBC life insurance", INSURANCE),
+    ("I want to insure my car, what plans do you have?", INSURANCE),
+    ("How do I claim on my travel insurance policy?", INSURANCE),
+    ("Is there home insurance that covers fire and flood?", INSURANCE),
+    ("What does the UOB personal accident plan cover?", INSURANCE),
+    ("Tell me about critical illness cover", INSURANCE),
+    ("What is the premium for annual multi-trip travel insurance?", INSURANCE),
+    ("Do you have insurance for my domestic helper?", INSURANCE),
+    ("Which insurance policy protects my savings and investments?", INSURANCE),
+    ("My OCBC 365 card is expiring soon. It was a great card with 2% cashback options. Can you suggest similar options with UOB?", CARD_INFO),
+    ("What credit cards does UOB offer?", CARD_INFO),
+    ("Which UOB card gives the best cashback?", CARD_INFO),
+    ("I have an OCBC card, what is the UOB equivalent?", CARD_INFO),
+    ("What is the annual fee of the UOB One card?", CARD_INFO),
+    ("Which UOB credit card has the best air miles?", CARD_INFO),
+    ("Compare UOB credit cards for dining rewards", CARD_INFO),
+    ("I am new to UOB, which credit card should I get?", CARD_INFO),
+    ("What are the benefits of the UOB PRVI Miles card?", CARD_INFO),
+    ("Is there a UOB card with no minimum spend?", CARD_INFO),
+    ("Does UOB have a card similar to OCBC Frank?", CARD_INFO),
+    ("What rewards do UOB cards give on online shopping?", CARD_INFO),
+    ("Ah thanks for the options. But based on my account and recent spend, can you suggest me some UOB cards that might be more suitable to me?", CARD_PERSONALISED),
+    ("Based on my transactions, which UOB card suits me?", CARD_PERSONALISED),
+    ("Look at my spending and recommend a card", CARD_PERSONALISED),
+    ("I am an existing UOB customer, which card fits my profile?", CARD_PERSONALISED),
+    ("Given my recent spend on travel, which card should I use?", CARD_PERSONALISED),
+    ("Check my account history and suggest a credit card for me", CARD_PERSONALISED),
+    ("Recommend a card tailored to my spending pattern", CARD_PERSONALISED),
+    ("With my salary and expenses, what UOB card is best for me?", CARD_PERSONALISED),
+    ("Use my customer profile to pick a credit card", CARD_PERSONALISED),
+    ("Personalise a credit card recommendation from my account data", CARD_PERSONALISED),
+    ("I spend a lot on groceries and fuel, which of my UOB card options suits my account?", CARD_PERSONALISED),
+    ("Which card matches how I have been spending recently?", CARD_PERSONALISED),
+]
+
+# keyword rules used when scikit-learn is not installed
+KEYWORD_RULES = {
+    LOAN: ("loan", "mortgage", "borrow", "refinanc", "tenure", "instalment"),
+    INSURANCE: ("insurance", "insure", "policy", "premium", "claim", "cover"),
+    CARD_INFO: ("card", "cashback", "miles", "annual fee", "rewards"),
+    CARD_PERSONALISED: ("my account", "my spend", "recent spend", "my profile", "my transactions", "spending", "tailored", "suits me", "for me"),
+}
+
+_word = re.compile(r"\w+")
+
+
+class IntentRouter:
+    """
+    Picks the next group chat speaker locally, as a GroupChat speaker_selection_method.
+
+    Turn-taking is rule based: tool calls go to the executor, tool results back to
+    the agent that asked for them, and an expert's answer back to the user. The
+    expert that answers a user message is chosen by a TF-IDF + logistic regression
+    classifier trained on labelled prompts (keyword rules without scikit-learn).
+    When the classifier is not confident, the router returns "auto" and GroupChat
+    falls back to LLM speaker selection.
+    """
+
+    def __init__(self, examples: List[Tuple[str, str]] = None, threshold: float = ROUTER_CONFIDENCE, user_name: str = "user", executor_name: str = "executor"):
+        self.threshold = threshold
+        self.user_name = user_name
+        self.executor_name = executor_name
+        self.routed = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+        self._model = None
+        examples = examples or TRAINING_PROMPTS
+        if make_pipeline is not None:
+            texts, labels = zip(*examples)
+            self._model = make_pipeline(
+                TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True),
+                LogisticRegression(C=10.0, max_iter=1000),
+            )
+            self._model.fit(texts, labels)
+
+    def classify(self, text: str) -> Tuple[Optional[str], float]:
+        """Return the most likely expert for a user message and its confidence."""
+        if self._model is not None:
+            probabilities = self._model.predict_proba([text])[0]
+            best = probabilities.argmax()
+            return self._model.classes_[best], float(probabilities[best])
+        text = " ".join(_word.findall(text.lower()))
+        scores = {label: sum(keyword in text for keyword in keywords) for label, keywords in KEYWORD_RULES.items()}
+        if scores[CARD_PERSONALISED] and scores[CARD_INFO]:
+            scores[CARD_INFO] = 0
+        total = sum(scores.values())
+        if not total:
+            return None, 0.0
+        label = max(scores, key=scores.get)
+        return label, scores[label] / total
+
+    def __call__(self, last_speaker: Agent, groupchat: GroupChat) -> Union[Agent, str]:
+        speaker = self._select(last_speaker, groupchat)
+        with self._lock:
+            if isinstance(speaker, str):
+                self.deferred += 1
+            else:
+                self.routed += 1
+        return speaker
+
+    def _select(self, last_speaker: Agent, groupchat: GroupChat) -> Union[Agent, str]:
+        if not groupchat.messages:
+            return "auto"
+        message = groupchat.messages[-1]
+        names = groupchat.agent_names
+        if message.get("tool_calls") and self.executor_name in names:
+            return groupchat.agent_by_name(self.executor_name)
+        if last_speaker.name == self.executor_name:
+            # hand the tool result back to the agent that asked for it
+            for previous in reversed(groupchat.messages[:-1]):
+                if previous.get("tool_calls") and previous.get("name") in names:
+                    return groupchat.agent_by_name(previous["name"])
+            return "auto"
+        if last_speaker.name != self.user_name:
+            # an expert answered; the user speaks next
+            return groupchat.agent_by_name(self.user_name) if self.user_name in names else "auto"
+        content = message.get("content")
+        if not isinstance(content, str) or not content.strip():
+            return "auto"
+        label, confidence = self.classify(content)
+        if label is None or confidence < self.threshold or label not in names:
+            return "auto"
+        return groupchat.agent_by_name(label)
+
+    def stats(self):
+        with self._lock:
+            return {"routed": self.routed, "deferred": self.deferred}
+
+
+_router: Optional[IntentRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_intent_router() -> IntentRouter:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = IntentRouter()
+    return _router
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from scipy.sparse import vstack
+    from sklearn.feature_extraction.text import HashingVectorizer
+except ImportError:
+    HashingVectorizer = None
+
+LLM_CACHE = os.getenv("LLM_CACHE", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAXSIZE = int(os.getenv("LLM_CACHE_MAXSIZE", "1024"))
+# cosine similarity a new question needs with a cached one to reuse its answer, 0 disables the similarity tier
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0"))
+# conversations that called one of these tools carry personal data and are never cached
+LLM_CACHE_EXCLUDE_TOOLS = tuple(
+    name.strip() for name in os.getenv("LLM_CACHE_EXCLUDE_TOOLS", "get_customer_details").split(",") if name.strip()
+)
+
+_whitespace = re.compile(r"\s+")
+# request parameters that do not change the completion
+_IGNORED_PARAMS = ("messages", "stream", "tools")
+
+
+def _normalise_text(text) -> str:
+    if not isinstance(text, str):
+        return text
+    return _whitespace.sub(" ", text).strip()
+
+
+def normalise_messages(messages: List[Dict]) -> List[Dict]:
+    """Collapse whitespace and drop the per-call tool ids, which differ between otherwise identical chats."""
+    normalised = []
+    for message in messages:
+        item = {"role": message.get("role"), "content": _normalise_text(message.get("content"))}
+        if message.get("name"):
+            item["name"] = message["name"]
+        if message.get("tool_calls"):
+            item["tool_calls"] = [
+                [call.get("function", {}).get("name"), _normalise_text(call.get("function", {}).get("arguments"))]
+                for call in message["tool_calls"]
+            ]
+        normalised.append(item)
+    return normalised
+
+
+def called_tools(messages: List[Dict]) -> set:
+    """
+    Names of the tools the conversation called: the function names of assistant
+    tool calls and the names of tool and function responses. Message content, such
+    as a system prompt that tells the agent about a tool, is not a call.
+    """
+    names = set()
+    for message in messages:
+        role = message.get("role")
+        if role == "assistant":
+            for call in message.get("tool_calls") or []:
+                names.add((call.get("function") or {}).get("name"))
+            if message.get("function_call"):
+                names.add(message["function_call"].get("name"))
+        elif role in ("tool", "function") and message.get("name"):
+            names.add(message["name"])
+    return names
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for chat completions, usable as an autogen cache (the
+    AbstractCache protocol: get, set, close and the context manager).
+
+    autogen calls it with the JSON of the request parameters as the key. The
+    exact tier hashes the normalised messages, tool schemas and parameters. The
+    optional similarity tier embeds the visible conversation with a hashing
+    vectoriser and reuses the answer of the nearest cached conversation for the
+    same system prompt and tools when the cosine similarity reaches the
+    threshold; it only serves requests that end with a user message.
+
+    Entries expire after ttl seconds and the least recently used are evicted
+    beyond maxsize. Requests of conversations that called an excluded tool are
+    never read from or written to the cache.
+    """
+
+    def __init__(
+        self,
+        ttl: float = LLM_CACHE_TTL,
+        maxsize: int = LLM_CACHE_MAXSIZE,
+        similarity: float = LLM_CACHE_SIMILARITY,
+        exclude_tools: Tuple[str, ...] = LLM_CACHE_EXCLUDE_TOOLS,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.similarity = similarity if HashingVectorizer is not None else 0
+        self.exclude_tools = exclude_tools
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.excluded = 0
+        self.evictions = 0
+        # exact key -> (response, expires_at, partition)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # partition -> {exact key: vector}, and the stacked matrix of each partition
+        self._vectors: Dict[str, Dict[str, Any]] = {}
+        self._matrices: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._vectoriser = None
+        if self.similarity:
+            self._vectoriser = HashingVectorizer(n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False)
+
+    def _parse(self, key: str) -> Optional[Dict]:
+        try:
+            params = json.loads(key)
+        except ValueError:
+            return None
+        if not isinstance(params, dict) or not isinstance(params.get("messages"), list):
+            return None
+        messages = params["messages"]
+        if self.exclude_tools and called_tools(messages) & set(self.exclude_tools):
+            return None
+        normalised = normalise_messages(messages)
+        system = [m for m in normalised if m["role"] == "system"]
+        settings = {k: v for k, v in params.items() if k not in _IGNORED_PARAMS}
+        partition = _digest([system, params.get("tools"), settings])
+        request = {
+            "exact": _digest([normalised, params.get("tools"), settings]),
+            "partition": partition,
+            "text": None,
+        }
+        if self._vectoriser is not None and messages and messages[-1].get("role") == "user":
+            request["text"] = " ".join(
+                f"{m.get('name', m['role'])}: {m['content']}" for m in normalised if m["role"] != "system" and isinstance(m["content"], str)
+            )
+        return request
+
+    def get(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        request = self._parse(key)
+        now = time.time()
+        with self._lock:
+            if request is None:
+                self.excluded += 1
+                return default
+            entry = self._live_entry(request["exact"], now)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            if request["text"]:
+                nearest = self._nearest(request["partition"], request["text"])
+                entry = self._live_entry(nearest, now) if nearest else None
+                if entry is not None:
+                    self.similar_hits += 1
+                    return entry[0]
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        request = self._parse(key)
+        if request is None:
+            return
+        vector = self._vectoriser.transform([request["text"]]) if request["text"] else None
+        with self._lock:
+            exact, partition = request["exact"], request["partition"]
+            self._entries[exact] = (value, time.time() + self.ttl, partition)
+            self._entries.move_to_end(exact)
+            if vector is not None:
+                self._vectors.setdefault(partition, {})[exact] = vector
+                self._matrices.pop(partition, None)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _live_entry(self, exact: str, now: float) -> Optional[tuple]:
+        entry = self._entries.get(exact)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            self._evict(exact)
+            return None
+        self._entries.move_to_end(exact)
+        return entry
+
+    def _evict(self, exact: str):
+        _, _, partition = self._entries.pop(exact)
+        vectors = self._vectors.get(partition)
+        if vectors is not None and vectors.pop(exact, None) is not None:
+            self._matrices.pop(partition, None)
+            if not vectors:
+                del self._vectors[partition]
+
+    def _nearest(self, partition: str, text: str) -> Optional[str]:
+        vectors = self._vectors.get(partition)
+        if not vectors:
+            return None
+        if partition not in self._matrices:
+            self._matrices[partition] = (list(vectors), vstack(list(vectors.values())).tocsr())
+        keys, matrix = self._matrices[partition]
+        # rows are l2-normalised, so the dot product is the cosine similarity
+        scores = (matrix @ self._vectoriser.transform([text]).T).toarray().ravel()
+        best = scores.argmax()
+        return keys[best] if scores[best] >= self.similarity else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrices.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "excluded": self.excluded,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+    def __deepcopy__(self, memo):
+        # autogen deep-copies llm_config; every agent must keep the one shared cache
+        return self
+
+    def close(self) -> None:
+        # shared by every session for the life of the process
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Return the process-wide completion cache, or None when LLM_CACHE is off."""
+    global _cache
+    if not LLM_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache()
+    return _cache
@@ -0,0 +1,285 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from metrics import LLM_ADMISSION_WAIT_SECONDS, LLM_RATE_LIMITED
+from tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# requests and tokens (prompt plus max_tokens) per minute this process may send to one deployment, 0 is unlimited;
+# with several workers give each its share of the deployment's quota
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+# how much of the per-minute quota may go out at once
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "10"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+# the admission controller paces retries, so the OpenAI client only retries once itself
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+# a waiting completion moves up one priority for every this many seconds, so background calls are not starved
+LLM_PRIORITY_AGING = float(os.getenv("LLM_PRIORITY_AGING", "30"))
+# threads for autogen's blocking completions, which run on the event loop's default executor
+LLM_THREADS = int(os.getenv("LLM_THREADS", "64"))
+
+# who a completion is for: the speaking agent, speaker selection, or anything else
+PRIORITY_REPLY = 0
+PRIORITY_SELECTION = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_REPLY: "reply", PRIORITY_SELECTION: "selection", PRIORITY_BACKGROUND: "background"}
+
+llm_session: contextvars.ContextVar[str] = contextvars.ContextVar("llm_session", default="")
+llm_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=PRIORITY_BACKGROUND)
+
+
+@contextlib.contextmanager
+def completion_priority(priority: int):
+    """Completions started inside the block are admitted with this priority."""
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+class ContextThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that runs every job in a copy of the submitter's context,
+    so llm_session and llm_priority set on the event loop reach the completion
+    threads autogen starts with run_in_executor.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+_executor: Optional[ContextThreadPoolExecutor] = None
+
+
+def install_executor(loop):
+    """Make the context-copying pool the loop's default executor."""
+    global _executor
+    if _executor is None:
+        _executor = ContextThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+    loop.set_default_executor(_executor)
+
+
+class _Waiter:
+    __slots__ = ("session", "priority", "tokens", "granted", "since")
+
+    def __init__(self, session: str, priority: int, tokens: float):
+        self.session = session
+        self.priority = priority
+        self.tokens = tokens
+        self.granted = False
+        self.since = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Token buckets for the requests and tokens per minute of one deployment.
+
+    Completions wait in acquire() until both buckets can pay for them. Waiters
+    are served by priority first, a waiter moving up one priority every
+    priority_aging seconds; within a priority the session served longest ago
+    goes next, so one busy session cannot starve the others. A 429 from the
+    deployment pauses every admission until its Retry-After has passed, instead
+    of each client retrying on its own.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, burst_seconds: float = LLM_BURST_SECONDS,
+                 priority_aging: float = LLM_PRIORITY_AGING):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.priority_aging = priority_aging
+        self.request_capacity = max(1.0, rpm * burst_seconds / 60) if rpm else 0
+        self.token_capacity = tpm * burst_seconds / 60 if tpm else 0
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[_Waiter] = []
+        self._last_served: Dict[str, float] = defaultdict(float)
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.rate_limited = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.rpm:
+            self._requests = min(self.request_capacity, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.token_capacity, self._tokens + elapsed * self.tpm / 60)
+
+    def _priority(self, waiter: _Waiter, now: float) -> int:
+        if not self.priority_aging:
+            return waiter.priority
+        return waiter.priority - int((now - waiter.since) / self.priority_aging)
+
+    def _next(self, now: float) -> Optional[_Waiter]:
+        if not self._waiters:
+            return None
+        priority = min(self._priority(waiter, now) for waiter in self._waiters)
+        candidates = [waiter for waiter in self._waiters if self._priority(waiter, now) == priority]
+        # the session served longest ago, and its oldest waiter
+        return min(candidates, key=lambda waiter: (self._last_served[waiter.session], waiter.since))
+
+    def _wait_time(self, waiter: _Waiter, now: float) -> float:
+        """Seconds until the buckets can pay for waiter, 0 if they can now."""
+        wait = max(0.0, self._paused_until - now)
+        if self.rpm and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+        # a request larger than the bucket goes through once the bucket is full
+        tokens = min(waiter.tokens, self.token_capacity)
+        if self.tpm and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+        return wait
+
+    def _dispatch(self, now: float) -> float:
+        """Admit waiters while the buckets allow; returns how long the next one has to wait."""
+        self._refill(now)
+        while True:
+            waiter = self._next(now)
+            if waiter is None:
+                return 0.0
+            wait = self._wait_time(waiter, now)
+            if wait > 0:
+                return wait
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= min(waiter.tokens, self.token_capacity)
+            self._waiters.remove(waiter)
+            self._last_served[waiter.session] = now
+            waiter.granted = True
+            self.admitted += 1
+            self._cond.notify_all()
+
+    def limited(self) -> bool:
+        """Whether completions have to be admitted: a quota is set or a 429 holds them back."""
+        return bool(self.rpm or self.tpm) or time.monotonic() < self._paused_until
+
+    def acquire(self, tokens: float, session: str = "", priority: int = PRIORITY_BACKGROUND):
+        """Block until a completion of about this many tokens may be sent."""
+        if not self.limited():
+            return
+        waiter = _Waiter(session, priority, tokens)
+        with self._cond:
+            self._waiters.append(waiter)
+            while True:
+                wait = self._dispatch(time.monotonic())
+                if waiter.granted:
+                    break
+                self._cond.wait(timeout=wait or None)
+        LLM_ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.since, priority=PRIORITY_NAMES.get(priority, priority))
+
+    def pause(self, seconds: float):
+        """The deployment is rate limiting: admit nothing for this long."""
+        with self._cond:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            if self.tpm:
+                self._tokens = min(self._tokens, 0.0)
+
+    def stats(self) -> Dict:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "admitted": self.admitted,
+            "waiting": len(self._waiters),
+            "rate_limited": self.rate_limited,
+        }
+
+
+def estimate_request_tokens(body: bytes) -> float:
+    """Prompt tokens plus max_tokens of a chat completion request, which is what the quota is charged."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return count_tokens(body.decode("utf-8", "replace"))
+    prompt = count_tokens(json.dumps(payload.get("messages", []))) + count_tokens(json.dumps(payload.get("tools", [])))
+    return prompt + (payload.get("max_tokens") or 0)
+
+
+def retry_after_seconds(headers: httpx.Headers) -> float:
+    if "retry-after-ms" in headers:
+        return float(headers["retry-after-ms"]) / 1000
+    try:
+        return float(headers.get("retry-after", 1))
+    except ValueError:
+        return 1.0
+
+
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller(deployment: str) -> AdmissionController:
+    with _controllers_lock:
+        if deployment not in _controllers:
+            _controllers[deployment] = AdmissionController()
+        return _controllers[deployment]
+
+
+class AdmissionTransport(httpx.HTTPTransport):
+    """HTTP transport that passes chat completions through their deployment's admission controller."""
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return super().handle_request(request)
+        controller = get_admission_controller(request.url.path)
+        if controller.limited():
+            # estimating parses and encodes the whole request, so only do it when tokens are limited
+            tokens = estimate_request_tokens(request.content) if controller.tpm else 0
+            controller.acquire(tokens, llm_session.get(), llm_priority.get())
+        response = super().handle_request(request)
+        if response.status_code == 429:
+            seconds = retry_after_seconds(response.headers)
+            LLM_RATE_LIMITED.inc()
+            logger.warning("%s is rate limited, pausing completions for %.1fs", request.url.path, seconds)
+            controller.pause(seconds)
+        return response
+
+
+class SharedHTTPClient(httpx.Client):
+    """The process-wide HTTP client; autogen deep-copies llm_config, which must not copy the pool."""
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+_http_client: Optional[SharedHTTPClient] = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> SharedHTTPClient:
+    """Return the keep-alive connection pool every OpenAI client of the process sends through."""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+                _http_client = SharedHTTPClient(
+                    transport=AdmissionTransport(limits=limits),
+                    timeout=httpx.Timeout(600.0, connect=5.0),
+                )
+    return _http_client
+
+
+def pooled_config(config: Dict) -> Dict:
+    """An autogen config entry that sends through the shared client and admission controller."""
+    return dict(config, http_client=get_http_client(), max_retries=LLM_MAX_RETRIES)
+
+
+def admission_stats() -> Dict[str, Dict]:
+    with _controllers_lock:
+        return {deployment: controller.stats() for deployment, controller in _controllers.items()}
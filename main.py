@@ -1,7 +1,14 @@
-from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import TYPE_CHECKING, List, Union
+import json
 import uuid
-from group_chat import AutogenChat
+from client_queue import next_batch
+from session_checkpoint import get_checkpointer
+from llm_pool import admission_stats, install_executor
+from session_registry import CLOSE_IDLE, CLOSE_TRY_AGAIN_LATER, SessionRegistry
+from metrics import PUMP_BATCH_FRAMES, PUMP_SECONDS, render_metrics
 import asyncio
 import uvicorn
 from dotenv import load_dotenv, find_dotenv
@@ -13,55 +20,144 @@ from database.db import Base, engine
 from api.prompt_crud import router as prompt_router
 from api.transactions_crud import router as transaction_router
 
+# autogen, the agents and their tools are imported by the startup hook, not with this module
+if TYPE_CHECKING:
+    from group_chat import AutogenChat
+
 _ = load_dotenv(find_dotenv()) # read local .env file
 
 app = FastAPI()
-app.autogen_chat = {}
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[AutogenChat] = []
-
-    async def connect(self, autogen_chat: AutogenChat):
+    def __init__(self, sessions: SessionRegistry):
+        # live sessions keyed by ws_client_id, capped and swept for idle clients
+        self.sessions = sessions
+
+    async def reject(self, websocket: WebSocket):
+        self.sessions.reject()
+        await websocket.accept()
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Too many sessions, try again later")
+
+    async def connect(self, autogen_chat: "AutogenChat"):
+        # registered before the first await, so the capacity check in the endpoint still holds
+        previous = self.sessions.register(autogen_chat)
         await autogen_chat.websocket.accept()
-        self.active_connections.append(autogen_chat)
+        # a connection still serving this id on another worker sees the claim and closes
+        await autogen_chat.claim()
+        if previous is not None:
+            await previous.close(code=CLOSE_IDLE, reason="Replaced by a new connection")
 
-    async def disconnect(self, autogen_chat: AutogenChat):
-        autogen_chat.client_receive_queue.put_nowait("DO_FINISH")
+    async def disconnect(self, autogen_chat: "AutogenChat"):
+        autogen_chat.client_receive_queue.finish()
         print(f"autogen_chat {autogen_chat.chat_id} disconnected")
-        self.active_connections.remove(autogen_chat)
+        self.sessions.remove(autogen_chat)
+        await autogen_chat.release()
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(SessionRegistry())
 
 
-async def send_to_client(autogen_chat: AutogenChat):
-    while True:
-        reply = await autogen_chat.client_receive_queue.get()
-        if reply and reply == "DO_FINISH":
-            autogen_chat.client_receive_queue.task_done()
-            break
-        await autogen_chat.websocket.send_text(reply)
-        autogen_chat.client_receive_queue.task_done()
-        await asyncio.sleep(0.05)
+@app.on_event("startup")
+async def build_agent_templates():
+    # completions run on the default executor; this one carries the session and priority to admission
+    install_executor(asyncio.get_running_loop())
+    # agents, tool schemas and the speaker router are built once here; sessions share them
+    from group_chat import get_agent_templates
+    from intent_router import get_intent_router
+    get_agent_templates()
+    get_intent_router()
+    app.state.session_sweeper = asyncio.create_task(manager.sessions.run_eviction())
+    checkpointer = get_checkpointer()
+    if checkpointer is not None:
+        await asyncio.to_thread(checkpointer.prune)
+
 
-async def receive_from_client(autogen_chat: AutogenChat):
+@app.on_event("shutdown")
+async def flush_checkpoints():
+    checkpointer = get_checkpointer()
+    if checkpointer is not None:
+        await checkpointer.flush()
+
+
+async def send_to_client(autogen_chat: "AutogenChat"):
+    # frames are sent as soon as they arrive; bursts are coalesced into fewer sends
     while True:
-        data = await autogen_chat.websocket.receive_text()
+        batch = await next_batch(autogen_chat.client_receive_queue)
+        PUMP_BATCH_FRAMES.observe(len(batch))
+        with PUMP_SECONDS.time(pump="send_to_client"):
+            for reply in batch:
+                if reply and reply == "DO_FINISH":
+                    return
+                await autogen_chat.websocket.send_text(reply)
+        autogen_chat.touch()
+
+async def receive_from_client(autogen_chat: "AutogenChat"):
+    while True:
+        try:
+            data = await autogen_chat.receive_input()
+        except WebSocketDisconnect:
+            # the client dropped without DO_FINISH: stop answering, a reconnect resumes the chat
+            autogen_chat.abandon()
+            raise
         if data and data == "DO_FINISH":
-            await autogen_chat.client_receive_queue.put("DO_FINISH")
-            await autogen_chat.client_sent_queue.put("DO_FINISH")
+            autogen_chat.end()
+            autogen_chat.client_receive_queue.finish()
+            autogen_chat.client_sent_queue.finish()
             break
-        await autogen_chat.client_sent_queue.put(data)
-        await asyncio.sleep(0.05)
+        # the queue is bounded, so a flooding client is paused here
+        with PUMP_SECONDS.time(pump="receive_from_client"):
+            await autogen_chat.client_sent_queue.put(data)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/ws/{ws_client_id}/stats")
+async def websocket_queue_stats(ws_client_id: str):
+    autogen_chat = manager.sessions.get(ws_client_id)
+    if autogen_chat is None:
+        raise HTTPException(status_code=404, detail="Unknown websocket client id")
+    return {**autogen_chat.queue_stats(), "history": autogen_chat.history_stats()}
+
+class BulkCustomerLookup(BaseModel):
+    cust_ids: List[Union[int, str]]
+
+
+@app.post("/api/customers/bulk")
+def bulk_customer_details(request: BulkCustomerLookup):
+    """Rows of many customers as NDJSON, one {"cust_id", "transactions"} line per requested id."""
+    from customer_store import bulk_lookup
+
+    def lines():
+        for cust_id, records in bulk_lookup(request.cust_ids):
+            yield json.dumps({"cust_id": cust_id, "transactions": records}) + "\n"
+    # a sync iterator is consumed on the threadpool, off the event loop
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/api/admin/sessions")
+async def list_sessions():
+    checkpointer = get_checkpointer()
+    return {
+        **manager.sessions.describe(),
+        "checkpoints": checkpointer.stats() if checkpointer else None,
+        "llm_admission": admission_stats(),
+    }
 
 @app.websocket("/api/ws/{ws_client_id}")
 async def websocket_endpoint(websocket: WebSocket, ws_client_id: str):
+    if not manager.sessions.has_room(ws_client_id):
+        # checked before building the session, so a connection storm is turned away cheaply
+        await manager.reject(websocket)
+        return
+    from group_chat import AutogenChat
     try:
         autogen_chat = AutogenChat(chat_id=ws_client_id, websocket=websocket)
         await manager.connect(autogen_chat)
-        data = await autogen_chat.websocket.receive_text()
+        restored = await autogen_chat.restore()
+        if restored:
+            print(f"autogen_chat {ws_client_id} resumed with {restored} messages")
+        data = await autogen_chat.first_input()
         future_calls = asyncio.gather(send_to_client(autogen_chat), receive_from_client(autogen_chat))
         await autogen_chat.start(data)
         print("DO_FINISHED")
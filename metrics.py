@@ -0,0 +1,205 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _label_text(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class _Span:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, **self.labels)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s %s %.1fms%s", self.histogram.name, self.labels, elapsed * 1000, " (error)" if exc_type else "")
+        return False
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram aggregated in process, of durations in seconds unless
+    its buckets say otherwise.
+
+    ``with histogram.time(phase="select_speaker"):`` times a block as one span;
+    an observation costs a lock and a bisect, cheap enough to leave on.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels) -> _Span:
+        return _Span(self, labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _label_text(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CHAT_PHASE_SECONDS = Histogram(
+    "skagents_chat_phase_seconds",
+    "Time spent in each phase of a group chat round.",
+    ("phase", "agent"),
+)
+TOOL_SECONDS = Histogram(
+    "skagents_tool_seconds",
+    "Time spent in agent tool functions and the calls they make.",
+    ("tool", "target"),
+)
+TOOL_CALLS = Counter(
+    "skagents_tool_calls_total",
+    "Tool function calls, by whether a cache answered them.",
+    ("tool", "cached"),
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "skagents_queue_wait_seconds",
+    "Time a frame waited in a websocket client queue before it was taken.",
+    ("queue",),
+)
+QUEUE_DROPPED = Counter(
+    "skagents_queue_dropped_total",
+    "Frames dropped by a full client queue.",
+    ("queue",),
+)
+PUMP_SECONDS = Histogram(
+    "skagents_pump_seconds",
+    "Time the websocket pumps spend sending a batch or handing a client message to the chat.",
+    ("pump",),
+)
+PUMP_BATCH_FRAMES = Histogram(
+    "skagents_pump_batch_frames",
+    "Frames sent per websocket batch after coalescing.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+FALLBACK_REPLIES = Counter(
+    "skagents_fallback_replies_total",
+    "Speaker replies by who answered: the primary, a hedged or failed-over fallback, or the fallback while the circuit is open.",
+    ("agent", "outcome"),
+)
+LLM_ADMISSION_WAIT_SECONDS = Histogram(
+    "skagents_llm_admission_wait_seconds",
+    "Time a completion waited for the rate limit admission controller, by whom it was for.",
+    ("priority",),
+)
+LLM_RATE_LIMITED = Counter(
+    "skagents_llm_rate_limited_total",
+    "Completions the deployment answered with 429 Too Many Requests.",
+)
+SEARCH_RESULT_BYTES = Counter(
+    "skagents_search_result_bytes_total",
+    "Bytes of Bing search hits received and sent to the agent after post-processing.",
+    ("site", "stage"),
+)
+SEARCH_RESULT_TOKENS = Counter(
+    "skagents_search_result_tokens_total",
+    "Prompt tokens of Bing search hits received and sent to the agent after post-processing.",
+    ("site", "stage"),
+)
+SEARCH_LOCAL_ANSWERS = Counter(
+    "skagents_search_local_answers_total",
+    "Site searches answered from the local product index, and those sent to Bing because its recall was low.",
+    ("site", "source"),
+)
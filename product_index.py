@@ -0,0 +1,516 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from metrics import SEARCH_LOCAL_ANSWERS
+from search_postprocess import canonical_url
+
+logger = logging.getLogger(__name__)
+
+# directory of the on-disk index built by `python product_index.py ingest`
+PRODUCT_INDEX_DIR = os.getenv("PRODUCT_INDEX_DIR", os.path.join(".cache", "product_index"))
+# answer bing_search from the index when it knows the query well enough; "false" always asks Bing
+PRODUCT_INDEX = os.getenv("PRODUCT_INDEX", "true").lower() in ("1", "true", "yes")
+# a site is answered locally when it has this many pages for the query and one of them
+# contains this share of the query's terms; otherwise its search goes to Bing
+PRODUCT_INDEX_MIN_HITS = int(os.getenv("PRODUCT_INDEX_MIN_HITS", "2"))
+PRODUCT_INDEX_MIN_COVERAGE = float(os.getenv("PRODUCT_INDEX_MIN_COVERAGE", "0.6"))
+# pages returned per site, like Bing's result count
+PRODUCT_INDEX_HITS = int(os.getenv("PRODUCT_INDEX_HITS", "8"))
+# pages are indexed as passages of this many words, so a hit's snippet stays short
+PASSAGE_WORDS = int(os.getenv("PRODUCT_INDEX_PASSAGE_WORDS", "80"))
+MANIFEST = "manifest.json"
+ARRAYS = ("vocabulary", "offsets", "postings", "frequencies", "lengths", "page_ids", "passage_offsets")
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a about am an and any are as at be best by can could do does for from get give have how i if in is it "
+    "like me my need of on or our please some tell than that the their them there these this to us want "
+    "what when which who why will with would you your".split()
+)
+# pages saved by a browser record the address they were saved from
+_SAVED_FROM = re.compile(r"<!--\s*saved from url=\(\d+\)(\S+?)\s*-->", re.IGNORECASE)
+
+
+def _stem(word: str) -> str:
+    # "cards" and "card" are one term
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    """The index terms of a text, in order."""
+    return [_stem(word) for word in _WORD.findall(text.lower())]
+
+
+def query_terms(query: str) -> List[str]:
+    """The distinct terms a query is matched on, without stop words unless it has nothing else."""
+    words = _WORD.findall(query.lower())
+    content = [word for word in words if word not in _STOPWORDS] or words
+    return list(dict.fromkeys(_stem(word) for word in content))
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), "little")
+
+
+def _host(url: str) -> str:
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class _PageParser(HTMLParser):
+    """Title, own URL and readable text of a saved page, without scripts, styles and site navigation."""
+
+    SKIP = {"script", "style", "noscript", "template", "svg", "nav", "header", "footer", "form"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.url: Optional[str] = None
+        self.chunks: List[str] = []
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "link" and "canonical" in (attrs.get("rel") or "").lower().split() and attrs.get("href"):
+            self.url = attrs["href"]
+        elif tag == "meta" and attrs.get("property") == "og:url" and attrs.get("content"):
+            self.url = self.url or attrs["content"]
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip:
+            self._skip -= 1
+        elif tag == "title":
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.chunks.append(data)
+
+
+def parse_page(markup: str, url: Optional[str] = None) -> Optional[Dict]:
+    """The url, title and text of a saved HTML page, or None when its URL is unknown."""
+    parser = _PageParser()
+    parser.feed(markup)
+    parser.close()
+    saved_from = _SAVED_FROM.search(markup[:4096])
+    url = parser.url or (saved_from.group(1) if saved_from else None) or url
+    if not url:
+        return None
+    return {"url": url, "title": " ".join(parser.title.split()), "text": " ".join(" ".join(parser.chunks).split())}
+
+
+def read_pages(paths: Iterable[str], base_url: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Yield the pages saved under paths: .html/.htm files, and .jsonl files with one
+    {"url", "title", "html" or "text"} page per line. A page that names neither a
+    canonical URL nor the address it was saved from gets base_url plus its path
+    under the directory it was found in, and is skipped without one.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            root = path
+            files = sorted(os.path.join(folder, name) for folder, _, names in os.walk(path) for name in names)
+        else:
+            root, files = os.path.dirname(path), [path]
+        for file in files:
+            extension = os.path.splitext(file)[1].lower()
+            if extension in (".html", ".htm"):
+                fallback = None
+                if base_url:
+                    fallback = f"{base_url.rstrip('/')}/{os.path.relpath(file, root).replace(os.sep, '/')}"
+                with open(file, encoding="utf-8", errors="replace") as f:
+                    page = parse_page(f.read(), fallback)
+                if page is None:
+                    logger.warning("skipping %s: no URL, pass --base-url", file)
+                    continue
+                yield page
+            elif extension == ".jsonl":
+                with open(file, encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        if "html" in record:
+                            page = parse_page(record["html"], record["url"])
+                            if record.get("title"):
+                                page["title"] = record["title"]
+                            yield page
+                        else:
+                            yield {"url": record["url"], "title": record.get("title", ""), "text": record.get("text", "")}
+
+
+def write_segment(pages: Iterable[Dict], index_dir: str = PRODUCT_INDEX_DIR) -> Optional[str]:
+    """
+    Index pages into a new segment directory of index_dir and return its name, or
+    None when there was nothing to index. Each page is split into passages of
+    PASSAGE_WORDS words that are scored on their own words and the page title.
+    The segment is written under a temporary name and renamed into place, so
+    readers never see a partial one.
+    """
+    name = f"segment-{time.time_ns()}-{os.getpid()}"
+    tmp = os.path.join(index_dir, f".{name}.tmp")
+    os.makedirs(tmp)
+    hashes: Dict[str, int] = {}
+    page_rows, lengths, page_ids, passage_offsets = [], [], [], []
+    term_list, passage_list, frequency_list = [], [], []
+    with open(os.path.join(tmp, "passages.jsonl"), "wb") as passages:
+        for page in pages:
+            words = page["text"].split()
+            title_terms = terms(page["title"])
+            page_id = len(page_rows)
+            for start in range(0, max(len(words), 1), PASSAGE_WORDS):
+                text = " ".join(words[start:start + PASSAGE_WORDS])
+                counts = Counter(title_terms + terms(text))
+                if not counts:
+                    continue
+                passage_offsets.append(passages.tell())
+                passages.write(json.dumps(text).encode() + b"\n")
+                for term, count in counts.items():
+                    if term not in hashes:
+                        hashes[term] = term_hash(term)
+                    term_list.append(hashes[term])
+                    passage_list.append(len(lengths))
+                    frequency_list.append(count)
+                lengths.append(sum(counts.values()))
+                page_ids.append(page_id)
+            if page_ids and page_ids[-1] == page_id:
+                page_rows.append({"url": page["url"], "title": page["title"], "host": _host(page["url"])})
+        # the end of the last passage
+        passage_offsets.append(passages.tell())
+    if not lengths:
+        shutil.rmtree(tmp)
+        return None
+
+    # postings sorted by term, then passage: one contiguous slice per term
+    term_array = np.array(term_list, dtype=np.uint64)
+    order = np.argsort(term_array, kind="stable")
+    term_array = term_array[order]
+    vocabulary, starts = np.unique(term_array, return_index=True)
+    arrays = {
+        "vocabulary": vocabulary,
+        "offsets": np.append(starts, len(term_array)).astype(np.int64),
+        "postings": np.array(passage_list, dtype=np.int32)[order],
+        "frequencies": np.minimum(np.array(frequency_list), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+        "lengths": np.array(lengths, dtype=np.int32),
+        "page_ids": np.array(page_ids, dtype=np.int32),
+        "passage_offsets": np.array(passage_offsets, dtype=np.int64),
+    }
+    for array_name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{array_name}.npy"), array)
+    with open(os.path.join(tmp, "pages.json"), "w") as f:
+        json.dump(page_rows, f)
+    os.replace(tmp, os.path.join(index_dir, name))
+    return name
+
+
+def read_manifest(index_dir: str = PRODUCT_INDEX_DIR) -> List[str]:
+    try:
+        with open(os.path.join(index_dir, MANIFEST)) as f:
+            return json.load(f)["segments"]
+    except FileNotFoundError:
+        return []
+
+
+def write_manifest(segments: List[str], index_dir: str = PRODUCT_INDEX_DIR):
+    # renamed into place: readers see the old or the new list of segments, never half of one
+    tmp = os.path.join(index_dir, f".{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"segments": segments}, f)
+    os.replace(tmp, os.path.join(index_dir, MANIFEST))
+
+
+class Segment:
+    """One immutable part of the index, its arrays memory-mapped from disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(path, "pages.json")) as f:
+            self.pages: List[Dict] = json.load(f)
+        self.canonical_urls = [canonical_url(page["url"]) for page in self.pages]
+        with open(os.path.join(path, "passages.jsonl"), "rb") as f:
+            self._passages = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._hosts: Dict[str, np.ndarray] = {}
+
+    def postings_of(self, term: np.uint64) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """The passages containing a term and how often they contain it."""
+        i = int(np.searchsorted(self.vocabulary, term))
+        if i == len(self.vocabulary) or self.vocabulary[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.postings[start:end], self.frequencies[start:end]
+
+    def passage(self, passage_id: int) -> str:
+        return json.loads(self._passages[self.passage_offsets[passage_id]:self.passage_offsets[passage_id + 1]])
+
+    def on_site(self, site: str) -> np.ndarray:
+        """Which pages are on site or one of its subdomains, like Bing's site: operator."""
+        mask = self._hosts.get(site)
+        if mask is None:
+            mask = np.array([page["host"] == site or page["host"].endswith(f".{site}") for page in self.pages], dtype=bool)
+            self._hosts[site] = mask
+        return mask
+
+    def live_pages(self, live: np.ndarray) -> Iterator[Dict]:
+        """The pages whose passages are live, their text put back together from the passages."""
+        # the passages of a page are stored together, in order
+        bounds = np.searchsorted(self.page_ids, np.arange(len(self.pages) + 1))
+        for page_id, page in enumerate(self.pages):
+            start, end = bounds[page_id], bounds[page_id + 1]
+            if end > start and live[start]:
+                yield {"url": page["url"], "title": page["title"], "text": " ".join(self.passage(i) for i in range(start, end))}
+
+
+class _View:
+    """
+    The segments of one manifest with their live masks and BM25 statistics.
+    Views are never changed: a new manifest gets a new view, so a search sees
+    one manifest throughout, whatever is ingested meanwhile.
+    """
+
+    def __init__(self, segments: List[Segment]):
+        self.segments = segments
+        # passages of pages that a later segment indexed again are not live; newest first
+        self.live: List[np.ndarray] = [None] * len(segments)
+        seen = set()
+        for i in reversed(range(len(segments))):
+            segment = segments[i]
+            live_pages = np.array([url not in seen for url in segment.canonical_urls], dtype=bool)
+            seen.update(segment.canonical_urls)
+            self.live[i] = live_pages[segment.page_ids]
+        self.passages = sum(int(live.sum()) for live in self.live)
+        total_length = sum(int(segment.lengths[live].sum()) for segment, live in zip(segments, self.live))
+        self.average_length = total_length / self.passages if self.passages else 1.0
+
+
+class ProductIndex:
+    """
+    BM25 search over saved OCBC and UOB product pages, for answering bing_search
+    queries without a web request. The index is a directory of segments, one per
+    ingest, listed in a manifest; a page ingested again hides its copy in older
+    segments. Segment arrays are memory-mapped, so every worker process shares
+    the same page cache, and new segments are picked up when the manifest changes.
+    """
+
+    def __init__(self, index_dir: str = PRODUCT_INDEX_DIR):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._view = _View([])
+
+    def _refresh(self) -> _View:
+        try:
+            mtime = os.stat(os.path.join(self.index_dir, MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._open(read_manifest(self.index_dir))
+                    except Exception:
+                        # keep the previous view until the manifest changes again,
+                        # e.g. after a compact that removed the segments just read
+                        logger.exception("cannot open product index %s", self.index_dir)
+                    self._mtime = mtime
+        return self._view
+
+    def _open(self, names: List[str]):
+        # segments are immutable and shared between views; only the view is replaced
+        opened = {os.path.basename(segment.path): segment for segment in self._view.segments}
+        self._view = _View([opened.get(name) or Segment(os.path.join(self.index_dir, name)) for name in names])
+
+    def live_pages(self) -> Iterator[Dict]:
+        """Every page of the index in its latest copy, oldest segment first."""
+        view = self._refresh()
+        for segment, live in zip(view.segments, view.live):
+            yield from segment.live_pages(live)
+
+    def segments(self) -> List[Segment]:
+        return list(self._refresh().segments)
+
+    def search(self, query: str, sites: Iterable[str], hits: int = PRODUCT_INDEX_HITS) -> Dict[str, Tuple[List[Dict], float]]:
+        """
+        Return, per site, up to hits pages for the query shaped like Bing web pages
+        (name, url and the best passage as snippet), best first, and the largest
+        share of the query's terms one of those passages contains.
+        """
+        sites = list(sites)
+        found = {site: ([], 0.0) for site in sites}
+        # one view throughout, even if a new manifest is opened meanwhile
+        view = self._refresh()
+        words = query_terms(query)
+        if not view.segments or not words:
+            return found
+        hashes = [np.uint64(term_hash(word)) for word in words]
+
+        # live postings of every query term in every segment, and the document frequencies across all of them
+        matches = []
+        frequencies = np.zeros(len(words))
+        for segment, segment_live in zip(view.segments, view.live):
+            postings = []
+            for j, term in enumerate(hashes):
+                posting = segment.postings_of(term)
+                if posting is not None:
+                    live = segment_live[posting[0]]
+                    posting = posting[0][live], posting[1][live]
+                    frequencies[j] += len(posting[0])
+                    postings.append((j, posting))
+            if postings:
+                matches.append((segment, postings))
+        idf = np.log(1 + (view.passages - frequencies + 0.5) / (frequencies + 0.5))
+
+        candidates = {site: [] for site in sites}
+        for segment, postings in matches:
+            passage_ids = np.concatenate([ids for _, (ids, _) in postings])
+            tf = np.concatenate([tfs for _, (_, tfs) in postings]).astype(np.float64)
+            weights = np.concatenate([np.full(len(ids), idf[j]) for j, (ids, _) in postings])
+            norm = _K1 * (1 - _B + _B * segment.lengths[passage_ids] / view.average_length)
+            passage_ids, inverse = np.unique(passage_ids, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights * tf * (_K1 + 1) / (tf + norm))
+            matched = np.bincount(inverse)
+            page_ids = segment.page_ids[passage_ids]
+            order = np.argsort(-scores, kind="stable")
+            for site in sites:
+                on_site = segment.on_site(site)[page_ids[order]]
+                seen = set()
+                # the best passage of each page
+                for i in order[on_site]:
+                    if page_ids[i] in seen:
+                        continue
+                    seen.add(page_ids[i])
+                    candidates[site].append((scores[i], matched[i] / len(words), segment, int(passage_ids[i])))
+                    if len(seen) == hits:
+                        break
+
+        for site in sites:
+            best = sorted(candidates[site], key=lambda candidate: -candidate[0])[:hits]
+            pages = []
+            for _, _, segment, passage_id in best:
+                page = segment.pages[segment.page_ids[passage_id]]
+                pages.append({"name": page["title"], "url": page["url"], "snippet": segment.passage(passage_id)})
+            found[site] = (pages, max((coverage for _, coverage, _, _ in best), default=0.0))
+        return found
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_product_index() -> ProductIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ProductIndex()
+    return _index
+
+
+def local_results(query: str, sites: Iterable[str]) -> Dict[str, List[Dict]]:
+    """
+    The pages of each site the local index answers the query with: sites with at
+    least PRODUCT_INDEX_MIN_HITS pages, one of which contains PRODUCT_INDEX_MIN_COVERAGE
+    of the query's terms. The other sites are left to Bing.
+    """
+    if not PRODUCT_INDEX:
+        return {}
+    try:
+        found = get_product_index().search(query, sites)
+    except Exception:
+        logger.exception("product index search failed, searching Bing")
+        return {}
+    answered = {}
+    for site, (pages, coverage) in found.items():
+        if len(pages) >= PRODUCT_INDEX_MIN_HITS and coverage >= PRODUCT_INDEX_MIN_COVERAGE:
+            answered[site] = pages
+        SEARCH_LOCAL_ANSWERS.inc(site=site, source="index" if site in answered else "web")
+    return answered
+
+
+def ingest(paths: Iterable[str], index_dir: str = PRODUCT_INDEX_DIR, base_url: Optional[str] = None) -> Optional[str]:
+    """
+    Index the pages saved under paths as a new segment; pages indexed before are
+    replaced by their new copy. Run one ingest or compact on an index at a time.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    name = write_segment(read_pages(paths, base_url), index_dir)
+    if name is not None:
+        write_manifest(read_manifest(index_dir) + [name], index_dir)
+    return name
+
+
+def compact(index_dir: str = PRODUCT_INDEX_DIR) -> Optional[str]:
+    """Merge every segment into one without the pages later segments replaced, and delete the old segments."""
+    index = ProductIndex(index_dir)
+    segments = index.segments()
+    if len(segments) < 2:
+        return None
+    name = write_segment(index.live_pages(), index_dir)
+    write_manifest([name] if name else [], index_dir)
+    # processes that still map the old files keep reading them until they refresh
+    for segment in segments:
+        shutil.rmtree(segment.path, ignore_errors=True)
+    return name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query the local index of saved OCBC and UOB product pages.")
+    parser.add_argument("--index-dir", default=PRODUCT_INDEX_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="index saved .html pages and .jsonl crawls as a new segment")
+    ingest_parser.add_argument("paths", nargs="+")
+    ingest_parser.add_argument("--base-url", help="address the pages were saved from, for pages that do not name their URL")
+    commands.add_parser("compact", help="merge the segments into one")
+    search_parser = commands.add_parser("search", help="query the index like bing_search")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--sites", nargs="+", default=["ocbc.com", "uob.com.sg"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "ingest":
+        name = ingest(args.paths, args.index_dir, args.base_url)
+        if name is None:
+            print("no pages found")
+        else:
+            segment = Segment(os.path.join(args.index_dir, name))
+            print(f"{name}: {len(segment.pages)} pages, {len(segment.lengths)} passages, {len(segment.vocabulary)} terms")
+    elif args.command == "compact":
+        print(compact(args.index_dir) or "nothing to compact")
+    else:
+        index = ProductIndex(args.index_dir)
+        start = time.perf_counter()
+        found = index.search(args.query, args.sites)
+        elapsed = time.perf_counter() - start
+        for site, (pages, coverage) in found.items():
+            local = len(pages) >= PRODUCT_INDEX_MIN_HITS and coverage >= PRODUCT_INDEX_MIN_COVERAGE
+            print(f"{site}: {len(pages)} pages, coverage {coverage:.2f}, {'answered locally' if local else 'sent to Bing'}")
+            for page in pages:
+                print(f"  {page['name']} <{page['url']}>\n    {page['snippet'][:160]}")
+        print(f"{elapsed * 1000:.1f} ms")
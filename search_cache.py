@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAXSIZE = int(os.getenv("SEARCH_CACHE_MAXSIZE", "1024"))
+# optional SQLite file that keeps cached results across restarts
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH") or None
+
+_punctuation = re.compile(r"[^\w\s]")
+_whitespace = re.compile(r"\s+")
+
+
+def normalise_query(query: str) -> str:
+    """Lower-case the query and drop punctuation and repeated whitespace."""
+    query = _punctuation.sub(" ", query.lower())
+    return _whitespace.sub(" ", query).strip()
+
+
+class SearchCache:
+    """
+    Process-wide TTL cache for web search results, keyed by site and normalised
+    query. The in-memory tier is a size-bounded LRU; when a path is given, entries
+    are also written to SQLite so they survive restarts.
+    """
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, maxsize: int = SEARCH_CACHE_MAXSIZE, path: Optional[str] = SEARCH_CACHE_PATH):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+            self._db.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(site: str, query: str, variant: str = "") -> str:
+        # variant tells apart results of the same query fetched in another format
+        return f"{site}|{variant}|{normalise_query(query)}"
+
+    def get(self, site: str, query: str, variant: str = "") -> Optional[Any]:
+        key = self.make_key(site, query, variant)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self._store(key, entry)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, site: str, query: str, value: Any, variant: str = ""):
+        key = self.make_key(site, query, variant)
+        entry = (value, time.time() + self.ttl)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), entry[1]),
+                )
+                # the backing file is bounded like the memory tier, dropping the soonest to expire
+                self._db.execute(
+                    "DELETE FROM search_cache WHERE key NOT IN "
+                    "(SELECT key FROM search_cache ORDER BY expires_at DESC LIMIT ?)",
+                    (self.maxsize,),
+                )
+                self._db.commit()
+
+    async def a_get(self, site: str, query: str, variant: str = "") -> Optional[Any]:
+        """get for async code: with a backing file, the SQLite read runs on a worker thread."""
+        if self._db is None:
+            return self.get(site, query, variant)
+        return await asyncio.to_thread(self.get, site, query, variant)
+
+    async def a_set(self, site: str, query: str, value: Any, variant: str = ""):
+        """set for async code: with a backing file, the SQLite write runs on a worker thread."""
+        if self._db is None:
+            return self.set(site, query, value, variant)
+        await asyncio.to_thread(self.set, site, query, value, variant)
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM search_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+
+_cache: Optional[SearchCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SearchCache()
+    return _cache
@@ -0,0 +1,147 @@
+import html
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from tokens import count_tokens
+from metrics import SEARCH_RESULT_BYTES, SEARCH_RESULT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# tokens of search hits each site may put in the agent's context, 0 keeps every hit
+SEARCH_TOKEN_BUDGET = int(os.getenv("SEARCH_TOKEN_BUDGET", "400"))
+# hits whose snippets share this share of their word shingles are one hit
+SEARCH_DEDUPE_SIMILARITY = float(os.getenv("SEARCH_DEDUPE_SIMILARITY", "0.8"))
+
+_TAG = re.compile(r"<[^>]+>")
+# Bing's raw-format hit highlighting markers
+_DECORATIONS = re.compile(r"[\ue000-\ue00f]")
+_SPACE = re.compile(r"\s+")
+_WORD = re.compile(r"[a-z0-9]+")
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+
+def strip_markup(text: str) -> str:
+    """Plain text of an HTML or decorated snippet."""
+    text = _DECORATIONS.sub("", _TAG.sub(" ", text or ""))
+    return _SPACE.sub(" ", html.unescape(text)).strip()
+
+
+def canonical_url(url: str) -> str:
+    """The URL without scheme, www., query, fragment and trailing slash, for spotting the same page twice."""
+    parts = urlsplit(url.strip().lower())
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    return urlunsplit(("", host, parts.path.rstrip("/"), "", ""))
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _shingles(words: List[str], size: int = 3) -> set:
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def bm25_scores(query: str, documents: List[List[str]]) -> List[float]:
+    """BM25 of each tokenised document for the query, with document frequencies from the documents themselves."""
+    terms = set(_words(query))
+    if not documents or not terms:
+        return [0.0] * len(documents)
+    frequencies = Counter(term for document in documents for term in set(document) & terms)
+    average = sum(len(document) for document in documents) / len(documents) or 1
+    scores = []
+    for document in documents:
+        counts = Counter(document)
+        score = 0.0
+        for term in terms:
+            if not counts[term]:
+                continue
+            idf = math.log(1 + (len(documents) - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+            tf = counts[term]
+            score += idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * len(document) / average))
+        scores.append(score)
+    return scores
+
+
+def _hit_tokens(hit: Dict) -> int:
+    return count_tokens(json.dumps(hit))
+
+
+def _site_hits(query: str, pages: List[Dict], budget: int, similarity: float) -> Tuple[List[Dict], int]:
+    """The clean, deduplicated, ranked and budgeted hits of one site, and how many duplicates were dropped."""
+    hits = [
+        {"title": strip_markup(page.get("name", "")), "url": page.get("url", ""), "snippet": strip_markup(page.get("snippet", ""))}
+        for page in pages
+    ]
+    documents = [_words(f"{hit['title']} {hit['snippet']}") for hit in hits]
+    scores = bm25_scores(query, documents)
+    # Bing's own order breaks ties
+    order = sorted(range(len(hits)), key=lambda i: (-scores[i], i))
+
+    kept, seen_urls, seen_shingles, duplicates = [], set(), [], 0
+    for i in order:
+        url = canonical_url(hits[i]["url"])
+        shingles = _shingles(_words(hits[i]["snippet"]) or documents[i])
+        if url in seen_urls or any(len(shingles & other) / len(shingles | other) >= similarity for other in seen_shingles):
+            duplicates += 1
+            continue
+        seen_urls.add(url)
+        seen_shingles.append(shingles)
+        kept.append(hits[i])
+
+    if budget:
+        budgeted, used = [], 0
+        for hit in kept:
+            tokens = _hit_tokens(hit)
+            # the best hit is kept even if it alone is over the budget
+            if budgeted and used + tokens > budget:
+                break
+            budgeted.append(hit)
+            used += tokens
+        kept = budgeted
+    return kept, duplicates
+
+
+def postprocess_results(query: str, site_results: List[List[Dict]], sites: Tuple[str, ...],
+                        budget: int = SEARCH_TOKEN_BUDGET,
+                        similarity: float = SEARCH_DEDUPE_SIMILARITY) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """
+    Turn the Bing web pages of each site into the hits sent to the agent: markup
+    stripped, duplicate URLs and near-identical snippets dropped, ranked by BM25
+    relevance to the query and cut to budget tokens per site.
+
+    Returns the hits and, per site, the hits, bytes and tokens before and after,
+    measured against the title, url and snippet of every page as they used to be
+    sent. The report is also logged and counted in the metrics.
+    """
+    results, report = [], {}
+    for site, pages in zip(sites, site_results):
+        hits, duplicates = _site_hits(query, pages, budget, similarity)
+        results.extend(hits)
+        raw = json.dumps([{"title": page.get("name"), "url": page.get("url"), "snippet": page.get("snippet")} for page in pages])
+        sent = json.dumps(hits)
+        report[site] = {
+            "hits": (len(pages), len(hits)),
+            "duplicates": duplicates,
+            "bytes": (len(raw.encode()), len(sent.encode())),
+            "tokens": (count_tokens(raw), count_tokens(sent)),
+        }
+        SEARCH_RESULT_BYTES.inc(report[site]["bytes"][0], site=site, stage="received")
+        SEARCH_RESULT_BYTES.inc(report[site]["bytes"][1], site=site, stage="sent")
+        SEARCH_RESULT_TOKENS.inc(report[site]["tokens"][0], site=site, stage="received")
+        SEARCH_RESULT_TOKENS.inc(report[site]["tokens"][1], site=site, stage="sent")
+    logger.info("search %r: %s", query, "; ".join(
+        f"{site} {r['hits'][0]}->{r['hits'][1]} hits ({r['duplicates']} duplicates), "
+        f"{r['bytes'][0]}->{r['bytes'][1]} bytes, {r['tokens'][0]}->{r['tokens'][1]} tokens"
+        for site, r in report.items()
+    ))
+    return results, report
@@ -0,0 +1,140 @@
+import asyncio
+import itertools
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from session_store import SESSION_STORE_TTL, SessionStore, get_session_store
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS = os.getenv("CHECKPOINTS", "true").lower() in ("1", "true", "yes")
+# how often queued session updates are written out
+CHECKPOINT_FLUSH_INTERVAL = float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "0.5"))
+
+MESSAGE = "message"
+INPUT = "input"
+CONSUME = "consume"
+DISCARD = "discard"
+
+
+def complete_transcript(messages: List[Dict]) -> List[Dict]:
+    """Drop trailing tool calls whose results were never recorded, which the model would reject."""
+    messages = list(messages)
+    while messages and messages[-1].get("tool_calls"):
+        messages.pop()
+    return messages
+
+
+class SessionCheckpointer:
+    """
+    Write-behind checkpoints of group chat sessions in a SessionStore.
+
+    record(), record_input(), consume_input() and discard() only queue the
+    update; a background task applies everything queued every flush_interval
+    seconds from a worker thread, batching consecutive updates of a session, so
+    the chat never waits on the store. A session that ends with DO_FINISH
+    discards its checkpoint; one whose websocket drops keeps it, and a reconnect
+    with the same id, to this worker or any other sharing the store, loads it back.
+    """
+
+    def __init__(self, store: SessionStore, flush_interval: float = CHECKPOINT_FLUSH_INTERVAL):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.flushes = 0
+        # (operation, chat_id, payload), applied in order
+        self._pending: List[Tuple[str, str, object]] = []
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, chat_id: str, position: int, message: Dict):
+        """The message at position in the transcript; writing it again replaces it."""
+        self._queue(MESSAGE, chat_id, (position, message))
+
+    def record_input(self, chat_id: str, text: str):
+        """A client message the chat has not consumed yet."""
+        self._queue(INPUT, chat_id, text)
+
+    def consume_input(self, chat_id: str, text: str):
+        self._queue(CONSUME, chat_id, text)
+
+    def discard(self, chat_id: str):
+        self._queue(DISCARD, chat_id, None)
+
+    def _queue(self, operation: str, chat_id: str, payload):
+        self._pending.append((operation, chat_id, payload))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("writing session checkpoints failed")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self._write, batch)
+
+    def _write(self, batch: List[Tuple[str, str, object]]):
+        for (operation, chat_id), updates in itertools.groupby(batch, key=lambda update: update[:2]):
+            payloads = [payload for _, _, payload in updates]
+            if operation == MESSAGE:
+                self.store.save_messages(chat_id, payloads)
+                self.written += len(payloads)
+            elif operation == INPUT:
+                self.store.append_inputs(chat_id, payloads)
+            elif operation == CONSUME:
+                self.store.consume_inputs(chat_id, payloads)
+            else:
+                self.store.delete(chat_id)
+        self.flushes += 1
+
+    async def load(self, chat_id: str) -> Tuple[List[Dict], List[str]]:
+        """Return the transcript and unconsumed inputs of a session, including updates not yet written."""
+        await self.flush()
+        messages, inputs = await asyncio.to_thread(self.store.load, chat_id)
+        return complete_transcript(messages), inputs
+
+    async def claim(self, chat_id: str, owner: str) -> Optional[str]:
+        return await asyncio.to_thread(self.store.claim, chat_id, owner)
+
+    async def owner(self, chat_id: str) -> Optional[str]:
+        return await asyncio.to_thread(self.store.owner, chat_id)
+
+    async def release(self, chat_id: str, owner: str):
+        await asyncio.to_thread(self.store.release, chat_id, owner)
+
+    def prune(self, ttl: float = SESSION_STORE_TTL) -> int:
+        return self.store.prune(ttl)
+
+    def stats(self) -> Dict:
+        return {
+            "store": type(self.store).__name__,
+            "pending": len(self._pending),
+            "written": self.written,
+            "flushes": self.flushes,
+        }
+
+
+_checkpointer: Optional[SessionCheckpointer] = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> Optional[SessionCheckpointer]:
+    """Return the process-wide checkpointer, or None when CHECKPOINTS is off."""
+    global _checkpointer
+    if not CHECKPOINTS:
+        return None
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                _checkpointer = SessionCheckpointer(get_session_store())
+    return _checkpointer
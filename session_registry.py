@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "200"))
+# seconds without client traffic after which a session is closed, 0 keeps idle sessions
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "900"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "30"))
+
+# websocket close codes: going away (evicted) and try again later (registry full)
+CLOSE_IDLE = 1001
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class SessionLimitError(Exception):
+    """Raised when the registry already holds max_sessions sessions."""
+
+
+class SessionRegistry:
+    """
+    Live AutogenChat sessions keyed by ws_client_id.
+
+    Registration fails with SessionLimitError once max_sessions are open, so a
+    connection storm is turned away instead of exhausting memory. A reconnect
+    with an id that is still registered replaces (and closes) the old session.
+    Sessions whose client has been silent for idle_timeout seconds are closed
+    by evict_idle, and sessions a reconnect on another worker has claimed by
+    evict_moved; run_eviction calls both periodically.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.rejected = 0
+        self.evicted = 0
+        self.moved = 0
+        self._sessions: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, chat_id: str):
+        return self._sessions.get(chat_id)
+
+    def has_room(self, chat_id: str) -> bool:
+        """Whether a session with this id can be registered; a reconnect always can."""
+        return chat_id in self._sessions or len(self._sessions) < self.max_sessions
+
+    def reject(self):
+        self.rejected += 1
+
+    def register(self, autogen_chat):
+        """Add a session and return the one it replaced, if any."""
+        with self._lock:
+            if not self.has_room(autogen_chat.chat_id):
+                self.rejected += 1
+                raise SessionLimitError(f"{len(self._sessions)} sessions are open, the limit is {self.max_sessions}")
+            previous = self._sessions.get(autogen_chat.chat_id)
+            self._sessions[autogen_chat.chat_id] = autogen_chat
+        return previous
+
+    def remove(self, autogen_chat) -> bool:
+        """Remove a session unless its id has since been taken by a newer session."""
+        with self._lock:
+            if self._sessions.get(autogen_chat.chat_id) is autogen_chat:
+                del self._sessions[autogen_chat.chat_id]
+                return True
+        return False
+
+    def idle_sessions(self, now: Optional[float] = None) -> List:
+        if not self.idle_timeout:
+            return []
+        now = time.monotonic() if now is None else now
+        return [chat for chat in list(self._sessions.values()) if now - chat.last_activity > self.idle_timeout]
+
+    async def evict_idle(self) -> int:
+        evicted = 0
+        for autogen_chat in self.idle_sessions():
+            if self.remove(autogen_chat):
+                evicted += 1
+                logger.info("evicting idle session %s", autogen_chat.chat_id)
+                await autogen_chat.close(code=CLOSE_IDLE, reason="Session idle")
+        self.evicted += evicted
+        return evicted
+
+    async def evict_moved(self) -> int:
+        moved = 0
+        for autogen_chat in list(self._sessions.values()):
+            if await autogen_chat.moved() and self.remove(autogen_chat):
+                moved += 1
+                logger.info("closing session %s, resumed by another connection", autogen_chat.chat_id)
+                await autogen_chat.close(code=CLOSE_IDLE, reason="Resumed by another connection")
+        self.moved += moved
+        return moved
+
+    async def run_eviction(self, interval: float = SESSION_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+                await self.evict_moved()
+            except Exception:
+                logger.exception("idle session sweep failed")
+
+    def describe(self) -> Dict:
+        now = time.monotonic()
+        sessions = [chat.describe(now) for chat in list(self._sessions.values())]
+        return {
+            "sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "moved": self.moved,
+            "memory_bytes": sum(session["memory_bytes"] for session in sessions),
+            "items": sessions,
+        }
@@ -0,0 +1,312 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# "sqlite" (default) shares sessions between the workers of one host, "redis" between hosts,
+# "memory" keeps them in the worker process
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", os.path.join(".cache", "sessions.sqlite"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "skagents:session:")
+# sessions nobody touched for this many seconds are deleted
+SESSION_STORE_TTL = float(os.getenv("SESSION_STORE_TTL", os.getenv("CHECKPOINT_TTL", str(24 * 3600))))
+
+# identifies this worker process in session owner tokens
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SessionStore(ABC):
+    """
+    Session state shared by the workers that may serve a websocket client:
+    the group chat transcript, client inputs the chat has not consumed yet, and
+    the owner token of the connection currently serving the session.
+
+    Methods block; the checkpointer calls them from a worker thread.
+    """
+
+    @abstractmethod
+    def save_messages(self, chat_id: str, messages: List[Tuple[int, Dict]]):
+        """Store transcript messages at their positions, replacing what was there."""
+
+    @abstractmethod
+    def append_inputs(self, chat_id: str, inputs: List[str]):
+        ...
+
+    @abstractmethod
+    def consume_inputs(self, chat_id: str, inputs: List[str]):
+        """Drop the oldest pending copy of each input."""
+
+    @abstractmethod
+    def load(self, chat_id: str) -> Tuple[List[Dict], List[str]]:
+        """Return the transcript and the pending inputs of a session."""
+
+    @abstractmethod
+    def delete(self, chat_id: str):
+        ...
+
+    @abstractmethod
+    def claim(self, chat_id: str, owner: str) -> Optional[str]:
+        """Make owner serve the session and return the previous owner."""
+
+    @abstractmethod
+    def owner(self, chat_id: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def release(self, chat_id: str, owner: str):
+        """Clear the owner, unless another connection has claimed the session since."""
+
+    def prune(self, ttl: float = SESSION_STORE_TTL) -> int:
+        return 0
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions in this process only; a reconnect must reach the same worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._messages: Dict[str, Dict[int, Dict]] = defaultdict(dict)
+        self._inputs: Dict[str, List[str]] = defaultdict(list)
+        self._owners: Dict[str, str] = {}
+        self._updated: Dict[str, float] = {}
+
+    def save_messages(self, chat_id, messages):
+        with self._lock:
+            self._messages[chat_id].update(messages)
+            self._updated[chat_id] = time.time()
+
+    def append_inputs(self, chat_id, inputs):
+        with self._lock:
+            self._inputs[chat_id].extend(inputs)
+            self._updated[chat_id] = time.time()
+
+    def consume_inputs(self, chat_id, inputs):
+        with self._lock:
+            pending = self._inputs.get(chat_id, [])
+            for text in inputs:
+                if text in pending:
+                    pending.remove(text)
+
+    def load(self, chat_id):
+        with self._lock:
+            messages = self._messages.get(chat_id, {})
+            return [messages[position] for position in sorted(messages)], list(self._inputs.get(chat_id, ()))
+
+    def delete(self, chat_id):
+        with self._lock:
+            for table in (self._messages, self._inputs, self._owners, self._updated):
+                table.pop(chat_id, None)
+
+    def claim(self, chat_id, owner):
+        with self._lock:
+            previous = self._owners.get(chat_id)
+            self._owners[chat_id] = owner
+            self._updated[chat_id] = time.time()
+        return previous
+
+    def owner(self, chat_id):
+        return self._owners.get(chat_id)
+
+    def release(self, chat_id, owner):
+        with self._lock:
+            if self._owners.get(chat_id) == owner:
+                del self._owners[chat_id]
+
+    def prune(self, ttl=SESSION_STORE_TTL):
+        cutoff = time.time() - ttl
+        stale = [chat_id for chat_id, updated in list(self._updated.items()) if updated < cutoff]
+        for chat_id in stale:
+            self.delete(chat_id)
+        return len(stale)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Sessions in a SQLite file in WAL mode, shared by every worker process on the
+    host. Each thread keeps its own connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (chat_id TEXT PRIMARY KEY, owner TEXT, updated REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS session_messages (chat_id TEXT NOT NULL, position INTEGER NOT NULL, body TEXT NOT NULL, PRIMARY KEY (chat_id, position));
+        CREATE TABLE IF NOT EXISTS session_inputs (seq INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, body TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_session_inputs_chat_id ON session_inputs (chat_id, seq);
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn: sqlite3.Connection, chat_id: str):
+        conn.execute(
+            "INSERT INTO sessions (chat_id, updated) VALUES (?, ?) ON CONFLICT (chat_id) DO UPDATE SET updated = excluded.updated",
+            (chat_id, time.time()),
+        )
+
+    def save_messages(self, chat_id, messages):
+        with self._connection() as conn:
+            self._touch(conn, chat_id)
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_messages (chat_id, position, body) VALUES (?, ?, ?)",
+                [(chat_id, position, json.dumps(message, default=str)) for position, message in messages],
+            )
+
+    def append_inputs(self, chat_id, inputs):
+        with self._connection() as conn:
+            self._touch(conn, chat_id)
+            conn.executemany("INSERT INTO session_inputs (chat_id, body) VALUES (?, ?)", [(chat_id, text) for text in inputs])
+
+    def consume_inputs(self, chat_id, inputs):
+        with self._connection() as conn:
+            conn.executemany(
+                "DELETE FROM session_inputs WHERE seq = (SELECT min(seq) FROM session_inputs WHERE chat_id = ? AND body = ?)",
+                [(chat_id, text) for text in inputs],
+            )
+
+    def load(self, chat_id):
+        conn = self._connection()
+        messages = [json.loads(body) for body, in conn.execute(
+            "SELECT body FROM session_messages WHERE chat_id = ? ORDER BY position", (chat_id,))]
+        inputs = [body for body, in conn.execute(
+            "SELECT body FROM session_inputs WHERE chat_id = ? ORDER BY seq", (chat_id,))]
+        return messages, inputs
+
+    def delete(self, chat_id):
+        with self._connection() as conn:
+            for table in ("session_messages", "session_inputs", "sessions"):
+                conn.execute(f"DELETE FROM {table} WHERE chat_id = ?", (chat_id,))
+
+    def claim(self, chat_id, owner):
+        with self._connection() as conn:
+            # taken before reading, so two workers claiming at once see each other
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+            conn.execute(
+                "INSERT INTO sessions (chat_id, owner, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET owner = excluded.owner, updated = excluded.updated",
+                (chat_id, owner, time.time()),
+            )
+        return row[0] if row else None
+
+    def owner(self, chat_id):
+        row = self._connection().execute("SELECT owner FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    def release(self, chat_id, owner):
+        with self._connection() as conn:
+            conn.execute("UPDATE sessions SET owner = NULL WHERE chat_id = ? AND owner = ?", (chat_id, owner))
+
+    def prune(self, ttl=SESSION_STORE_TTL):
+        cutoff = time.time() - ttl
+        conn = self._connection()
+        stale = [chat_id for chat_id, in conn.execute("SELECT chat_id FROM sessions WHERE updated < ?", (cutoff,))]
+        for chat_id in stale:
+            self.delete(chat_id)
+        return len(stale)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis, shared by workers on any host. Every key of a session
+    expires ttl seconds after its last write, so prune has nothing to do.
+    """
+
+    # releases the owner only if it is still ours
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX, ttl: float = SESSION_STORE_TTL):
+        if redis is None:
+            raise RuntimeError("SESSION_STORE=redis needs the redis package")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        self._release = self.client.register_script(self.RELEASE_SCRIPT)
+
+    def _key(self, chat_id: str, part: str) -> str:
+        return f"{self.prefix}{chat_id}:{part}"
+
+    def save_messages(self, chat_id, messages):
+        key = self._key(chat_id, "messages")
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={position: json.dumps(message, default=str) for position, message in messages})
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def append_inputs(self, chat_id, inputs):
+        key = self._key(chat_id, "inputs")
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *inputs)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def consume_inputs(self, chat_id, inputs):
+        pipe = self.client.pipeline()
+        for text in inputs:
+            pipe.lrem(self._key(chat_id, "inputs"), 1, text)
+        pipe.execute()
+
+    def load(self, chat_id):
+        pipe = self.client.pipeline()
+        pipe.hgetall(self._key(chat_id, "messages"))
+        pipe.lrange(self._key(chat_id, "inputs"), 0, -1)
+        messages, inputs = pipe.execute()
+        return [json.loads(messages[position]) for position in sorted(messages, key=int)], inputs
+
+    def delete(self, chat_id):
+        self.client.delete(*(self._key(chat_id, part) for part in ("messages", "inputs", "owner")))
+
+    def claim(self, chat_id, owner):
+        pipe = self.client.pipeline()
+        pipe.getset(self._key(chat_id, "owner"), owner)
+        pipe.expire(self._key(chat_id, "owner"), self.ttl)
+        return pipe.execute()[0]
+
+    def owner(self, chat_id):
+        return self.client.get(self._key(chat_id, "owner"))
+
+    def release(self, chat_id, owner):
+        self._release(keys=[self._key(chat_id, "owner")], args=[owner])
+
+
+_session_store: Optional[SessionStore] = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Return the process-wide session store selected by SESSION_STORE."""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                if SESSION_STORE == "memory":
+                    _session_store = MemorySessionStore()
+                elif SESSION_STORE == "redis":
+                    _session_store = RedisSessionStore()
+                elif SESSION_STORE == "sqlite":
+                    _session_store = SqliteSessionStore()
+                else:
+                    raise ValueError(f"Unknown SESSION_STORE: {SESSION_STORE}")
+    return _session_store
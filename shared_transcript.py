@@ -0,0 +1,76 @@
+from collections.abc import Sequence
+from typing import Dict, List
+
+# the keys autogen keeps when it appends a received message to an agent's history
+_OAI_KEYS = ("content", "function_call", "tool_calls", "tool_responses", "tool_call_id", "name", "context")
+
+
+class TranscriptView(Sequence):
+    """
+    One agent's read-only view of the shared, append-only group chat transcript.
+
+    The view stands in for ``agent._oai_messages[manager]``: instead of every agent
+    holding its own copy of each broadcast message, the manager appends a message
+    to ``groupchat.messages`` once and each view renders it on access with the role
+    autogen would have given it for that agent ("assistant" for the agent's own
+    messages, "user" for everyone else's, tool and function roles unchanged).
+    """
+
+    def __init__(self, transcript: List[Dict], agent_name: str):
+        self.transcript = transcript
+        self.agent_name = agent_name
+
+    def _as_seen(self, message: Dict) -> Dict:
+        seen = {k: message[k] for k in _OAI_KEYS if k in message and message[k] is not None}
+        if "content" not in seen:
+            seen["content"] = None
+        if message.get("role") in ("function", "tool"):
+            seen["role"] = message["role"]
+        elif seen.get("function_call") or seen.get("tool_calls"):
+            seen["role"] = "assistant"
+        elif seen.get("name") == self.agent_name:
+            seen["role"] = "assistant"
+        else:
+            seen["role"] = "user"
+        return seen
+
+    def __len__(self) -> int:
+        return len(self.transcript)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._as_seen(message) for message in self.transcript[index]]
+        return self._as_seen(self.transcript[index])
+
+    def __iter__(self):
+        return (self._as_seen(message) for message in self.transcript)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return list(self)
+
+    def copy(self) -> List[Dict]:
+        return list(self)
+
+    def append(self, message):
+        # the manager owns the transcript; an agent's own sends are added there once
+        pass
+
+    def clear(self):
+        # clearing is done on the transcript itself through GroupChat.reset()
+        pass
+
+
+def attach_transcript(manager, groupchat):
+    """Point every participant's history with the manager at the shared transcript."""
+    for agent in groupchat.agents:
+        if not isinstance(agent._oai_messages.get(manager), TranscriptView):
+            agent._oai_messages[manager] = TranscriptView(groupchat.messages, agent.name)
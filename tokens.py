@@ -0,0 +1,44 @@
+import threading
+from typing import Optional
+
+# the estimate used when tiktoken or its encoding file is not available
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """tiktoken's cl100k_base, or False without tiktoken; tiktoken is imported by the first call."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    # no tiktoken, or its encoding file cannot be fetched
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Count tokens with tiktoken's cl100k_base, or estimate four characters per token without it."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens tokens, marking the cut with "..."."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + "..."
+    return text[:max_tokens * CHARS_PER_TOKEN] + "..."